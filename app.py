@@ -6,10 +6,12 @@
 import streamlit as st
 import os
 import json
+import uuid
 from datetime import datetime
 from document_manager import DocumentManager
-from rag_system import DualVectorStoreRAG
-from utils import format_file_size, get_directory_size, safe_remove_file
+from rag_system import create_rag_from_env
+from service import RAGService, WarmingUpError
+from utils import format_file_size, safe_remove_file, is_valid_user_id
 
 # 页面配置
 st.set_page_config(
@@ -20,7 +22,7 @@ st.set_page_config(
 )
 
 st.title("📑 McMaster Academic Knowledge QA System V1.0")
-st.markdown(f"Based on default and user uploaded course materials and RAG. \n First launch may cause a few minutes.")
+st.markdown(f"Based on default and user uploaded course materials and RAG. \n First launch may take a few minutes to load the course materials; you can upload documents meanwhile.")
 
 
 # ==================== 配置加载 ====================
@@ -104,25 +106,83 @@ def load_config():
 
 # ==================== 初始化 RAG 系统 ====================
 @st.cache_resource
-def initialize_rag_system():
-    """初始化双向量库 RAG 系统（基础库缓存）"""
-    rag = DualVectorStoreRAG()
+def initialize_rag_service():
+    """初始化 RAG 服务（进程内所有会话共享，基础库缓存）"""
+    service = RAGService(create_rag_from_env())
     
-    # 初始化基础向量库（缓存）
-    with st.spinner("📚 正在初始化基础知识库..."):
-        base_doc_count = rag.initialize_base_vectorstore()
+    # 基础向量库在后台线程加载，页面无需等待即可渲染
+    service.start_warmup()
     
-    # 初始化用户向量库（不缓存，动态）
-    rag.initialize_user_vectorstore()
+    # 用户向量库按用户分区，在首次使用时懒加载
     
-    return rag, base_doc_count
+    return service
+
+
+WARMUP_PHASES = {
+    "starting": "准备中",
+    "installing_artifact": "安装预构建向量库",
+    "opening": "打开向量库",
+    "building": "从课程材料构建向量库",
+}
+
+
+def describe_warmup(status: dict) -> str:
+    """把基础库加载状态格式化为一行提示"""
+    text = f"⏳ 基础知识库加载中：{WARMUP_PHASES.get(status.get('phase'), status.get('phase') or '')}"
+    if status.get("phase") == "building" and status.get("chunks") is not None:
+        text += f"（{status['chunks']} 个文本块）"
+    if status.get("elapsed_seconds") is not None:
+        text += f"，已用 {status['elapsed_seconds']:.0f} 秒"
+    return text
+
+
+def render_warmup_status(rag_service: RAGService):
+    """显示基础库加载状态；加载期间每 2 秒刷新，完成后重新运行整个页面"""
+    
+    @st.fragment(run_every=None if rag_service.is_ready else 2)
+    def warmup_status():
+        status = rag_service.warmup_status()
+        if status["state"] == "ready":
+            if st.session_state.pop("warmup_seen_loading", False):
+                # 加载完成：刷新整个页面，课程过滤等依赖基础库的控件才会显示完整内容
+                st.rerun(scope="app")
+            if status["base_doc_count"]:
+                st.success(f"✌️ System All Set!  {status['base_doc_count']} default docs loaded!")
+            else:
+                st.warning("⚠️ 基础知识库为空或加载失败，请查看日志")
+        elif status["state"] == "failed":
+            st.warning(f"⚠️ 基础知识库加载失败，只能基于上传的文档回答：{status['error']}")
+        else:
+            st.session_state.warmup_seen_loading = True
+            st.progress(status["progress"] or 0.0, text=describe_warmup(status))
+    
+    warmup_status()
+
+
+# ==================== 用户标识 ====================
+def get_user_id():
+    """
+    获取当前用户 ID
+    
+    ID 保存在 URL 查询参数 uid 中，刷新页面或收藏链接后仍对应同一个用户分区。
+    uid 就是访问分区的凭据，只接受应用签发的随机 uuid4，其他值（可猜测的短 ID 等）一律重新签发
+    """
+    if 'user_id' not in st.session_state:
+        user_id = st.query_params.get("uid")
+        if not is_valid_user_id(user_id):
+            user_id = uuid.uuid4().hex
+            st.query_params["uid"] = user_id
+        st.session_state.user_id = user_id
+    return st.session_state.user_id
 
 
 # ==================== 初始化文档管理器 ====================
-def get_document_manager():
-    """获取文档管理器实例"""
+def get_document_manager(user_id: str):
+    """获取文档管理器实例（每个用户独立的上传目录）"""
     if 'doc_manager' not in st.session_state:
-        st.session_state.doc_manager = DocumentManager()
+        st.session_state.doc_manager = DocumentManager(
+            upload_dir=os.path.join("UserUploads", user_id)
+        )
     return st.session_state.doc_manager
 
 
@@ -132,12 +192,13 @@ def main():
         # 加载配置
         config = load_config()
         
-        # 初始化 RAG 系统
-        rag_system, base_doc_count = initialize_rag_system()
-        st.success(f"✌️ System All Set!  {base_doc_count} default docs loaded!")
+        # 初始化 RAG 服务（基础库在后台加载，这里只显示加载状态）
+        rag_service = initialize_rag_service()
+        render_warmup_status(rag_service)
         
-        # 初始化文档管理器
-        doc_manager = get_document_manager()
+        # 初始化用户标识和文档管理器
+        user_id = get_user_id()
+        doc_manager = get_document_manager(user_id)
         
         # 初始化会话状态
         if 'qa_history' not in st.session_state:
@@ -233,12 +294,14 @@ def main():
                             
                             # 阶段2: 索引到向量库
                             st.write("🔢 正在向量化文档...")
-                            index_success, index_message, chunk_count = rag_system.add_user_document(
+                            index_success, index_message, chunk_count = rag_service.run(rag_service.ingest(
                                 file_path=metadata['filepath'],
                                 original_filename=metadata['original_filename'],
                                 upload_time=metadata['upload_time'],
-                                file_size=metadata['size']
-                            )
+                                file_size=metadata['size'],
+                                file_id=metadata['file_id'],
+                                user_id=user_id
+                            ))
                             
                             if not index_success:
                                 # 索引失败，清理已保存的文件
@@ -333,7 +396,25 @@ def main():
                         
                         with col1:
                             st.markdown(f"**📄 {doc['original_filename']}**")
-                        
+                            # 分批索引的大文档显示索引覆盖率
+                            coverage = rag_service.rag.get_indexing_coverage(doc['file_id'], user_id=user_id)
+                            if coverage and coverage['status'] != "complete":
+                                done, total = coverage['pages_indexed'], coverage['total_pages']
+                                if coverage['status'] == "indexing":
+                                    st.progress(done / total, text=f"⏳ 索引中 {done}/{total} 页（已索引的页面可以提问）")
+                                else:
+                                    st.warning(f"⚠️ 仅索引了 {done}/{total} 页")
+                                    if st.button("🔄 继续索引", key=f"resume_{doc['file_id']}"):
+                                        _, resume_message = rag_service.rag.resume_user_document(
+                                            file_path=doc['filepath'],
+                                            original_filename=doc['original_filename'],
+                                            upload_time=doc['upload_time'],
+                                            file_size=doc['size'],
+                                            file_id=doc['file_id'],
+                                            user_id=user_id
+                                        )
+                                        st.info(resume_message)
+
                         with col2:
                             st.text(f"📦 {doc['size_formatted']}")
                         
@@ -346,9 +427,10 @@ def main():
                                 file_success, file_message = doc_manager.delete_document(doc['file_id'])
                                 
                                 # 从向量库删除
-                                vec_success, vec_message = rag_system.remove_user_document(
-                                    doc['original_filename']
-                                )
+                                vec_success, vec_message = rag_service.run(rag_service.remove_document(
+                                    doc['file_id'],
+                                    user_id=user_id
+                                ))
                                 
                                 if file_success:
                                     st.success(file_message)
@@ -373,6 +455,13 @@ def main():
             key="question_input"
         )
         
+        # 可选的课程过滤：不选择时按问题内容自动选择最相关的课程
+        selected_courses = st.multiselect(
+            "📚 Limit to courses (optional)",
+            options=rag_service.rag.get_base_courses(),
+            key="course_filter"
+        )
+        
         col1, col2, col3 = st.columns([1, 1, 4])
         with col1:
             ask_button = st.button("Shoot", type="primary", use_container_width=True)
@@ -381,25 +470,37 @@ def main():
                 st.session_state.qa_history = []
                 st.rerun()
         
-        if ask_button and question.strip():
+        if ask_button and question.strip() and not rag_service.is_ready:
+            # 基础库加载期间不阻塞页面：问题排队，加载完成后页面整体刷新时自动回答
+            st.session_state.pending_question = (question.strip(), selected_courses or None)
+        
+        pending = st.session_state.get("pending_question")
+        if pending and not rag_service.is_ready:
+            st.info(f"{describe_warmup(rag_service.warmup_status())}。问题已排队，加载完成后自动回答")
+        elif (ask_button and question.strip()) or pending:
+            asked, courses = st.session_state.pop("pending_question", None) or (question.strip(), selected_courses or None)
             with st.spinner("(ー_ーゞ thinking~~~"):
                 try:
-                    # 创建 RAG 链并查询
-                    rag_chain = rag_system.create_rag_chain(k=3)
-                    response = rag_chain.invoke(question)
+                    # 提交给 RAG 服务查询
+                    answer = rag_service.run(rag_service.ask(
+                        asked, user_id=user_id, courses=courses
+                    ))
                     
                     # 保存到历史记录
                     qa_entry = {
                         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'question': question.strip(),
-                        'answer': response.content
+                        'question': asked,
+                        'answer': answer
                     }
                     st.session_state.qa_history.append(qa_entry)
                     
                     # 显示当前回答
                     st.markdown("### Answer")
-                    st.info(response.content)
+                    st.info(answer)
                     
+                except WarmingUpError as e:
+                    st.session_state.pending_question = (asked, courses)
+                    st.info(f"{describe_warmup(e.status)}。问题已排队，加载完成后自动回答")
                 except Exception as e:
                     st.error(f"😭 Get an error: {str(e)}")
         
@@ -467,18 +568,45 @@ def main():
             
             st.divider()
             
-            # 存储使用情况
+            # 存储使用情况（由文档管理器增量维护，不遍历上传目录）
             try:
-                upload_dir = "UserUploads"
-                if os.path.exists(upload_dir):
-                    total_size = get_directory_size(upload_dir)
-                    st.metric(
-                        label="📊 Data Uploaded",
-                        value=format_file_size(total_size)
-                    )
+                st.metric(
+                    label="📊 Data Uploaded",
+                    value=format_file_size(doc_manager.get_total_size())
+                )
             except:
                 pass
             
+            cache_stats = rag_service.rag.get_query_cache_stats()
+            if cache_stats['hits'] + cache_stats['misses'] > 0:
+                st.caption(
+                    f"⚡ Query embedding cache: {cache_stats['hit_rate']:.0%} hit rate "
+                    f"({cache_stats['size']}/{cache_stats['max_size']} entries)"
+                )
+            
+            cascade_stats = rag_service.rag.get_cascade_stats()
+            if cascade_stats['questions'] > 0:
+                tier_latency = ", ".join(
+                    f"{name} {tier['avg_seconds']:.1f}s"
+                    for name, tier in cascade_stats['tiers'].items() if tier['calls']
+                )
+                st.caption(
+                    f"🪜 Model cascade: {cascade_stats['escalation_rate']:.0%} escalated ({tier_latency})"
+                )
+            
+            latency_stats = rag_service.rag.get_latency_stats()
+            hedged = latency_stats['embed']['hedged'] + sum(tier['hedged'] for tier in latency_stats['llm'].values())
+            degraded = latency_stats['base_search']['timeouts'] + latency_stats['user_search']['timeouts']
+            if hedged or degraded:
+                st.caption(f"⏱️ Tail latency: {hedged} hedged requests, {degraded} searches skipped after deadline")
+
+            coalescing_stats = rag_service.rag.get_coalescing_stats()
+            if coalescing_stats['coalesced'] > 0:
+                st.caption(
+                    f"🤝 Coalesced questions: {coalescing_stats['coalesced']}/{coalescing_stats['requests']} "
+                    f"({coalescing_stats['coalescing_ratio']:.0%}) shared an in-flight answer"
+                )
+            
             st.markdown("---")
             st.caption("🔔 Note: Initial document loading and vectorization may take a few moments on first use.")
     
@@ -0,0 +1,202 @@
+"""
+批量问答模块
+从 JSONL 文件读取问题，批量检索并以有限并发调用 LLM，把答案写入 JSONL 文件
+
+用法：
+    python batch_qa.py questions.jsonl answers.jsonl --concurrency 8
+
+输入每行一个 JSON 对象，必须包含 "question" 字段，可选 "id" 字段；
+输出每行包含 id、question、answer、tier（回答的模型级别）、error 和 timings（秒）。
+"""
+
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence
+from langchain_core.prompts import ChatPromptTemplate
+from rag_system import DualVectorStoreRAG, DEFAULT_USER_ID, DEFAULT_TOP_K, create_rag_from_env, RAG_PROMPT_TEMPLATE
+from utils import ensure_openai_api_key
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(input_path: str) -> Iterator[Dict]:
+    """
+    读取 JSONL 问题文件
+
+    Args:
+        input_path: 输入文件路径
+
+    Yields:
+        {"id": ..., "question": ...}，缺少 id 时使用行号；
+        无法解析、不是 JSON 对象或 question 不是非空字符串的行记录警告后跳过
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping line {line_no}: invalid JSON ({e})")
+                continue
+            if not isinstance(item, dict):
+                logger.warning(f"Skipping line {line_no}: expected a JSON object, got {type(item).__name__}")
+                continue
+            question = item.get("question")
+            if not isinstance(question, str) or not question.strip():
+                logger.warning(f"Skipping line {line_no}: missing or non-string question")
+                continue
+            yield {"id": item.get("id", line_no), "question": question}
+
+
+def answer_questions(
+    rag: DualVectorStoreRAG,
+    items: List[Dict],
+    k: int = DEFAULT_TOP_K,
+    user_id: str = DEFAULT_USER_ID,
+    max_concurrency: int = 8,
+    courses: Optional[Sequence[str]] = None
+) -> List[Dict]:
+    """
+    批量回答一组问题
+
+    所有问题的 embedding 合并为一次请求，每个向量库只做一次多查询检索；
+    回答经过模型级联（见 model_cascade.py），LLM 调用以 max_concurrency 为上限并发执行
+
+    Args:
+        rag: 已初始化的 RAG 系统
+        items: [{"id": ..., "question": ...}, ...]
+        k: 检索的文档总数（基础库和用户库合并）
+        user_id: 检索哪个用户的向量库分区
+        max_concurrency: LLM 并发调用上限
+        courses: 只检索这些课程的资料，None 表示自动路由
+
+    Returns:
+        与输入顺序一致的结果列表
+    """
+    questions = [item["question"] for item in items]
+
+    t0 = time.perf_counter()
+    contexts = []
+    top_scores = []
+    for scored in rag.batch_retrieve_scored(questions, k=k, user_id=user_id, courses=courses):
+        contexts.append(rag.format_context([doc for doc, _ in scored]))
+        top_scores.append(max((score for _, score in scored), default=None))
+    retrieve_seconds = time.perf_counter() - t0
+
+    prompt = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+
+    def answer_one(index: int) -> Dict:
+        item = items[index]
+        result = {"id": item["id"], "question": item["question"], "answer": None, "tier": None, "error": None}
+        t1 = time.perf_counter()
+        try:
+            prompt_value = prompt.invoke({
+                "context": contexts[index],
+                "question": item["question"]
+            })
+            # 与交互问答一致：按检索置信度和上下文长度选择模型级别，带截止时间和对冲请求
+            response = rag.cascade.invoke(prompt_value, top_scores[index], len(contexts[index]))
+            result["answer"] = response.content
+            result["tier"] = response.response_metadata.get("cascade_tier")
+        except Exception as e:
+            result["error"] = str(e)
+        result["timings"] = {
+            # 检索为整批共享的耗时
+            "batch_retrieve": round(retrieve_seconds, 4),
+            "llm": round(time.perf_counter() - t1, 4),
+        }
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        return list(executor.map(answer_one, range(len(items))))
+
+
+def run_batch(
+    rag: DualVectorStoreRAG,
+    input_path: str,
+    output_path: str,
+    k: int = DEFAULT_TOP_K,
+    user_id: str = DEFAULT_USER_ID,
+    max_concurrency: int = 8,
+    batch_size: int = 64,
+    courses: Optional[Sequence[str]] = None
+) -> Dict:
+    """
+    处理整个问题文件，按 batch_size 分批检索，每批完成后立即写出结果
+
+    Args:
+        rag: 已初始化的 RAG 系统
+        input_path: 输入 JSONL 文件
+        output_path: 输出 JSONL 文件
+        k: 检索的文档总数（基础库和用户库合并）
+        user_id: 检索哪个用户的向量库分区
+        max_concurrency: LLM 并发调用上限
+        batch_size: 每批问题数量
+        courses: 只检索这些课程的资料，None 表示自动路由
+
+    Returns:
+        {"total", "failed", "seconds"}
+    """
+    start = time.perf_counter()
+    total = failed = 0
+    batch: List[Dict] = []
+
+    with open(output_path, 'w', encoding='utf-8') as out:
+        def flush():
+            nonlocal total, failed
+            for result in answer_questions(rag, batch, k, user_id, max_concurrency, courses):
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                total += 1
+                failed += result["error"] is not None
+            out.flush()
+            batch.clear()
+
+        for item in read_questions(input_path):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    return {"total": total, "failed": failed, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the RAG system")
+    parser.add_argument("input", help="输入 JSONL 文件（每行包含 question 字段）")
+    parser.add_argument("output", help="输出 JSONL 文件")
+    parser.add_argument("--k", type=int, default=DEFAULT_TOP_K, help="检索的文档总数")
+    parser.add_argument("--user-id", default=DEFAULT_USER_ID, help="同时检索该用户的上传文档")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM 并发调用上限")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批检索的问题数量")
+    parser.add_argument("--course", action="append", dest="courses", help="只检索指定课程（可重复），默认自动路由")
+    args = parser.parse_args()
+
+    if not ensure_openai_api_key():
+        print("❌ 未找到 OpenAI API Key（环境变量 OPENAI_API_KEY 或 config.json）", file=sys.stderr)
+        sys.exit(1)
+
+    rag = create_rag_from_env()
+    rag.initialize_base_vectorstore()
+
+    summary = run_batch(
+        rag,
+        args.input,
+        args.output,
+        k=args.k,
+        user_id=args.user_id,
+        max_concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        courses=args.courses
+    )
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
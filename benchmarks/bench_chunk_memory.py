@@ -0,0 +1,107 @@
+"""
+文本块内存基准测试
+比较两种表示在加载并切分整个语料时的峰值内存（tracemalloc）：
+
+- documents：每页一个 LangChain Document（各自的元数据 dict），split_documents 为每个文本块复制元数据
+- records：紧凑的页面/文本块记录（__slots__），文件级元数据驻留在 MetadataTable 中，
+  文本块只保存偏移量
+
+两种方式都保留全部文本块（相当于 loadAndIndexFiles 的最坏情况）。
+先预热页面缓存，计时和内存统计不包含 PDF 解析本身。
+
+用法：
+    python benchmarks/bench_chunk_memory.py --docs CourseMaterials
+"""
+
+import os
+import sys
+import gc
+import time
+import json
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_records import MetadataTable, split_page_records
+from offset_splitter import OffsetTextSplitter
+from page_cache import PageTextCache
+from pdf_loader import load_pdf_file, load_pdf_pages, create_text_splitter
+
+
+def list_pdfs(docs_dir: str) -> list:
+    paths = []
+    for root, _, files in os.walk(docs_dir):
+        paths.extend(os.path.join(root, f) for f in files if f.endswith('.pdf'))
+    return sorted(paths)
+
+
+def run_documents(paths: list, page_cache: PageTextCache, metadata: dict) -> int:
+    splitter = create_text_splitter()
+    pages = []
+    for path in paths:
+        pages.extend(load_pdf_file(path, "user", metadata, page_cache))
+    chunks = splitter.split_documents(pages)
+    return len(chunks)
+
+
+def run_records(paths: list, page_cache: PageTextCache, metadata: dict) -> int:
+    splitter = OffsetTextSplitter()
+    table = MetadataTable()
+    pages = []
+    for path in paths:
+        pages.extend(load_pdf_pages(path, table, "user", metadata, page_cache))
+    chunks = list(split_page_records(pages, splitter))
+    return len(chunks)
+
+
+def measure(func, *args) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    chunks = func(*args)
+    seconds = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "chunks": chunks,
+        "peak_mb": round(peak / 2**20, 2),
+        "bytes_per_chunk": round(peak / max(1, chunks)),
+        "seconds": round(seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure peak memory of chunk representations")
+    parser.add_argument("--docs", default="CourseMaterials", help="语料 PDF 目录")
+    parser.add_argument("--cache-dir", default="./.cache/pages", help="页面缓存目录")
+    args = parser.parse_args()
+
+    paths = list_pdfs(args.docs)
+    page_cache = PageTextCache(args.cache_dir)
+    # 用户上传文档的典型额外元数据
+    metadata = {
+        "file_id": "20250101_000000_example.pdf",
+        "original_filename": "example.pdf",
+        "upload_time": "2025-01-01 00:00:00",
+        "file_size": 1048576,
+    }
+
+    # 预热页面缓存
+    for path in paths:
+        try:
+            load_pdf_file(path, page_cache=page_cache)
+        except Exception as e:
+            print(f"skip {path}: {e}", file=sys.stderr)
+            paths = [p for p in paths if p != path]
+
+    results = {
+        "documents": measure(run_documents, paths, page_cache, metadata),
+        "records": measure(run_records, paths, page_cache, metadata),
+    }
+    results["peak_reduction"] = round(1 - results["records"]["peak_mb"] / results["documents"]["peak_mb"], 4)
+    print(json.dumps({"files": len(paths), **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
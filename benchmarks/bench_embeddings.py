@@ -0,0 +1,118 @@
+"""
+Embedding 后端基准测试
+比较本地 HashedNgramEmbeddings 与 OpenAI embedding 的吞吐量和检索质量
+
+检索质量：从每个抽样文本块中截取一段连续文字作为查询，
+统计原文本块出现在前 k 个结果中的比例（recall@k）和 MRR；
+同时比较两个后端时，额外统计本地后端前 k 个结果与 OpenAI 结果的重合率。
+
+用法：
+    python benchmarks/bench_embeddings.py --docs CourseMaterials/DL --samples 300
+    python benchmarks/bench_embeddings.py --compare-openai   # 需要 OPENAI_API_KEY
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import create_embedding_backend, DEFAULT_LOCAL_MODEL_PATH
+from page_cache import PageTextCache
+from pdf_loader import load_pdf_file, create_text_splitter
+
+
+def load_chunks(docs_dir: str) -> list:
+    """加载并分割目录中的所有 PDF"""
+    page_cache = PageTextCache()
+    splitter = create_text_splitter()
+    chunks = []
+    for root, _, files in os.walk(docs_dir):
+        for file in sorted(files):
+            if file.endswith('.pdf'):
+                try:
+                    docs = load_pdf_file(os.path.join(root, file), page_cache=page_cache)
+                except Exception as e:
+                    print(f"skip {file}: {e}", file=sys.stderr)
+                    continue
+                chunks.extend(c.page_content for c in splitter.split_documents(docs))
+    return [c for c in chunks if len(c.split()) >= 40]
+
+
+def make_query(text: str, rng: random.Random, length: int = 20) -> str:
+    """从文本块中截取一段连续的词作为查询"""
+    words = text.split()
+    start = rng.randrange(0, max(1, len(words) - length))
+    return " ".join(words[start:start + length])
+
+
+def evaluate(embeddings, corpus: list, queries: list, k: int) -> dict:
+    """向量化语料和查询，返回吞吐量、recall@k、MRR 和每个查询的前 k 个结果"""
+    t0 = time.perf_counter()
+    doc_vectors = np.asarray(embeddings.embed_documents(corpus), dtype=np.float32)
+    doc_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    query_seconds = time.perf_counter() - t0
+
+    doc_vectors /= np.linalg.norm(doc_vectors, axis=1, keepdims=True) + 1e-12
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True) + 1e-12
+    scores = query_vectors @ doc_vectors.T
+    ranking = np.argsort(-scores, axis=1)
+
+    hits, reciprocal_ranks = 0, []
+    for i in range(len(queries)):
+        rank = int(np.where(ranking[i] == i)[0][0]) + 1
+        hits += rank <= k
+        reciprocal_ranks.append(1.0 / rank)
+
+    return {
+        "dim": int(doc_vectors.shape[1]),
+        "docs_per_second": round(len(corpus) / doc_seconds, 1),
+        "queries_per_second": round(len(queries) / query_seconds, 1),
+        f"recall@{k}": round(hits / len(queries), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "top_k": ranking[:, :k],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends")
+    parser.add_argument("--docs", default="CourseMaterials", help="语料 PDF 目录")
+    parser.add_argument("--samples", type=int, default=500, help="抽样文本块数量（同时也是查询数量）")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--model", default=DEFAULT_LOCAL_MODEL_PATH, help="本地模型文件")
+    parser.add_argument("--compare-openai", action="store_true", help="同时评测 OpenAI embedding")
+    parser.add_argument("--openai-model", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chunks = load_chunks(args.docs)
+    corpus = rng.sample(chunks, min(args.samples, len(chunks)))
+    queries = [make_query(text, rng) for text in corpus]
+    print(f"{len(chunks)} chunks loaded, evaluating on {len(corpus)}")
+
+    backends = {"hashed": create_embedding_backend("hashed", args.model)}
+    if args.compare_openai:
+        backends["openai"] = create_embedding_backend("openai", args.openai_model)
+
+    results = {name: evaluate(backend, corpus, queries, args.k) for name, backend in backends.items()}
+
+    if "openai" in results:
+        local_top, openai_top = results["hashed"]["top_k"], results["openai"]["top_k"]
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(local_top, openai_top)])
+        results["hashed"][f"overlap@{args.k}_with_openai"] = round(float(overlap), 4)
+
+    for result in results.values():
+        result.pop("top_k")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+文本分割基准测试
+比较 RecursiveCharacterTextSplitter 与 OffsetTextSplitter：
+
+- 吞吐量：每秒切分的页面文本字符数
+- 文本块数量和长度分布
+- 文档负载：旧方式在 Chroma 中为每个文本块保存完整文本（重叠部分重复保存）；
+  新方式每页文本只在页面存储中 zlib 压缩保存一份，Chroma 只保存偏移量
+
+用法：
+    python benchmarks/bench_splitter.py --docs CourseMaterials
+"""
+
+import os
+import sys
+import time
+import json
+import zlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_records import MetadataTable
+from offset_splitter import OffsetTextSplitter
+from page_cache import PageTextCache
+from pdf_loader import load_pdf_pages, create_text_splitter
+
+
+def load_page_texts(docs_dir: str, page_cache: PageTextCache) -> list:
+    table = MetadataTable()
+    texts = []
+    for root, _, files in os.walk(docs_dir):
+        for file in sorted(files):
+            if file.endswith('.pdf'):
+                try:
+                    pages = load_pdf_pages(os.path.join(root, file), table, page_cache=page_cache)
+                except Exception as e:
+                    print(f"skip {file}: {e}", file=sys.stderr)
+                    continue
+                texts.extend(page.text for page in pages)
+    return texts
+
+
+def time_split(split, texts: list, repeat: int) -> tuple:
+    best, chunks = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        chunks = [split(text) for text in texts]
+        seconds = time.perf_counter() - t0
+        best = seconds if best is None else min(best, seconds)
+    return best, chunks
+
+
+def length_stats(lengths: list) -> dict:
+    lengths = sorted(lengths)
+    return {
+        "chunks": len(lengths),
+        "mean_chars": round(sum(lengths) / max(1, len(lengths)), 1),
+        "max_chars": lengths[-1] if lengths else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text splitters and document payload size")
+    parser.add_argument("--docs", default="CourseMaterials", help="语料 PDF 目录")
+    parser.add_argument("--cache-dir", default="./.cache/pages", help="页面缓存目录")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = load_page_texts(args.docs, PageTextCache(args.cache_dir))
+    total_chars = sum(len(text) for text in texts)
+
+    recursive = create_text_splitter(args.chunk_size, args.chunk_overlap)
+    offset = OffsetTextSplitter(args.chunk_size, args.chunk_overlap)
+
+    rec_seconds, rec_chunks = time_split(recursive.split_text, texts, args.repeat)
+    off_seconds, off_spans = time_split(offset.split_offsets, texts, args.repeat)
+
+    rec_lengths = [len(chunk) for chunks in rec_chunks for chunk in chunks]
+    off_lengths = [end - start for spans in off_spans for start, end in spans]
+
+    # 旧方式：Chroma 为每个文本块保存完整文本
+    chunk_text_bytes = sum(len(chunk.encode("utf-8")) for chunks in rec_chunks for chunk in chunks)
+    # 新方式：每页压缩保存一份
+    page_store_bytes = sum(len(zlib.compress(text.encode("utf-8"))) for text in texts)
+
+    results = {
+        "pages": len(texts),
+        "page_chars": total_chars,
+        "recursive": {
+            **length_stats(rec_lengths),
+            "chars_per_second": round(total_chars / rec_seconds),
+        },
+        "offset": {
+            **length_stats(off_lengths),
+            "chars_per_second": round(total_chars / off_seconds),
+        },
+        "speedup": round(rec_seconds / off_seconds, 2),
+        "payload_bytes": {
+            "chunk_texts_in_chroma": chunk_text_bytes,
+            "compressed_page_store": page_store_bytes,
+            "reduction": round(1 - page_store_bytes / max(1, chunk_text_bytes), 4),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
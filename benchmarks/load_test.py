@@ -0,0 +1,268 @@
+"""
+并发负载测试
+用 N 个并发模拟用户驱动问答和上传路径（RAGService → DualVectorStoreRAG / DocumentManager），
+后端使用本地模拟 OpenAI 服务（mock_openai_server.py），逐级提高并发数，
+输出每一级的吞吐量、延迟分位数（p50/p95/p99）和错误率。
+
+每个模拟用户有独立的 user_id 和上传目录，与 Streamlit 会话一致；
+测试在临时目录中生成合成的课程 PDF，不读写项目的 chroma_db 和 UserUploads。
+
+用法：
+    python benchmarks/load_test.py --concurrency 1,4,16,32 --duration 20 --profile realistic
+    python benchmarks/load_test.py --profile throttled --upload-ratio 0.1 --output results.json
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8765/v1   # 使用已启动的模拟服务
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import numpy as np
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openai_server import PROFILES, start_mock_server
+
+VOCABULARY = (
+    "gradient descent backpropagation neural network activation function convolution pooling "
+    "attention transformer embedding tokenizer regression classification overfitting regularization "
+    "dropout batch normalization learning rate optimizer loss entropy precision recall cloud storage "
+    "database query index partition cluster replication latency throughput variance covariance "
+    "eigenvalue projection component matrix vector probability distribution sampling estimator"
+).split()
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """生成带文本层的最小 PDF（每页一段文字，Helvetica 字体）"""
+    objects = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    page_objects = []
+    for text in pages:
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)]
+        stream_lines = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream_lines.append(f"({escaped}) Tj T*")
+        stream_lines.append("ET")
+        stream = "\n".join(stream_lines).encode("latin-1", "replace")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        page_objects.append((content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"))
+        page_objects.append((page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()))
+
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append((1, b"<< /Type /Catalog /Pages 2 0 R >>"))
+    objects.append((2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()))
+    objects.append((font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    objects.extend(page_objects)
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for obj_id in range(1, len(objects) + 1):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def synthetic_pages(rng: random.Random, n_pages: int, words_per_page: int = 250) -> List[str]:
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(words_per_page)) for _ in range(n_pages)]
+
+
+class FakeUploadedFile:
+    """模拟 Streamlit UploadedFile（DocumentManager.upload_document 需要的属性）"""
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.type = "application/pdf"
+        self.size = len(content)
+        self._content = content
+
+    def getvalue(self) -> bytes:
+        return self._content
+
+
+def percentile_summary(latencies: List[float]) -> Dict:
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None}
+    values = np.asarray(latencies)
+    return {f"p{p}": round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}
+
+
+def run_level(service, workspace: str, concurrency: int, duration: float, upload_ratio: float,
+              questions: List[str], seed: int) -> Dict:
+    """以 concurrency 个模拟用户运行 duration 秒，返回该级的统计"""
+    from document_manager import DocumentManager
+
+    results = {"ask": [], "upload": []}
+    errors = {"ask": 0, "upload": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user(index: int):
+        rng = random.Random(seed * 1000 + concurrency * 100 + index)
+        user_id = f"load-c{concurrency}-u{index}"
+        doc_manager = DocumentManager(upload_dir=os.path.join(workspace, "UserUploads", user_id))
+        uploads = 0
+        while time.perf_counter() < deadline:
+            op = "upload" if rng.random() < upload_ratio else "ask"
+            t0 = time.perf_counter()
+            ok = True
+            try:
+                if op == "ask":
+                    service.run(service.ask(rng.choice(questions), user_id=user_id))
+                else:
+                    uploads += 1
+                    content = make_pdf(synthetic_pages(rng, 3))
+                    success, message, metadata = doc_manager.upload_document(
+                        FakeUploadedFile(f"{user_id}-{uploads}.pdf", content)
+                    )
+                    ok = success
+                    if success:
+                        ok, _, _ = service.run(service.ingest(
+                            file_path=metadata['filepath'],
+                            original_filename=metadata['original_filename'],
+                            upload_time=metadata['upload_time'],
+                            file_size=metadata['size'],
+                            file_id=metadata['file_id'],
+                            user_id=user_id
+                        ))
+                        if ok:
+                            ok, _ = doc_manager.save_document_metadata(metadata)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    results[op].append(elapsed)
+                else:
+                    errors[op] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    level = {"concurrency": concurrency, "wall_seconds": round(wall, 2)}
+    total_ok = 0
+    for op in ("ask", "upload"):
+        count = len(results[op]) + errors[op]
+        total_ok += len(results[op])
+        level[op] = {
+            "requests": count,
+            "throughput_per_s": round(len(results[op]) / wall, 2),
+            "error_rate": round(errors[op] / count, 4) if count else 0.0,
+            **percentile_summary(results[op]),
+        }
+    level["throughput_per_s"] = round(total_ok / wall, 2)
+    return level
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test against a mock OpenAI backend")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="逗号分隔的并发用户数")
+    parser.add_argument("--duration", type=float, default=20, help="每一级的持续时间（秒）")
+    parser.add_argument("--upload-ratio", type=float, default=0.05, help="上传操作占比")
+    parser.add_argument("--questions", type=int, default=200, help="问题池大小（越小越容易合并相同问题）")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--base-url", default=None, help="使用已启动的 OpenAI 兼容服务，而不是内置的模拟服务")
+    parser.add_argument("--courses", type=int, default=3, help="合成课程数量")
+    parser.add_argument("--pages", type=int, default=20, help="每门课程的页数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server = start_mock_server(args.profile, seed=args.seed)
+        base_url = server.base_url
+    os.environ["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY") if args.base_url and os.environ.get("OPENAI_API_KEY") else "mock"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+
+    from embeddings import create_embedding_backend
+    from rag_system import DualVectorStoreRAG
+    from service import RAGService
+
+    rng = random.Random(args.seed)
+    workspace = tempfile.mkdtemp(prefix="rag-load-")
+    try:
+        for c in range(args.courses):
+            course_dir = os.path.join(workspace, "CourseMaterials", f"Course{c}")
+            os.makedirs(course_dir)
+            with open(os.path.join(course_dir, "lecture.pdf"), 'wb') as f:
+                f.write(make_pdf(synthetic_pages(rng, args.pages)))
+
+        rag = DualVectorStoreRAG(
+            base_persist_dir=os.path.join(workspace, "chroma_db", "base"),
+            user_persist_dir=os.path.join(workspace, "chroma_db", "user"),
+            base_docs_dir=os.path.join(workspace, "CourseMaterials"),
+            page_cache_dir=None,
+            base_artifact_path=None,
+            embedding_backend=create_embedding_backend("openai", "text-embedding-3-small", check_embedding_ctx_length=False)
+        )
+        service = RAGService(rag)
+        t0 = time.perf_counter()
+        base_count = service.run(service.initialize())
+        print(f"Base index: {base_count} pages in {time.perf_counter() - t0:.1f}s ({base_url})", file=sys.stderr)
+
+        questions = [
+            f"What is the relation between {rng.choice(VOCABULARY)} and {rng.choice(VOCABULARY)}?"
+            for _ in range(args.questions)
+        ]
+
+        levels = []
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            level = run_level(service, workspace, concurrency, args.duration, args.upload_ratio, questions, args.seed)
+            levels.append(level)
+            ask = level["ask"]
+            print(
+                f"c={concurrency:>4}  {level['throughput_per_s']:>7.2f} ops/s  "
+                f"ask p50={ask['p50']} p95={ask['p95']} p99={ask['p99']} err={ask['error_rate']:.1%}  "
+                f"upload n={level['upload']['requests']} p95={level['upload']['p95']} err={level['upload']['error_rate']:.1%}",
+                file=sys.stderr
+            )
+
+        report = {
+            "profile": args.profile if server else "external",
+            "server_profile": server.profile if server else None,
+            "levels": levels,
+            "coalescing": rag.get_coalescing_stats(),
+            "cascade": rag.get_cascade_stats(),
+            "mock_requests": server.stats if server else None,
+        }
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if server:
+            server.shutdown()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+本地模拟 OpenAI 兼容 HTTP 服务
+提供 /v1/embeddings 和 /v1/chat/completions，用于负载测试，不消耗真实 API 额度
+
+- embedding：按输入文本哈希生成确定性的单位向量（相同文本得到相同向量）
+- 聊天：返回固定格式的回答
+- 延迟、错误（500）和限流（429）按配置文件模拟；slow_rate 比例的请求额外延迟 slow_latency 秒，
+  用于模拟长尾延迟；GET /stats 返回请求统计
+
+用法：
+    python benchmarks/mock_openai_server.py --port 8765 --profile realistic
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock streamlit run app.py
+"""
+
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+# 延迟单位为秒；chat_per_token 按回答的 token 数（近似为词数）累加
+PROFILES: Dict[str, Dict] = {
+    "instant": {"embed_latency": 0.0, "chat_latency": 0.0, "chat_per_token": 0.0,
+                "jitter": 0.0, "error_rate": 0.0, "rate_limit_rate": 0.0,
+                "slow_rate": 0.0, "slow_latency": 0.0},
+    "realistic": {"embed_latency": 0.15, "chat_latency": 0.6, "chat_per_token": 0.01,
+                  "jitter": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0,
+                  "slow_rate": 0.0, "slow_latency": 0.0},
+    "flaky": {"embed_latency": 0.15, "chat_latency": 0.6, "chat_per_token": 0.01,
+              "jitter": 0.5, "error_rate": 0.05, "rate_limit_rate": 0.0,
+              "slow_rate": 0.0, "slow_latency": 0.0},
+    "throttled": {"embed_latency": 0.15, "chat_latency": 0.6, "chat_per_token": 0.01,
+                  "jitter": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.2,
+                  "slow_rate": 0.0, "slow_latency": 0.0},
+    # 3% 的请求额外慢 4 秒（长尾延迟），用于验证对冲请求和截止时间
+    "tail": {"embed_latency": 0.15, "chat_latency": 0.6, "chat_per_token": 0.01,
+             "jitter": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0,
+             "slow_rate": 0.03, "slow_latency": 4.0},
+}
+
+MOCK_ANSWER = (
+    "Based on the provided context, this is a simulated answer produced by the mock server "
+    "for load testing purposes. It has roughly the length of a typical short answer."
+)
+
+
+def mock_embedding(text, dim: int) -> list:
+    """按文本内容生成确定性的单位向量"""
+    if not isinstance(text, str):
+        # check_embedding_ctx_length=True 时客户端发送 token ID 列表
+        text = json.dumps(text)
+    seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """带配置和统计的 HTTP 服务"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], profile: Dict, dim: int = 256, seed: Optional[int] = None):
+        super().__init__(address, MockOpenAIHandler)
+        self.profile = dict(profile)
+        self.dim = dim
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record(self, endpoint: str, status: int):
+        with self.stats_lock:
+            counts = self.stats.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def draw(self) -> Tuple[float, float, float]:
+        """返回 (用于判定错误/限流的随机数, 延迟抖动系数, 长尾额外延迟)"""
+        with self.rng_lock:
+            jitter = self.profile["jitter"]
+            slow = self.profile["slow_latency"] if self.rng.random() < self.profile["slow_rate"] else 0.0
+            return self.rng.random(), max(0.0, 1.0 + self.rng.uniform(-jitter, jitter)), slow
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    server: MockOpenAIServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.stats_lock:
+                self._send_json(200, {"profile": self.server.profile, "requests": self.server.stats})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            endpoint = "embeddings"
+        elif path.endswith("/chat/completions"):
+            endpoint = "chat"
+        else:
+            self._send_json(404, {"error": {"message": f"unknown endpoint {self.path}"}})
+            return
+
+        profile = self.server.profile
+        roll, jitter, slow = self.server.draw()
+        if roll < profile["rate_limit_rate"]:
+            self.server.record(endpoint, 429)
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": "1"}
+            )
+            return
+        if roll < profile["rate_limit_rate"] + profile["error_rate"]:
+            time.sleep(profile[f"{'embed' if endpoint == 'embeddings' else 'chat'}_latency"] * jitter)
+            self.server.record(endpoint, 500)
+            self._send_json(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+            return
+
+        if endpoint == "embeddings":
+            inputs = request.get("input", [])
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            time.sleep(profile["embed_latency"] * jitter + slow)
+            payload = {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": mock_embedding(text, self.server.dim)}
+                    for i, text in enumerate(inputs)
+                ],
+                "model": request.get("model", "mock-embedding"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        else:
+            tokens = len(MOCK_ANSWER.split())
+            time.sleep((profile["chat_latency"] + profile["chat_per_token"] * tokens) * jitter + slow)
+            payload = {
+                "id": f"chatcmpl-mock-{int(time.time() * 1000)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock-chat"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": MOCK_ANSWER},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens},
+            }
+
+        self.server.record(endpoint, 200)
+        self._send_json(200, payload)
+
+
+def start_mock_server(
+    profile: str = "realistic",
+    host: str = "127.0.0.1",
+    port: int = 0,
+    dim: int = 256,
+    overrides: Optional[Dict] = None,
+    seed: Optional[int] = None
+) -> MockOpenAIServer:
+    """
+    在后台线程启动模拟服务
+
+    Args:
+        profile: 配置名称（PROFILES 的键）
+        host: 监听地址
+        port: 监听端口，0 表示自动分配
+        dim: embedding 维度
+        overrides: 覆盖配置中的个别字段
+        seed: 随机种子
+
+    Returns:
+        已启动的服务（server.base_url 为 OpenAI base URL，server.shutdown() 停止）
+    """
+    server = MockOpenAIServer((host, port), {**PROFILES[profile], **(overrides or {})}, dim=dim, seed=seed)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--dim", type=int, default=256, help="embedding 维度")
+    for key in PROFILES["realistic"]:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=None, help=f"覆盖配置中的 {key}")
+    args = parser.parse_args()
+
+    overrides = {key: getattr(args, key) for key in PROFILES["realistic"] if getattr(args, key) is not None}
+    server = MockOpenAIServer((args.host, args.port), {**PROFILES[args.profile], **overrides}, dim=args.dim)
+    print(f"Mock OpenAI server on {server.base_url} ({args.profile}: {server.profile})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+尾延迟测试
+在注入长尾延迟的模拟 OpenAI 服务（mock_openai_server.py 的 tail 配置：少量请求额外慢数秒）上，
+分别以不同的截止时间 / 对冲配置回答同一批问题，比较问答延迟的 p50/p95/p99 和对冲、超时统计。
+
+每个问题只提问一次，查询向量缓存不会掩盖 embedding 的长尾延迟。
+
+用法：
+    python benchmarks/tail_latency.py --questions 300 --concurrency 4
+    python benchmarks/tail_latency.py --slow-rate 0.05 --slow-latency 6 --output tail.json
+    python benchmarks/tail_latency.py --user-search-timeout 0.001   # 验证用户库检索超时后的降级
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openai_server import start_mock_server
+from load_test import VOCABULARY, make_pdf, percentile_summary, synthetic_pages
+
+# 对比的配置：(名称, 截止时间, 对冲阶段)
+MODES = [
+    ("baseline", {"embed": None, "base_search": None, "user_search": None, "llm": None}, ()),
+    ("hedged", {}, ("embed", "llm")),
+]
+
+
+def run_mode(rag, questions: List[str], concurrency: int, user_id: str) -> Dict:
+    """用 concurrency 个线程回答所有问题，返回延迟分位数和错误数"""
+    latencies: List[float] = []
+    errors = []
+    lock = threading.Lock()
+    pending = list(questions)
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                question = pending.pop()
+            t0 = time.perf_counter()
+            try:
+                rag.answer(question, user_id=user_id)
+                with lock:
+                    latencies.append(time.perf_counter() - t0)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "questions": len(questions),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "max": round(max(latencies), 3) if latencies else None,
+        **percentile_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tail latency with hedged requests and per-stage deadlines")
+    parser.add_argument("--questions", type=int, default=300, help="每种配置回答的问题数")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="额外变慢的请求比例")
+    parser.add_argument("--slow-latency", type=float, default=4.0, help="变慢请求的额外延迟（秒）")
+    parser.add_argument("--stage-timeouts", default=None, help="hedged 配置的截止时间（JSON），默认 DEFAULT_STAGE_TIMEOUTS")
+    parser.add_argument("--user-search-timeout", type=float, default=None, help="hedged 配置的用户库检索截止时间")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    server = start_mock_server(
+        "tail", overrides={"slow_rate": args.slow_rate, "slow_latency": args.slow_latency}, seed=args.seed
+    )
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_BASE"] = server.base_url
+
+    from embeddings import create_embedding_backend
+    from rag_system import DualVectorStoreRAG
+
+    rng = random.Random(args.seed)
+    workspace = tempfile.mkdtemp(prefix="rag-tail-")
+    try:
+        course_dir = os.path.join(workspace, "CourseMaterials", "Course0")
+        os.makedirs(course_dir)
+        with open(os.path.join(course_dir, "lecture.pdf"), 'wb') as f:
+            f.write(make_pdf(synthetic_pages(rng, 20)))
+        upload = os.path.join(workspace, "notes.pdf")
+        with open(upload, 'wb') as f:
+            f.write(make_pdf(synthetic_pages(rng, 5)))
+
+        report = {"server_profile": None, "modes": {}}
+        for name, timeouts, hedge_stages in MODES:
+            if name != "baseline":
+                timeouts = dict(json.loads(args.stage_timeouts) if args.stage_timeouts else timeouts)
+                if args.user_search_timeout is not None:
+                    timeouts["user_search"] = args.user_search_timeout
+            rag = DualVectorStoreRAG(
+                base_persist_dir=os.path.join(workspace, "chroma_db", "base"),
+                user_persist_dir=os.path.join(workspace, "chroma_db", "user"),
+                base_docs_dir=os.path.join(workspace, "CourseMaterials"),
+                page_cache_dir=None,
+                base_artifact_path=None,
+                query_cache_size=0,
+                embedding_backend=create_embedding_backend(
+                    "openai", "text-embedding-3-small", check_embedding_ctx_length=False
+                ),
+                llm_tiers=[{"name": "mock", "model": "gpt-4o-mini"}],
+                stage_timeouts=timeouts,
+                hedge_stages=hedge_stages
+            )
+            # 建库和上传不计入测试，期间关闭长尾延迟
+            server.profile["slow_rate"] = 0.0
+            rag.initialize_base_vectorstore()
+            if name == MODES[0][0]:
+                rag.add_user_document(upload, "notes.pdf", "now", os.path.getsize(upload), "notes.pdf", user_id="tail")
+            server.profile["slow_rate"] = args.slow_rate
+
+            questions = [
+                f"[{name} {i}] How does {rng.choice(VOCABULARY)} relate to {rng.choice(VOCABULARY)}?"
+                for i in range(args.questions)
+            ]
+            before = json.loads(json.dumps(server.stats))
+            result = run_mode(rag, questions, args.concurrency, "tail")
+            result["stages"] = rag.get_latency_stats()
+            result["mock_requests"] = {
+                endpoint: {status: count - before.get(endpoint, {}).get(status, 0) for status, count in counts.items()}
+                for endpoint, counts in server.stats.items()
+            }
+            report["modes"][name] = result
+            llm = result["stages"]["llm"]["mock"]
+            print(
+                f"{name:>9}: p50={result['p50']} p95={result['p95']} p99={result['p99']} max={result['max']} "
+                f"err={result['errors']}  hedged embed={result['stages']['embed']['hedged']} llm={llm['hedged']}  "
+                f"user_search timeouts={result['stages']['user_search']['timeouts']}",
+                file=sys.stderr
+            )
+        report["server_profile"] = server.profile
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+基础库构建检查点模块
+基础向量库先构建到暂存目录，检查点记录已完成的文件；进程中断或 API 限流导致构建失败后，
+下次启动从检查点继续，只处理未完成的文件（文件内已写入的批次由确定性文本块 ID 跳过）。
+构建完成并通过校验后，暂存目录整体替换正式目录。
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+from datetime import datetime
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# 检查点文件（位于暂存目录中）
+CHECKPOINT_FILE = "build_checkpoint.json"
+
+
+class BuildCheckpoint:
+    """
+    记录一次构建的配置指纹和已完成的文件（线程安全，每次更新先写临时文件再原子替换）
+    """
+
+    def __init__(self, checkpoint_file: str):
+        """
+        Args:
+            checkpoint_file: 检查点文件路径
+        """
+        self.checkpoint_file = checkpoint_file
+        self.fingerprint = None
+        self.files: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self, fingerprint: str) -> bool:
+        """
+        读取检查点
+
+        Args:
+            fingerprint: 当前语料和构建配置的指纹（见 index_artifact.index_fingerprint()）
+
+        Returns:
+            存在与指纹匹配的检查点时返回 True；否则重置为空的检查点并返回 False
+        """
+        self.fingerprint = fingerprint
+        self.files = {}
+        if not os.path.exists(self.checkpoint_file):
+            return False
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable build checkpoint {self.checkpoint_file}: {e}")
+            return False
+        if data.get("fingerprint") != fingerprint:
+            logger.info("Build checkpoint was made for a different corpus or configuration, starting over")
+            return False
+        self.files = data.get("files", {})
+        return True
+
+    def save(self):
+        """写出检查点（先写临时文件再原子替换）"""
+        with self._lock:
+            data = {
+                "fingerprint": self.fingerprint,
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                "files": dict(self.files),
+            }
+            tmp_file = f"{self.checkpoint_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.checkpoint_file)
+
+    def mark_file(self, doc_id: str, info: Dict):
+        """
+        记录一个文件已全部写入
+
+        Args:
+            doc_id: 文档 ID
+            info: {"pages": 页数, "chunks": 文本块数}
+        """
+        with self._lock:
+            self.files[doc_id] = dict(info)
+        self.save()
+
+    @property
+    def chunks(self) -> int:
+        """已完成文件的文本块总数"""
+        with self._lock:
+            return sum(info["chunks"] for info in self.files.values())
+
+    @property
+    def pages(self) -> int:
+        """已完成文件的页面总数"""
+        with self._lock:
+            return sum(info["pages"] for info in self.files.values())
+
+
+def promote_directory(staging_dir: str, target_dir: str):
+    """
+    用暂存目录替换正式目录
+
+    旧目录先改名为 <target>.old，暂存目录再改名到位，最后删除旧目录；
+    两次改名之间进程退出时正式目录缺失，暂存目录保持完整，下次启动重新执行替换即可
+
+    Args:
+        staging_dir: 已完成的暂存目录
+        target_dir: 正式目录
+    """
+    old_dir = f"{target_dir.rstrip('/')}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(target_dir):
+        os.replace(target_dir, old_dir)
+    os.replace(staging_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
@@ -0,0 +1,154 @@
+"""
+紧凑文本记录模块
+索引流水线内部使用的页面和文本块记录：
+
+- 文件级元数据（source、source_type、total_pages、用户上传信息等）在 MetadataTable 中驻留一份，
+  记录只保存其整数 ID，不再为每个页面和文本块复制一个 dict
+- 记录使用 __slots__，只在写入 Chroma 或返回 LangChain Document 时才物化为元数据 dict
+- 文本块只保存所属页面的引用和 (start, end) 偏移量，需要时才从页面文本切出内容
+"""
+
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+from langchain_core.documents import Document
+
+
+class MetadataTable:
+    """
+    文件级元数据驻留表
+
+    相同内容的元数据只保存一份，按插入顺序分配整数 ID；线程安全
+    """
+
+    def __init__(self):
+        self._entries: List[dict] = []
+        self._index: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(metadata: dict) -> tuple:
+        return tuple(sorted((k, repr(v)) for k, v in metadata.items()))
+
+    def intern(self, metadata: dict) -> int:
+        """
+        驻留一份元数据
+
+        Args:
+            metadata: 文件级元数据（调用后不应再修改）
+
+        Returns:
+            元数据 ID
+        """
+        key = self._key(metadata)
+        with self._lock:
+            meta_id = self._index.get(key)
+            if meta_id is None:
+                meta_id = len(self._entries)
+                self._entries.append({
+                    k: sys.intern(v) if isinstance(v, str) else v
+                    for k, v in metadata.items()
+                })
+                self._index[key] = meta_id
+            return meta_id
+
+    def get(self, meta_id: int) -> dict:
+        """
+        获取驻留的元数据（共享对象，调用方不得修改）
+
+        Args:
+            meta_id: 元数据 ID
+
+        Returns:
+            元数据 dict
+        """
+        return self._entries[meta_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PageRecord:
+    """单个 PDF 页面：文件元数据 ID、页码、页面标签和文本"""
+
+    __slots__ = ("meta_id", "page", "page_label", "text")
+
+    def __init__(self, meta_id: int, page: int, page_label: str, text: str):
+        self.meta_id = meta_id
+        self.page = page
+        # 页面标签（"1"、"iv" 等）在文件之间大量重复，驻留后共享同一个字符串
+        self.page_label = sys.intern(page_label)
+        self.text = text
+
+
+class ChunkRecord:
+    """文本块：文本块 ID、所属页面和在页面文本中的偏移量"""
+
+    __slots__ = ("chunk_id", "page_record", "start", "end")
+
+    def __init__(self, chunk_id: Optional[str], page_record: PageRecord, start: int, end: int):
+        self.chunk_id = chunk_id
+        self.page_record = page_record
+        self.start = start
+        self.end = end
+
+    @property
+    def meta_id(self) -> int:
+        return self.page_record.meta_id
+
+    @property
+    def page(self) -> int:
+        return self.page_record.page
+
+    @property
+    def page_label(self) -> str:
+        return self.page_record.page_label
+
+    @property
+    def text(self) -> str:
+        """文本块内容（每次访问时从页面文本切出）"""
+        return self.page_record.text[self.start:self.end]
+
+
+def record_metadata(record, table: MetadataTable, with_offsets: bool = False) -> dict:
+    """
+    物化记录的完整元数据（与原先页面 Document 的元数据字段一致）
+
+    Args:
+        record: 页面或文本块记录
+        table: 记录所属的元数据驻留表
+        with_offsets: 为文本块额外写入 start / end 偏移量
+
+    Returns:
+        新的元数据 dict
+    """
+    metadata = dict(table.get(record.meta_id))
+    metadata["page"] = record.page
+    metadata["page_label"] = record.page_label
+    if with_offsets:
+        metadata["start"] = record.start
+        metadata["end"] = record.end
+    return metadata
+
+
+def record_to_document(record, table: MetadataTable) -> Document:
+    """把记录转换为 LangChain Document"""
+    return Document(page_content=record.text, metadata=record_metadata(record, table))
+
+
+def split_page_records(pages: Iterable[PageRecord], splitter) -> Iterator[ChunkRecord]:
+    """
+    把页面记录切分为文本块记录（文本块 ID 由调用方分配）
+
+    文本块只记录偏移量，不复制子串，也不复制元数据
+
+    Args:
+        pages: 页面记录
+        splitter: 偏移量分割器（OffsetTextSplitter）
+
+    Yields:
+        文本块记录
+    """
+    for page in pages:
+        for start, end in splitter.split_offsets(page.text):
+            yield ChunkRecord(None, page, start, end)
@@ -0,0 +1,194 @@
+"""
+文本块注册表模块
+记录每个上传文档在向量库中的文本块 ID，删除时按 ID 直接批量删除，无需扫描元数据；
+分批索引的文档还记录索引覆盖率（已索引页数 / 总页数 / 状态）
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+def make_page_chunk_id(file_id: str, page: int, index: int) -> str:
+    """
+    生成按页编号的确定性文本块 ID
+
+    每页的文本块独立编号，分批索引时不同批次的 ID 互不冲突，
+    且可以从 ID 得知哪些页面已经索引
+
+    Args:
+        file_id: 文件ID（唯一文件名）
+        page: 页码（从 0 开始）
+        index: 文本块在该页中的序号
+
+    Returns:
+        文本块 ID，例如 "20240101_120000_abc123_doc.pdf::p12-0"
+    """
+    return f"{file_id}::p{page}-{index}"
+
+
+def chunk_page(chunk_id: str) -> Optional[int]:
+    """从 make_page_chunk_id() 生成的 ID 中取出页码，其他格式返回 None"""
+    suffix = chunk_id.rsplit("::", 1)[-1]
+    if not suffix.startswith("p") or "-" not in suffix:
+        return None
+    try:
+        return int(suffix[1:suffix.index("-")])
+    except ValueError:
+        return None
+
+
+class ChunkRegistry:
+    """
+    文本块注册表：{file_id: [chunk_id, ...]}，持久化为 JSON 文件
+
+    文件格式为 {"chunks": {...}, "coverage": {file_id: {...}}}；
+    旧版文件只有 {file_id: [chunk_id, ...]}，读取时自动兼容。
+    每次修改都重写整个文件，分批索引时文本块 ID 和覆盖率在同一次调用中更新，每批只写一次。
+
+    文件被其他进程（例如 reconcile.py）修改后，下次访问时重新读取；修改在文件锁
+    （<注册表文件>.lock）内先重新读取再写回，不会覆盖其他进程的修改
+    """
+
+    def __init__(self, registry_file: str):
+        """
+        Args:
+            registry_file: 注册表 JSON 文件路径
+        """
+        self.registry_file = registry_file
+        self._entries: Optional[Dict[str, List[str]]] = None
+        self._coverage: Dict[str, Dict] = {}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{registry_file}.lock")
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.registry_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> Dict[str, List[str]]:
+        signature = self._file_signature()
+        if self._entries is None or signature != self._signature:
+            self._signature = signature
+            self._coverage = {}
+            if signature is not None:
+                try:
+                    with open(self.registry_file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if isinstance(data.get("chunks"), dict):
+                        self._entries = data["chunks"]
+                        self._coverage = data.get("coverage", {})
+                    else:
+                        self._entries = data
+                except Exception as e:
+                    logger.warning(f"Failed to load chunk registry {self.registry_file}: {e}")
+                    self._entries = {}
+            else:
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        # 先写临时文件再替换，避免进程中断时注册表损坏
+        tmp_file = f"{self.registry_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"chunks": self._entries, "coverage": self._coverage}, f, ensure_ascii=False)
+        os.replace(tmp_file, self.registry_file)
+        self._signature = self._file_signature()
+
+    def register(self, file_id: str, chunk_ids: List[str], coverage: Optional[Dict] = None):
+        """
+        记录文档的文本块 ID（覆盖已有记录）
+
+        Args:
+            file_id: 文件ID
+            chunk_ids: 文本块 ID 列表
+            coverage: 同时写入的覆盖率（格式同 get_coverage()），None 表示清除之前的覆盖率
+        """
+        with self._lock, self._file_lock:
+            self._load()[file_id] = list(chunk_ids)
+            self._set_coverage(file_id, coverage)
+            self._save()
+
+    def extend(self, file_id: str, chunk_ids: List[str], coverage: Optional[Dict] = None):
+        """
+        追加文档的文本块 ID（分批索引时每提交一批调用一次）
+
+        Args:
+            file_id: 文件ID
+            chunk_ids: 新写入的文本块 ID
+            coverage: 同时更新的覆盖率（格式同 get_coverage()），None 表示不修改
+        """
+        with self._lock, self._file_lock:
+            existing = self._load().setdefault(file_id, [])
+            known = set(existing)
+            existing.extend(chunk_id for chunk_id in chunk_ids if chunk_id not in known)
+            if coverage is not None:
+                self._set_coverage(file_id, coverage)
+            self._save()
+
+    def _set_coverage(self, file_id: str, coverage: Optional[Dict]):
+        if coverage is None:
+            self._coverage.pop(file_id, None)
+        else:
+            self._coverage[file_id] = {
+                "pages_indexed": coverage["pages_indexed"],
+                "total_pages": coverage["total_pages"],
+                "status": coverage["status"],
+            }
+
+    def set_coverage(self, file_id: str, pages_indexed: int, total_pages: int, status: str):
+        """
+        记录文档的索引覆盖率
+
+        Args:
+            file_id: 文件ID
+            pages_indexed: 已索引的页数
+            total_pages: 总页数
+            status: "indexing"、"complete"、"failed" 或 "cancelled"
+        """
+        with self._lock, self._file_lock:
+            self._load()
+            self._set_coverage(file_id, {"pages_indexed": pages_indexed, "total_pages": total_pages, "status": status})
+            self._save()
+
+    def get_coverage(self, file_id: str) -> Optional[Dict]:
+        """获取文档的索引覆盖率，一次性索引的文档返回 None"""
+        with self._lock:
+            self._load()
+            coverage = self._coverage.get(file_id)
+            return dict(coverage) if coverage else None
+
+    def get(self, file_id: str) -> List[str]:
+        """获取文档的文本块 ID，不存在时返回空列表"""
+        with self._lock:
+            return list(self._load().get(file_id, []))
+
+    def remove(self, file_id: str) -> List[str]:
+        """
+        删除文档的记录
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            被删除记录中的文本块 ID
+        """
+        with self._lock, self._file_lock:
+            chunk_ids = self._load().pop(file_id, [])
+            self._coverage.pop(file_id, None)
+            self._save()
+            return chunk_ids
+
+    def file_ids(self) -> List[str]:
+        """列出注册表中的所有文件ID"""
+        with self._lock:
+            return list(self._load().keys())
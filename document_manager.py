@@ -5,9 +5,9 @@
 
 import os
 import json
+import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
-import streamlit as st
 from utils import (
     generate_unique_filename, 
     calculate_file_hash, 
@@ -16,6 +16,8 @@ from utils import (
     format_file_size
 )
 
+logger = logging.getLogger(__name__)
+
 
 class DocumentManager:
     """文档管理器类"""
@@ -32,25 +34,77 @@ class DocumentManager:
         self.metadata_file = os.path.join(upload_dir, metadata_file)
         self._ensure_directory_exists()
         
+        # 元数据的内存副本及增量维护的视图：按上传时间倒序的列表、总大小、哈希索引
+        # 只有元数据文件被其他会话修改时才重新读取
+        self._metadata: Optional[Dict[str, Dict]] = None
+        self._metadata_stamp = None
+        self._sorted_docs: List[Dict] = []
+        self._total_size = 0
+        self._hash_index: Dict[str, Dict] = {}
+        
     def _ensure_directory_exists(self):
         """确保上传目录存在"""
         os.makedirs(self.upload_dir, exist_ok=True)
+    
+    def _file_stamp(self):
+        """元数据文件的 (修改时间, 大小)，文件不存在时返回 None"""
+        try:
+            stat = os.stat(self.metadata_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
         
     def _load_metadata(self) -> Dict[str, Dict]:
         """
         加载文档元数据
         
+        文件自上次读取或写入后未被修改时直接返回内存副本（只需一次 stat）
+        
         Returns:
             文档元数据字典 {file_id: metadata}
         """
-        if os.path.exists(self.metadata_file):
+        stamp = self._file_stamp()
+        if self._metadata is not None and stamp == self._metadata_stamp:
+            return self._metadata
+        
+        metadata = {}
+        if stamp is not None:
             try:
                 with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    metadata = json.load(f)
             except Exception as e:
-                st.warning(f"⚠️ 无法加载元数据：{str(e)}")
-                return {}
-        return {}
+                logger.warning(f"⚠️ 无法加载元数据：{str(e)}")
+        
+        self._metadata = metadata
+        self._metadata_stamp = stamp
+        self._rebuild_views()
+        return metadata
+    
+    def _rebuild_views(self):
+        """根据元数据重建文档列表、总大小和哈希索引"""
+        self._sorted_docs = sorted(
+            self._metadata.values(), key=lambda x: x.get('upload_time', ''), reverse=True
+        )
+        self._total_size = sum(meta.get('size', 0) for meta in self._metadata.values())
+        self._hash_index = {meta['hash']: meta for meta in self._metadata.values() if meta.get('hash')}
+    
+    def _add_to_views(self, meta: Dict):
+        """把新文档加入视图（新上传的文档通常位于列表最前面）"""
+        upload_time = meta.get('upload_time', '')
+        index = 0
+        while index < len(self._sorted_docs) and self._sorted_docs[index].get('upload_time', '') > upload_time:
+            index += 1
+        self._sorted_docs.insert(index, meta)
+        self._total_size += meta.get('size', 0)
+        if meta.get('hash'):
+            self._hash_index[meta['hash']] = meta
+    
+    def _remove_from_views(self, meta: Dict):
+        """把文档从视图中移除"""
+        self._sorted_docs = [doc for doc in self._sorted_docs if doc is not meta]
+        self._total_size -= meta.get('size', 0)
+        if self._hash_index.get(meta.get('hash')) is meta:
+            del self._hash_index[meta['hash']]
     
     def _save_metadata(self, metadata: Dict[str, Dict]):
         """
@@ -58,12 +112,20 @@ class DocumentManager:
         
         Args:
             metadata: 文档元数据字典
+            
+        Raises:
+            OSError: 写入失败时抛出，由调用方转换为返回值
         """
         try:
             with open(self.metadata_file, 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, ensure_ascii=False, indent=2)
         except Exception as e:
-            st.error(f"❌ 无法保存元数据：{str(e)}")
+            logger.error(f"❌ 无法保存元数据：{str(e)}")
+            # 内存副本可能已与磁盘不一致，下次访问时重新读取
+            self._metadata = None
+            raise
+        self._metadata = metadata
+        self._metadata_stamp = self._file_stamp()
     
     def check_duplicate(self, file_content: bytes) -> Optional[Dict]:
         """
@@ -78,12 +140,8 @@ class DocumentManager:
             如果存在重复，返回已存在文件的元数据；否则返回 None
         """
         file_hash = calculate_file_hash(file_content)
-        metadata = self._load_metadata()
-        
-        for file_id, meta in metadata.items():
-            if meta.get('hash') == file_hash:
-                return meta
-        return None
+        self._load_metadata()
+        return self._hash_index.get(file_hash)
     
     def upload_document(self, uploaded_file) -> Tuple[bool, Optional[str], Optional[Dict]]:
         """
@@ -163,8 +221,12 @@ class DocumentManager:
         
         # 3. 删除元数据
         original_name = all_metadata[file_id]['original_filename']
-        del all_metadata[file_id]
-        self._save_metadata(all_metadata)
+        removed = all_metadata.pop(file_id)
+        try:
+            self._save_metadata(all_metadata)
+        except Exception as e:
+            return False, f"❌ 文件已删除，但更新元数据失败：{str(e)}"
+        self._remove_from_views(removed)
         
         return True, f"✅ 已删除文档：{original_name}"
     
@@ -172,16 +234,23 @@ class DocumentManager:
         """
         列出所有已上传的文档
         
+        返回增量维护的排序视图，调用方不应修改
+        
         Returns:
             文档列表（按上传时间倒序）
         """
-        all_metadata = self._load_metadata()
-        documents = list(all_metadata.values())
-        
-        # 按上传时间倒序排序
-        documents.sort(key=lambda x: x.get('upload_time', ''), reverse=True)
+        self._load_metadata()
+        return self._sorted_docs
+    
+    def get_total_size(self) -> int:
+        """
+        获取已上传文档的总大小（增量维护，不遍历目录）
         
-        return documents
+        Returns:
+            总大小（字节）
+        """
+        self._load_metadata()
+        return self._total_size
     
     def save_document_metadata(self, metadata: Dict) -> Tuple[bool, Optional[str]]:
         """
@@ -198,12 +267,37 @@ class DocumentManager:
         try:
             all_metadata = self._load_metadata()
             file_id = metadata['file_id']
+            previous = all_metadata.get(file_id)
             all_metadata[file_id] = metadata
             self._save_metadata(all_metadata)
+            if previous is not None:
+                self._remove_from_views(previous)
+            self._add_to_views(metadata)
             return True, None
         except Exception as e:
             return False, f"保存元数据失败：{str(e)}"
     
+    def remove_document_metadata(self, file_ids: List[str]) -> Tuple[bool, Optional[str]]:
+        """
+        批量删除文档元数据（不删除文件），用于对账清理
+        
+        Args:
+            file_ids: 文件ID列表
+            
+        Returns:
+            (是否成功, 错误信息)
+        """
+        try:
+            all_metadata = self._load_metadata()
+            removed = [all_metadata.pop(file_id) for file_id in file_ids if file_id in all_metadata]
+            if removed:
+                self._save_metadata(all_metadata)
+                for meta in removed:
+                    self._remove_from_views(meta)
+            return True, None
+        except Exception as e:
+            return False, f"删除元数据失败：{str(e)}"
+    
     def mark_as_indexed(self, file_id: str):
         """
         标记文档为已索引（已废弃，使用 save_document_metadata 代替）
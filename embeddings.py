@@ -0,0 +1,418 @@
+"""
+Embedding 辅助模块
+提供可插拔的 embedding 后端（OpenAI / 本地 CPU）和查询向量缓存
+"""
+
+import os
+import re
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """
+    规范化查询文本，用作缓存键
+
+    去掉首尾空白并把连续空白合并为一个空格
+
+    Args:
+        text: 原始查询文本
+
+    Returns:
+        规范化后的文本
+    """
+    return " ".join(text.split())
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    带 LRU 缓存的查询 embedding 包装器
+
+    只缓存 embed_query（检索时的问题向量），embed_documents 直接透传给底层实现。
+    一个实例在进程内所有会话之间共享，线程安全；缓存中保存元组，每次返回新的列表，
+    调用方原地修改返回值不会影响缓存。
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = 1024, caller=None):
+        """
+        Args:
+            embeddings: 底层 embedding 实现
+            max_size: 缓存的最大条目数，0 表示不缓存
+            caller: 未命中缓存时用于请求查询向量的 HedgedCaller（截止时间和对冲请求，见 hedging.py），
+                None 表示直接调用
+        """
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.caller = caller
+        self._cache: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+
+        # 在锁外请求 embedding，避免阻塞其他会话
+        if self.caller is not None:
+            vector = self.caller.call(self.embeddings.embed_query, key)
+        else:
+            vector = self.embeddings.embed_query(key)
+
+        if self.max_size > 0:
+            with self._lock:
+                self._cache[key] = tuple(vector)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return list(vector)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化查询
+
+        命中缓存的查询直接返回，其余查询合并成一次 embed_documents 请求（与 embed_query
+        一样经过 caller 的截止时间和对冲请求），结果写入缓存
+
+        Args:
+            texts: 查询文本列表
+
+        Returns:
+            与输入顺序一致的查询向量列表
+        """
+        keys = [normalize_query(text) for text in texts]
+        vectors: Dict[str, Tuple[float, ...]] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vector
+            missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            if self.caller is not None:
+                missing_vectors = self.caller.call(self.embeddings.embed_documents, missing)
+            else:
+                missing_vectors = self.embeddings.embed_documents(missing)
+            for key, vector in zip(missing, missing_vectors):
+                vectors[key] = tuple(vector)
+            if self.max_size > 0:
+                with self._lock:
+                    for key in missing:
+                        self._cache[key] = vectors[key]
+                        self._cache.move_to_end(key)
+                    while len(self._cache) > self.max_size:
+                        self._cache.popitem(last=False)
+
+        return [list(vectors[key]) for key in keys]
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计
+
+        Returns:
+            {"size", "max_size", "hits", "misses", "hit_rate"}
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class HashedNgramEmbeddings(Embeddings):
+    """
+    本地 CPU embedding：哈希 n-gram TF-IDF + 线性投影
+
+    1. 文本转小写后提取词 unigram/bigram 和字符 n-gram，用 crc32 哈希到 n_features 个桶
+    2. 词频取 log1p 并乘以 IDF，L2 归一化
+    3. 乘以投影矩阵降到 dim 维并再次归一化
+
+    调用 fit() 后 IDF 和投影矩阵（截断 SVD，即 LSA）由语料学习得到并可保存到磁盘；
+    未拟合时 IDF 全为 1，投影为固定种子的高斯随机投影，维度保持不变。
+    指定的模型文件不存在时报错，只有显式传入 allow_unfitted=True 才使用未拟合的随机投影。
+    全部计算为批量 NumPy 矩阵运算，无网络请求。
+
+    注意：拟合前后向量空间不同，更换模型文件后需要重建向量库。
+    """
+
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        n_features: int = 2 ** 14,
+        dim: int = 256,
+        char_ngram_range: Tuple[int, int] = (3, 5),
+        batch_size: int = 256,
+        seed: int = 42,
+        allow_unfitted: bool = False
+    ):
+        """
+        Args:
+            model_path: 拟合得到的模型文件（.npz），加载后覆盖 n_features/dim 等参数；
+                None 表示使用未拟合的随机投影（例如随后调用 fit()）
+            n_features: 哈希桶数量
+            dim: 输出向量维度
+            char_ngram_range: 字符 n-gram 长度范围（含两端）
+            batch_size: 每批向量化的文本数量
+            seed: 随机投影的种子
+            allow_unfitted: model_path 不存在时使用未拟合的随机投影而不是报错
+
+        Raises:
+            FileNotFoundError: model_path 不存在且未允许使用未拟合的投影
+        """
+        self.model_path = model_path
+        self.n_features = n_features
+        self.dim = dim
+        self.char_ngram_range = tuple(char_ngram_range)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.fitted = False
+
+        if model_path and os.path.exists(model_path):
+            self.load(model_path)
+        else:
+            if model_path:
+                # 随机投影与之后拟合的模型向量空间不同，用它建立的索引会在换上模型文件后静默失配
+                if not allow_unfitted:
+                    raise FileNotFoundError(
+                        f"Embedding model {model_path} not found; fit it with `python embeddings.py` "
+                        f"or pass allow_unfitted=True to use an unfitted random projection"
+                    )
+                logger.warning(f"Embedding model {model_path} not found, using unfitted random projection")
+            self.idf = np.ones(n_features, dtype=np.float32)
+            rng = np.random.default_rng(seed)
+            self.projection = (
+                rng.standard_normal((n_features, dim), dtype=np.float32) / np.sqrt(dim)
+            ).astype(np.float32)
+
+    # ==================== 特征提取 ====================
+    def _features(self, text: str) -> List[int]:
+        """提取一段文本的哈希特征桶编号"""
+        words = re.findall(r"\w+", text.lower())
+        features = []
+        n_features = self.n_features
+        min_n, max_n = self.char_ngram_range
+
+        for i, word in enumerate(words):
+            features.append(zlib.crc32(b"w:" + word.encode("utf-8")) % n_features)
+            if i > 0:
+                bigram = f"b:{words[i - 1]} {word}"
+                features.append(zlib.crc32(bigram.encode("utf-8")) % n_features)
+            padded = f" {word} "
+            for n in range(min_n, max_n + 1):
+                for j in range(len(padded) - n + 1):
+                    features.append(zlib.crc32(padded[j:j + n].encode("utf-8")) % n_features)
+        return features
+
+    def _term_matrix(self, texts: List[str]) -> np.ndarray:
+        """把一批文本转换为 (len(texts), n_features) 的 log 词频矩阵"""
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            rows.extend([row] * len(features))
+            cols.extend(features)
+        counts = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        if cols:
+            np.add.at(counts, (np.asarray(rows), np.asarray(cols)), 1.0)
+        return np.log1p(counts)
+
+    def _tfidf(self, texts: List[str]) -> np.ndarray:
+        matrix = self._term_matrix(texts) * self.idf
+        return _l2_normalize(matrix)
+
+    def _batches(self, texts: List[str]) -> Iterable[List[str]]:
+        for i in range(0, len(texts), self.batch_size):
+            yield texts[i:i + self.batch_size]
+
+    # ==================== Embeddings 接口 ====================
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = [
+            _l2_normalize(self._tfidf(batch) @ self.projection)
+            for batch in self._batches(list(texts))
+        ]
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    # ==================== 拟合与持久化 ====================
+    def fit(self, texts: List[str], oversample: int = 16):
+        """
+        用语料学习 IDF 和投影矩阵
+
+        投影矩阵通过分批的随机化截断 SVD 求得，不需要把整个 TF-IDF 矩阵放入内存
+
+        Args:
+            texts: 语料文本（例如基础课程材料的全部文本块）
+            oversample: 随机化 SVD 的过采样维数
+        """
+        texts = list(texts)
+        if len(texts) < self.dim:
+            raise ValueError(f"Need at least {self.dim} texts to fit a {self.dim}-dim projection")
+
+        # 1. 文档频率 → IDF
+        df = np.zeros(self.n_features, dtype=np.float64)
+        for batch in self._batches(texts):
+            df += (self._term_matrix(batch) > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+        # 2. 随机化 SVD：Y = X·Ω → Q = orth(Y) → B = Qᵀ·X → SVD(B)
+        rng = np.random.default_rng(self.seed)
+        omega = rng.standard_normal((self.n_features, self.dim + oversample)).astype(np.float32)
+        y = np.vstack([self._tfidf(batch) @ omega for batch in self._batches(texts)])
+        q, _ = np.linalg.qr(y)
+        b = np.zeros((q.shape[1], self.n_features), dtype=np.float32)
+        for start, batch in zip(range(0, len(texts), self.batch_size), self._batches(texts)):
+            b += q[start:start + len(batch)].T @ self._tfidf(batch)
+        _, _, vt = np.linalg.svd(b, full_matrices=False)
+        self.projection = np.ascontiguousarray(vt[:self.dim].T, dtype=np.float32)
+        self.fitted = True
+
+    def save(self, model_path: str):
+        """保存 IDF、投影矩阵和参数到 .npz 文件"""
+        os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+        np.savez_compressed(
+            model_path,
+            idf=self.idf,
+            projection=self.projection,
+            n_features=self.n_features,
+            dim=self.dim,
+            char_ngram_range=np.asarray(self.char_ngram_range),
+            fitted=self.fitted
+        )
+
+    def load(self, model_path: str):
+        """从 .npz 文件加载模型"""
+        with np.load(model_path) as data:
+            self.idf = data["idf"].astype(np.float32)
+            self.projection = data["projection"].astype(np.float32)
+            self.n_features = int(data["n_features"])
+            self.dim = int(data["dim"])
+            self.char_ngram_range = tuple(int(n) for n in data["char_ngram_range"])
+            self.fitted = bool(data["fitted"])
+
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# 默认的本地 embedding 模型文件
+DEFAULT_LOCAL_MODEL_PATH = "./models/hashed_ngram_embeddings.npz"
+
+
+def create_embedding_backend(
+    name: str = "openai",
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+    **kwargs
+) -> Embeddings:
+    """
+    按名称创建 embedding 后端
+
+    - "openai": OpenAIEmbeddings，model 为 OpenAI 模型名（默认使用 langchain 的默认模型）
+    - "hashed": 本地 CPU 的 HashedNgramEmbeddings，model 为模型文件路径
+
+    注意：不同后端（或同一后端的不同模型）的向量不能混用，切换后需要使用新的向量库目录
+
+    Args:
+        name: 后端名称
+        model: 模型名称或模型文件路径
+        dimensions: 输出向量维度（OpenAI text-embedding-3 系列支持降维；本地模型文件存在时以文件为准）
+        **kwargs: 传给后端构造函数的其他参数
+
+    Returns:
+        Embeddings 实例
+    """
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        if model:
+            kwargs["model"] = model
+        if dimensions:
+            kwargs["dimensions"] = dimensions
+        return OpenAIEmbeddings(**kwargs)
+    if name == "hashed":
+        if dimensions:
+            kwargs["dim"] = dimensions
+        return HashedNgramEmbeddings(model_path=model or DEFAULT_LOCAL_MODEL_PATH, **kwargs)
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+
+def main():
+    """
+    拟合本地 embedding 模型
+
+    语料按索引时相同的加载器和 OffsetTextSplitter 分块，拟合的文本与向量库中的文本块一致
+
+    用法：python embeddings.py --docs CourseMaterials --output models/hashed_ngram_embeddings.npz
+    """
+    import argparse
+    from pdf_loader import load_pdf_pages
+    from page_cache import PageTextCache
+    from offset_splitter import OffsetTextSplitter
+    from chunk_records import MetadataTable, split_page_records
+
+    parser = argparse.ArgumentParser(description="Fit the local hashed n-gram embedding model")
+    parser.add_argument("--docs", default="CourseMaterials", help="语料 PDF 目录")
+    parser.add_argument("--output", default=DEFAULT_LOCAL_MODEL_PATH, help="模型输出路径")
+    parser.add_argument("--dim", type=int, default=256, help="输出向量维度")
+    parser.add_argument("--n-features", type=int, default=2 ** 14, help="哈希桶数量")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="文本块大小（与索引时一致）")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="文本块重叠大小（与索引时一致）")
+    args = parser.parse_args()
+
+    page_cache = PageTextCache()
+    splitter = OffsetTextSplitter(args.chunk_size, args.chunk_overlap)
+    table = MetadataTable()
+    texts = []
+    for root, _, files in os.walk(args.docs):
+        for file in sorted(files):
+            if file.endswith('.pdf'):
+                try:
+                    pages = load_pdf_pages(os.path.join(root, file), table, "base", None, page_cache)
+                except Exception as e:
+                    logger.error(f"Failed to load {file}: {e}")
+                    continue
+                texts.extend(chunk.text for chunk in split_page_records(pages, splitter))
+
+    model = HashedNgramEmbeddings(n_features=args.n_features, dim=args.dim)
+    model.fit(texts)
+    model.save(args.output)
+    print(f"✅ Fitted on {len(texts)} chunks, saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
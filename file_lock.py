@@ -0,0 +1,112 @@
+"""
+跨进程文件锁模块
+基于 flock 的共享/独占锁，用于协调应用进程和命令行维护工具（reconcile.py、migration.py）：
+
+- 应用进程持有用户库目录的共享锁（INDEX_LOCK_FILE），多个应用和工具进程可以同时打开索引
+- 会删除 collection 或执行 VACUUM 的维护操作需要独占锁，应用运行期间无法获得
+- 文本块注册表在读-改-写时持有独占锁，其他进程的修改不会被覆盖
+
+不支持 flock 的平台（Windows）上锁不生效，只记录一次警告。
+"""
+
+import os
+import logging
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 用户库目录中的索引锁文件名
+INDEX_LOCK_FILE = ".index.lock"
+
+_warned_unsupported = False
+
+# 本进程持有独占锁的路径：同一进程再请求共享锁时直接视为已持有（flock 按打开的文件区分，否则会等待自己）
+_exclusive_paths = set()
+
+
+class FileLockError(RuntimeError):
+    """非阻塞获取锁失败（其他进程持有冲突的锁）"""
+
+
+class FileLock:
+    """
+    flock 文件锁
+
+    可以作为上下文管理器使用（阻塞获取独占锁），也可以用 acquire() / release() 长期持有
+    """
+
+    def __init__(self, lock_path: str):
+        """
+        Args:
+            lock_path: 锁文件路径（不存在时创建）
+        """
+        self.lock_path = lock_path
+        self._fd: Optional[int] = None
+        self._exclusive = False
+        self._nested = False
+
+    def acquire(self, exclusive: bool = True, blocking: bool = True):
+        """
+        获取锁
+
+        Args:
+            exclusive: True 为独占锁，False 为共享锁
+            blocking: 为 False 时不等待
+
+        Raises:
+            FileLockError: 非阻塞获取失败
+        """
+        global _warned_unsupported
+        if self._fd is not None or self._nested:
+            return
+        if not exclusive and os.path.abspath(self.lock_path) in _exclusive_paths:
+            self._nested = True
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            if not _warned_unsupported:
+                logger.warning("File locks are not supported on this platform; run maintenance tools with the app stopped")
+                _warned_unsupported = True
+            self._fd = fd
+            return
+        flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            os.close(fd)
+            raise FileLockError(f"{self.lock_path} is locked by another process")
+        self._fd = fd
+        self._exclusive = exclusive
+        if exclusive:
+            _exclusive_paths.add(os.path.abspath(self.lock_path))
+
+    def release(self):
+        """释放锁（未持有时无操作）"""
+        if self._nested:
+            self._nested = False
+            return
+        if self._fd is None:
+            return
+        if self._exclusive:
+            _exclusive_paths.discard(os.path.abspath(self.lock_path))
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        """当前是否持有锁"""
+        return self._fd is not None or self._nested
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,285 @@
+"""
+尾延迟控制模块
+为远程调用（查询 embedding、LLM）提供截止时间和对冲请求：
+
+- 截止时间：调用超过 timeout 秒仍未返回时抛出 StageTimeout，由调用方降级或升级处理
+- 对冲请求：调用超过最近延迟的 p95 仍未返回时，再发出一次相同的请求，采用先成功返回的结果；
+  按 p95 触发时只有约 5% 的请求会被重复发送
+
+延迟分布由 LatencyTracker 在滑动窗口内统计，样本不足时不对冲。
+同步调用在线程池中执行，超时或对冲落败的请求无法中断，会在后台运行到结束（结果丢弃）；
+异步调用的落败请求直接取消。
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimeout(TimeoutError):
+    """某个阶段在截止时间内未完成"""
+
+    def __init__(self, stage: str, timeout: float):
+        """
+        Args:
+            stage: 阶段名称
+            timeout: 截止时间（秒）
+        """
+        super().__init__(f"{stage} did not finish within {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class LatencyTracker:
+    """在滑动窗口内记录调用延迟，提供分位数"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        Args:
+            window: 保留的最近样本数
+            min_samples: 计算分位数所需的最少样本数
+        """
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        获取延迟分位数
+
+        Args:
+            p: 百分位（0~100）
+
+        Returns:
+            秒数；样本不足时返回 None
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = list(self._samples)
+        return float(np.percentile(samples, p))
+
+    def get_stats(self) -> Dict:
+        """
+        Returns:
+            {"samples", "p50", "p95", "p99"}（样本不足时分位数为 None）
+        """
+        with self._lock:
+            samples = list(self._samples)
+        stats = {"samples": len(samples)}
+        for p in (50, 95, 99):
+            stats[f"p{p}"] = round(float(np.percentile(samples, p)), 3) if samples else None
+        return stats
+
+
+class HedgedCaller:
+    """
+    带截止时间和对冲请求的调用器（一个阶段一个实例，线程安全）
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        timeout: Optional[float] = None,
+        hedge: bool = False,
+        hedge_percentile: float = 95,
+        min_hedge_delay: float = 0.05,
+        max_workers: int = 32,
+        tracker: Optional[LatencyTracker] = None
+    ):
+        """
+        Args:
+            stage: 阶段名称（用于日志和异常）
+            timeout: 截止时间（秒），None 表示不限制
+            hedge: 是否发出对冲请求
+            hedge_percentile: 触发对冲的延迟分位数
+            min_hedge_delay: 对冲延迟的下限（秒），避免延迟很低时频繁重复请求
+            max_workers: 同步调用线程池的大小
+            tracker: 延迟统计，默认新建
+        """
+        self.stage = stage
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.tracker = tracker or LatencyTracker()
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "errors": 0}
+
+    @property
+    def passthrough(self) -> bool:
+        """既没有截止时间也不对冲时直接在调用方线程执行"""
+        return self.timeout is None and not self.hedge
+
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲延迟（秒），不对冲或样本不足时返回 None"""
+        if not self.hedge:
+            return None
+        delay = self.tracker.percentile(self.hedge_percentile)
+        return None if delay is None else max(self.min_hedge_delay, delay)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix=f"hedge-{self.stage}"
+                )
+            return self._executor
+
+    def _timed(self, fn: Callable[..., Any], *args) -> Any:
+        t0 = time.perf_counter()
+        result = fn(*args)
+        self.tracker.record(time.perf_counter() - t0)
+        return result
+
+    def _wait_budget(self, start: float, hedged: bool, delay: Optional[float]) -> Optional[float]:
+        """距离下一个事件（发出对冲请求或截止时间）的秒数，None 表示无限等待"""
+        now = time.perf_counter()
+        budgets = []
+        if self.timeout is not None:
+            budgets.append(start + self.timeout - now)
+        if delay is not None and not hedged:
+            budgets.append(start + delay - now)
+        return max(0.0, min(budgets)) if budgets else None
+
+    def call(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        执行同步调用
+
+        Args:
+            fn: 实际调用的函数（对冲时会以相同参数再调用一次，必须是幂等的）
+            *args: 传给 fn 的参数
+
+        Returns:
+            先成功返回的结果
+
+        Raises:
+            StageTimeout: 超过截止时间仍没有成功的结果
+            Exception: 所有请求都失败时抛出最后一个异常
+        """
+        self._count("calls")
+        if self.passthrough:
+            return self._timed(fn, *args)
+
+        executor = self._get_executor()
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        primary = executor.submit(self._timed, fn, *args)
+        pending = {primary}
+        hedged = False
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=self._wait_budget(start, hedged, delay), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                last_error = future.exception()
+            if not pending:
+                break
+            elapsed = time.perf_counter() - start
+            if self.timeout is not None and elapsed >= self.timeout:
+                self._count("timeouts")
+                raise StageTimeout(self.stage, self.timeout)
+            if not hedged and delay is not None and elapsed >= delay:
+                hedged = True
+                self._count("hedged")
+                logger.debug(f"Hedging {self.stage} after {elapsed:.2f}s")
+                pending.add(executor.submit(self._timed, fn, *args))
+        self._count("errors")
+        raise last_error
+
+    async def acall(self, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行异步调用
+
+        Args:
+            make_call: 每次调用返回一个新的协程（对冲时调用两次）
+
+        Returns:
+            先成功返回的结果
+
+        Raises:
+            StageTimeout: 超过截止时间仍没有成功的结果
+            Exception: 所有请求都失败时抛出最后一个异常
+        """
+        self._count("calls")
+
+        async def timed():
+            t0 = time.perf_counter()
+            result = await make_call()
+            self.tracker.record(time.perf_counter() - t0)
+            return result
+
+        if self.passthrough:
+            return await timed()
+
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(timed())
+        pending = {primary}
+        hedged = False
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=self._wait_budget(start, hedged, delay), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                    last_error = task.exception()
+                if not pending:
+                    break
+                elapsed = time.perf_counter() - start
+                if self.timeout is not None and elapsed >= self.timeout:
+                    self._count("timeouts")
+                    raise StageTimeout(self.stage, self.timeout)
+                if not hedged and delay is not None and elapsed >= delay:
+                    hedged = True
+                    self._count("hedged")
+                    logger.debug(f"Hedging {self.stage} after {elapsed:.2f}s")
+                    pending.add(asyncio.ensure_future(timed()))
+        finally:
+            # 落败或超时的请求直接取消，释放连接
+            for task in pending:
+                task.cancel()
+        self._count("errors")
+        raise last_error
+
+    def get_stats(self) -> Dict:
+        """
+        获取调用统计
+
+        Returns:
+            调用数、对冲数、对冲请求先返回的次数、超时数、失败数、对冲率、当前对冲延迟和延迟分位数
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats["hedge_rate"] = stats["hedged"] / stats["calls"] if stats["calls"] else 0.0
+        delay = self.hedge_delay()
+        stats["hedge_delay"] = round(delay, 3) if delay is not None else None
+        stats["timeout"] = self.timeout
+        stats["latency"] = self.tracker.get_stats()
+        return stats
@@ -0,0 +1,248 @@
+"""
+基础向量库制品模块
+把构建好的基础向量库打包成带校验和的压缩制品，新实例启动时直接解包，无需重新向量化
+
+制品包含 manifest.json（语料清单、embedding 配置、分块参数及其指纹）和 index/ 目录；
+同目录下的 <制品>.sha256 文件保存整个制品的 SHA256。
+
+用法：
+    python index_artifact.py build --output artifacts/base_index.tar.gz
+    python index_artifact.py verify artifacts/base_index.tar.gz
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import tarfile
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+from embeddings import DEFAULT_LOCAL_MODEL_PATH
+from pdf_loader import LOADER_VERSION
+from offset_splitter import SPLITTER_VERSION
+from utils import calculate_path_hash
+
+logger = logging.getLogger(__name__)
+
+# 默认制品路径
+DEFAULT_ARTIFACT_PATH = "./artifacts/base_index.tar.gz"
+
+# 制品格式版本（2：基础库按课程分片；3：文本块以偏移量引用页面存储）
+ARTIFACT_FORMAT = 3
+
+
+def corpus_manifest(base_docs_dir: str, pdf_files: List[str]) -> List[Dict]:
+    """
+    生成语料清单
+
+    Args:
+        base_docs_dir: 基础文档目录
+        pdf_files: PDF 文件路径列表
+
+    Returns:
+        [{"path": 相对路径, "sha256": ..., "size": ...}, ...]（按路径排序）
+    """
+    manifest = []
+    for path in pdf_files:
+        manifest.append({
+            "path": os.path.relpath(path, base_docs_dir).replace(os.sep, "/"),
+            "sha256": calculate_path_hash(path),
+            "size": os.path.getsize(path),
+        })
+    manifest.sort(key=lambda item: item["path"])
+    return manifest
+
+
+def index_fingerprint(rag, pdf_files: List[str]) -> Dict:
+    """
+    计算基础向量库的构建配置：语料、embedding 配置、分块参数和加载器版本
+
+    任意一项变化都会改变指纹，旧制品不再匹配
+
+    Args:
+        rag: DualVectorStoreRAG 实例
+        pdf_files: 基础 PDF 文件路径列表
+
+    Returns:
+        {"config": {...}, "fingerprint": 十六进制字符串}
+    """
+    embedding = {"backend": rag.embedding_backend, "model": rag.embedding_model}
+    if rag.embedding_backend == "hashed":
+        # 本地模型的向量空间由模型文件决定
+        model_path = rag.embedding_model or DEFAULT_LOCAL_MODEL_PATH
+        embedding["model_sha256"] = calculate_path_hash(model_path) if os.path.exists(model_path) else None
+    if rag.embedding_dimensions:
+        embedding["dimensions"] = rag.embedding_dimensions
+
+    config = {
+        "corpus": corpus_manifest(rag.base_docs_dir, pdf_files),
+        "embedding": embedding,
+        "chunking": {
+            "chunk_size": rag.chunk_size,
+            "chunk_overlap": rag.chunk_overlap,
+            "splitter": SPLITTER_VERSION,
+        },
+        "loader_version": LOADER_VERSION,
+    }
+    serialized = json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return {"config": config, "fingerprint": hashlib.sha256(serialized).hexdigest()}
+
+
+def build_artifact(rag, output_path: str = DEFAULT_ARTIFACT_PATH) -> Dict:
+    """
+    打包基础向量库（不存在时先构建）
+
+    Args:
+        rag: DualVectorStoreRAG 实例
+        output_path: 制品输出路径（.tar.gz）
+
+    Returns:
+        制品的 manifest
+    """
+    doc_count = rag.initialize_base_vectorstore()
+    if not doc_count:
+        raise RuntimeError("Base vectorstore is empty, nothing to package")
+
+    fingerprint = index_fingerprint(rag, rag.list_base_pdf_files())
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "fingerprint": fingerprint["fingerprint"],
+        "config": fingerprint["config"],
+        "chunk_count": sum(store._collection.count() for store in rag.base_shards.values()),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    manifest_path = f"{output_path}.manifest.json"
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    try:
+        with tarfile.open(tmp_path, "w:gz") as tar:
+            tar.add(manifest_path, arcname="manifest.json")
+            tar.add(rag.base_persist_dir, arcname="index")
+    finally:
+        os.remove(manifest_path)
+
+    os.replace(tmp_path, output_path)
+    with open(f"{output_path}.sha256", 'w', encoding='utf-8') as f:
+        f.write(calculate_path_hash(output_path) + "\n")
+
+    return manifest
+
+
+def read_artifact_manifest(artifact_path: str) -> Dict:
+    """
+    校验制品的 SHA256 并读取其 manifest
+
+    Args:
+        artifact_path: 制品路径
+
+    Returns:
+        manifest 字典
+
+    Raises:
+        ValueError: 校验和缺失或不匹配、manifest 缺失
+    """
+    checksum_path = f"{artifact_path}.sha256"
+    if not os.path.exists(checksum_path):
+        raise ValueError(f"Missing checksum file {checksum_path}")
+    with open(checksum_path, 'r', encoding='utf-8') as f:
+        expected = f.read().split()[0]
+    actual = calculate_path_hash(artifact_path)
+    if actual != expected:
+        raise ValueError(f"Checksum mismatch for {artifact_path}: expected {expected}, got {actual}")
+
+    with tarfile.open(artifact_path, "r:gz") as tar:
+        member = tar.extractfile("manifest.json")
+        if member is None:
+            raise ValueError(f"{artifact_path} has no manifest.json")
+        return json.load(member)
+
+
+def install_artifact(rag, artifact_path: str = DEFAULT_ARTIFACT_PATH) -> Optional[Dict]:
+    """
+    校验制品并把与当前配置匹配的基础向量库解包到 rag.base_persist_dir
+
+    Args:
+        rag: DualVectorStoreRAG 实例
+        artifact_path: 制品路径
+
+    Returns:
+        安装成功时返回 manifest；制品不存在、校验失败或配置不匹配时返回 None
+    """
+    if not os.path.exists(artifact_path):
+        return None
+
+    try:
+        manifest = read_artifact_manifest(artifact_path)
+    except Exception as e:
+        logger.warning(f"Ignoring base index artifact {artifact_path}: {e}")
+        return None
+
+    expected = index_fingerprint(rag, rag.list_base_pdf_files())["fingerprint"]
+    if manifest.get("format") != ARTIFACT_FORMAT or manifest.get("fingerprint") != expected:
+        logger.warning(f"Base index artifact {artifact_path} was built with a different corpus or configuration")
+        return None
+
+    # 先解包到临时目录，完成后再移动到位，避免留下半解包的向量库
+    staging_dir = f"{rag.base_persist_dir.rstrip('/')}.unpack"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    try:
+        with tarfile.open(artifact_path, "r:gz") as tar:
+            members = []
+            for member in tar.getmembers():
+                name = os.path.normpath(member.name)
+                if name == "manifest.json":
+                    continue
+                if not (name == "index" or name.startswith("index" + os.sep)) or ".." in name.split(os.sep):
+                    raise ValueError(f"Unexpected path in artifact: {member.name}")
+                if not (member.isfile() or member.isdir()):
+                    raise ValueError(f"Unexpected member type in artifact: {member.name}")
+                members.append(member)
+            tar.extractall(staging_dir, members=members)
+
+        shutil.rmtree(rag.base_persist_dir, ignore_errors=True)
+        os.replace(os.path.join(staging_dir, "index"), rag.base_persist_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    logger.info(f"Installed base index artifact {artifact_path} ({manifest.get('chunk_count')} chunks)")
+    return manifest
+
+
+def main():
+    from rag_system import create_rag_from_env
+    from utils import ensure_openai_api_key
+
+    parser = argparse.ArgumentParser(description="Package or verify the prebuilt base index artifact")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="构建（如需要）并打包基础向量库")
+    build_parser.add_argument("--output", default=DEFAULT_ARTIFACT_PATH)
+    verify_parser = subparsers.add_parser("verify", help="校验制品并检查是否与当前配置匹配")
+    verify_parser.add_argument("artifact", nargs="?", default=DEFAULT_ARTIFACT_PATH)
+    args = parser.parse_args()
+
+    ensure_openai_api_key()
+    rag = create_rag_from_env(base_artifact_path=None)
+
+    if args.command == "build":
+        manifest = build_artifact(rag, args.output)
+        print(f"✅ {args.output}: {manifest['chunk_count']} chunks, fingerprint {manifest['fingerprint'][:16]}")
+    else:
+        try:
+            manifest = read_artifact_manifest(args.artifact)
+        except Exception as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        expected = index_fingerprint(rag, rag.list_base_pdf_files())["fingerprint"]
+        matches = manifest["fingerprint"] == expected
+        print(f"{'✅' if matches else '⚠️'} checksum OK, fingerprint {'matches' if matches else 'does not match'} current configuration")
+        sys.exit(0 if matches else 2)
+
+
+if __name__ == "__main__":
+    main()
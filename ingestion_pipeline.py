@@ -0,0 +1,373 @@
+"""
+流水线索引模块
+把 PDF 解析、文本分割、向量化、写入向量库拆成并行的阶段，阶段之间用有界队列连接
+"""
+
+import time
+import uuid
+import queue
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+from langchain_core.embeddings import Embeddings
+from pdf_loader import load_pdf_pages
+from page_cache import PageTextCache
+from page_store import PageStore
+from offset_splitter import OffsetTextSplitter
+from chunk_registry import make_page_chunk_id
+from chunk_records import MetadataTable, record_metadata, split_page_records
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_DONE = object()
+
+
+class IngestionPipeline:
+    """
+    解析 → 分割 → 向量化 → 写入 四阶段流水线
+
+    - 解析：parse_workers 个线程并行解析 PDF
+    - 分割：单线程把页面切成文本块并按 embed_batch_size 打包
+    - 向量化：embed_workers 个线程并发请求 embedding（网络 I/O）
+    - 写入：单个写线程把向量写入 Chroma collection
+
+    各阶段同时运行，总耗时接近最慢的阶段，而不是所有阶段之和。
+    有界队列提供背压，内存占用不随语料规模增长。
+
+    阶段之间传递紧凑的页面/文本块记录（chunk_records），文件级元数据每次运行只驻留一份，
+    写入 Chroma 时才为每个文本块物化元数据 dict。文本块以偏移量表示，
+    提供 page_store 时页面文本只在页面存储中保存一份，Chroma 中不再保存文本块内容。
+    """
+
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        parse_workers: int = 4,
+        embed_workers: int = 4,
+        embed_batch_size: int = 64,
+        queue_size: int = 8,
+        page_cache: Optional[PageTextCache] = None
+    ):
+        """
+        Args:
+            embedding_function: 用于文本块向量化的 embedding 实现
+            chunk_size: 文本块大小
+            chunk_overlap: 文本块重叠大小
+            parse_workers: PDF 解析线程数
+            embed_workers: 并发 embedding 请求数
+            embed_batch_size: 每次 embedding 请求包含的文本块数量
+            queue_size: 阶段之间队列的最大长度
+            page_cache: 页面文本缓存，命中时解析阶段跳过 PDF 解析
+        """
+        self.embedding_function = embedding_function
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.parse_workers = max(1, parse_workers)
+        self.embed_workers = max(1, embed_workers)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.queue_size = max(1, queue_size)
+        self.page_cache = page_cache
+
+    def run(
+        self,
+        file_paths: List[str],
+        collection,
+        source_type: str = "base",
+        additional_metadata: Optional[dict] = None,
+        progress_callback: Optional[Callable[[Dict], None]] = None,
+        id_prefix: Optional[str] = None,
+        collection_router: Optional[Callable[[dict], object]] = None,
+        page_store: Optional[PageStore] = None,
+        doc_id_for: Optional[Callable[[str], str]] = None,
+        page_indices: Optional[Sequence[int]] = None,
+        stable_ids: bool = False,
+        skip_existing: bool = False,
+        file_callback: Optional[Callable[[str, Dict], None]] = None,
+        use_page_cache: bool = True
+    ) -> Dict:
+        """
+        运行流水线，把文件索引到指定的 Chroma collection
+
+        Args:
+            file_paths: PDF 文件路径列表
+            collection: 目标 Chroma collection（Chroma._collection）
+            source_type: 文档来源类型 ("base" 或 "user")
+            additional_metadata: 额外的元数据（用于用户上传文档）
+            progress_callback: 每写入一批后调用，参数为当前统计信息
+            id_prefix: 指定时文本块 ID 为按页编号的确定性 ID（见 make_page_chunk_id），
+                并在统计信息的 "ids" 中返回已写入的 ID；否则使用随机 UUID
+            collection_router: 根据文本块的文件级元数据返回目标 collection，
+                指定时忽略 collection 参数（用于按课程分片写入基础库）
+            page_store: 页面存储；指定时页面文本写入页面存储，Chroma 只保存
+                文本块的偏移量（元数据 doc_id、page、start、end），文本为空字符串
+            doc_id_for: 根据文件路径生成页面存储中的文档 ID，默认使用文件路径
+            page_indices: 只索引这些页（从 0 开始，用于分批索引），None 表示全部页面；
+                部分索引时页面追加到页面存储，不替换该文档已有的页面
+            stable_ids: 未指定 id_prefix 时以每个文件的文档 ID 为前缀生成确定性文本块 ID，
+                重复运行同一文件得到相同的 ID（用于可恢复的构建）
+            skip_existing: 跳过目标 collection 中已存在的文本块 ID，不再向量化
+                （配合确定性 ID，中断后重新运行只补写缺失的批次）
+            file_callback: 一个文件的所有文本块都已写入（或已存在）时调用，
+                参数为 (文件路径, {"pages": 页数, "chunks": 文本块数})；解析失败的文件不回调
+            use_page_cache: 是否读写页面文本缓存（用户上传的文档不写入共享缓存）
+
+        Returns:
+            统计信息：文件数、页面数、文本块数（本次写入）、跳过的文本块数、失败文件、各阶段耗时
+
+        Raises:
+            Exception: 向量化或写入失败时抛出，已写入的部分保留在 collection 中
+        """
+        start = time.perf_counter()
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        stats_lock = threading.Lock()
+        stats = {
+            "files": len(file_paths),
+            "files_parsed": 0,
+            "failed_files": [],
+            "pages": 0,
+            "chunks": 0,
+            "chunks_skipped": 0,
+            "stage_seconds": {"parse": 0.0, "split": 0.0, "embed": 0.0, "write": 0.0},
+            "ids": [],
+        }
+
+        path_q: queue.Queue = queue.Queue()
+        parsed_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        batch_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        write_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        metadata_table = MetadataTable()
+        page_cache = self.page_cache if use_page_cache else None
+        # 每个文件尚未写入的文本块数（按文件级元数据 ID），归零时该文件完成
+        remaining: Dict[int, int] = {}
+        file_results: Dict[int, tuple] = {}
+
+        for path in file_paths:
+            path_q.put(path)
+
+        def put(q: queue.Queue, item) -> bool:
+            # 带停止检查的阻塞 put，避免出错后上游线程永久阻塞
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q: queue.Queue):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def add_stage_time(stage: str, seconds: float):
+            with stats_lock:
+                stats["stage_seconds"][stage] += seconds
+
+        def fail(exc: BaseException):
+            errors.append(exc)
+            stop.set()
+
+        def target_of(meta_id: int):
+            if collection_router:
+                return collection_router(metadata_table.get(meta_id))
+            return collection
+
+        def drop_existing(chunks: list) -> list:
+            # 按文件查询已写入的 ID：一个文件的文本块总是写入同一个 collection
+            target = target_of(chunks[0].meta_id)
+            existing = set()
+            for i in range(0, len(chunks), 1000):
+                ids = [chunk.chunk_id for chunk in chunks[i:i + 1000]]
+                existing.update(target.get(ids=ids, include=[])["ids"])
+            return [chunk for chunk in chunks if chunk.chunk_id not in existing]
+
+        def file_finished(path: str, pages: int, chunks: int):
+            if file_callback:
+                file_callback(path, {"pages": pages, "chunks": chunks})
+
+        def parse_worker():
+            while not stop.is_set():
+                try:
+                    path = path_q.get_nowait()
+                except queue.Empty:
+                    break
+                t0 = time.perf_counter()
+                try:
+                    file_metadata = additional_metadata
+                    if page_store is not None:
+                        doc_id = doc_id_for(path) if doc_id_for else path
+                        file_metadata = {**(additional_metadata or {}), "doc_id": doc_id}
+                    pages = load_pdf_pages(
+                        path, metadata_table, source_type, file_metadata, page_cache, page_indices
+                    )
+                    if page_store is not None and page_indices is not None:
+                        page_store.add_pages(doc_id, [(page.page, page.text) for page in pages])
+                    elif page_store is not None:
+                        page_store.put_pages(doc_id, [(page.page, page.text) for page in pages])
+                except Exception as e:
+                    logger.error(f"Failed to load {path}: {e}")
+                    with stats_lock:
+                        stats["failed_files"].append(path)
+                    continue
+                finally:
+                    add_stage_time("parse", time.perf_counter() - t0)
+                with stats_lock:
+                    stats["files_parsed"] += 1
+                    stats["pages"] += len(pages)
+                if not put(parsed_q, (path, pages)):
+                    break
+            put(parsed_q, _DONE)
+
+        def split_worker():
+            splitter = OffsetTextSplitter(self.chunk_size, self.chunk_overlap)
+            pending = []
+            finished_parsers = 0
+            page_chunk_counts: Dict[tuple, int] = {}
+            try:
+                while finished_parsers < self.parse_workers:
+                    item = get(parsed_q)
+                    if item is _DONE:
+                        if stop.is_set():
+                            return
+                        finished_parsers += 1
+                        continue
+                    path, pages = item
+                    t0 = time.perf_counter()
+                    prefix = id_prefix
+                    if prefix is None and stable_ids:
+                        prefix = doc_id_for(path) if doc_id_for else path
+                    file_chunks = []
+                    for chunk in split_page_records(pages, splitter):
+                        if prefix is not None:
+                            key = (chunk.meta_id, chunk.page)
+                            chunk.chunk_id = make_page_chunk_id(prefix, chunk.page, page_chunk_counts.get(key, 0))
+                            page_chunk_counts[key] = page_chunk_counts.get(key, 0) + 1
+                        else:
+                            chunk.chunk_id = str(uuid.uuid4())
+                        file_chunks.append(chunk)
+                    total = len(file_chunks)
+                    if skip_existing and file_chunks:
+                        file_chunks = drop_existing(file_chunks)
+                        with stats_lock:
+                            stats["chunks_skipped"] += total - len(file_chunks)
+                    add_stage_time("split", time.perf_counter() - t0)
+                    if not file_chunks:
+                        file_finished(path, len(pages), total)
+                    else:
+                        # 先登记再发出批次，写线程看到的文本块一定已登记
+                        with stats_lock:
+                            remaining[file_chunks[0].meta_id] = len(file_chunks)
+                            file_results[file_chunks[0].meta_id] = (path, len(pages), total)
+                        pending.extend(file_chunks)
+                    while len(pending) >= self.embed_batch_size:
+                        batch = pending[:self.embed_batch_size]
+                        pending = pending[self.embed_batch_size:]
+                        if not put(batch_q, batch):
+                            return
+                if pending:
+                    put(batch_q, pending)
+            except Exception as e:
+                fail(e)
+            finally:
+                for _ in range(self.embed_workers):
+                    put(batch_q, _DONE)
+
+        def embed_worker():
+            try:
+                while True:
+                    batch = get(batch_q)
+                    if batch is _DONE:
+                        break
+                    t0 = time.perf_counter()
+                    vectors = self.embedding_function.embed_documents(
+                        [chunk.text for chunk in batch]
+                    )
+                    add_stage_time("embed", time.perf_counter() - t0)
+                    if not put(write_q, (batch, vectors)):
+                        break
+            except Exception as e:
+                fail(e)
+            finally:
+                put(write_q, _DONE)
+
+        def write_worker():
+            finished_embedders = 0
+            try:
+                while finished_embedders < self.embed_workers:
+                    item = get(write_q)
+                    if item is _DONE:
+                        if stop.is_set():
+                            return
+                        finished_embedders += 1
+                        continue
+                    batch, vectors = item
+                    t0 = time.perf_counter()
+                    ids = [chunk.chunk_id for chunk in batch]
+                    # 按目标 collection 分组写入；未指定路由时整批写入同一个 collection
+                    groups: Dict[int, tuple] = {}
+                    for chunk, vector in zip(batch, vectors):
+                        if collection_router:
+                            target = collection_router(metadata_table.get(chunk.meta_id))
+                        else:
+                            target = collection
+                        groups.setdefault(id(target), (target, []))[1].append((chunk, vector))
+                    for target, items in groups.values():
+                        # 在 Chroma 边界才物化每个文本块的元数据
+                        if page_store is not None:
+                            documents = [""] * len(items)
+                        else:
+                            documents = [chunk.text for chunk, _ in items]
+                        target.upsert(
+                            ids=[chunk.chunk_id for chunk, _ in items],
+                            embeddings=[vector for _, vector in items],
+                            documents=documents,
+                            metadatas=[
+                                record_metadata(chunk, metadata_table, with_offsets=page_store is not None)
+                                for chunk, _ in items
+                            ]
+                        )
+                    add_stage_time("write", time.perf_counter() - t0)
+                    finished = []
+                    with stats_lock:
+                        stats["chunks"] += len(batch)
+                        if id_prefix is not None:
+                            stats["ids"].extend(ids)
+                        for chunk in batch:
+                            remaining[chunk.meta_id] -= 1
+                            if remaining[chunk.meta_id] == 0:
+                                finished.append(file_results.pop(chunk.meta_id))
+                        snapshot = dict(stats)
+                    for path, pages, total in finished:
+                        file_finished(path, pages, total)
+                    if progress_callback:
+                        progress_callback(snapshot)
+            except Exception as e:
+                fail(e)
+
+        threads = [threading.Thread(target=parse_worker, daemon=True) for _ in range(self.parse_workers)]
+        threads.append(threading.Thread(target=split_worker, daemon=True))
+        threads.extend(threading.Thread(target=embed_worker, daemon=True) for _ in range(self.embed_workers))
+        threads.append(threading.Thread(target=write_worker, daemon=True))
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats["wall_seconds"] = time.perf_counter() - start
+        logger.info(
+            f"Ingestion finished: {stats['files_parsed']}/{stats['files']} files, "
+            f"{stats['pages']} pages, {stats['chunks']} chunks in {stats['wall_seconds']:.1f}s "
+            f"(stage busy time: {stats['stage_seconds']})"
+        )
+
+        if errors:
+            raise errors[0]
+        return stats
@@ -0,0 +1,765 @@
+"""
+embedding 配置在线迁移模块（蓝绿切换）
+更换 embedding 模型或输出维度时，旧索引继续服务，新配置的索引在独立目录中后台构建：
+
+1. build：为新配置创建一个索引代（generation），从当前代复制页面文本、文本块元数据和注册表，
+   只对文本重新向量化（不重新解析 PDF），文本块 ID 保持不变
+2. compare：抽样查询，比较新旧两代检索结果的 overlap@k
+3. swap：把构建期间当前代新增或删除的文本块同步到新代，然后原子替换代指针文件
+4. rollback：切回上一代（同样先同步切换后写入新代的变更）
+
+代指针 embedding_generation.json 位于索引根目录（默认 ./chroma_db），记录当前代、上一代
+以及每一代的 embedding 配置和目录。create_rag_from_env() 按当前代打开索引；
+没有指针文件时使用 ./chroma_db/base 和 ./chroma_db/user（即第 0 代）。
+
+运行中的应用（RAGService）定期检查代指针，发现切换后在进程内把向量库目录和 embedding
+一起替换（见 DualVectorStoreRAG.refresh_generation()），正在进行的检索和写入完成后才切换，
+切换后自动把上一代在 swap 之后收到的写入补充到当前代；sync 命令可手动执行同样的补齐。
+
+用法：
+    python migration.py build --backend openai --model text-embedding-3-small --dimensions 512
+    python migration.py compare --sample 100 --k 5
+    python migration.py swap --min-overlap 0.6
+    python migration.py rollback
+    python migration.py status
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from chunk_registry import ChunkRegistry
+from shard_router import collection_centroid
+
+logger = logging.getLogger(__name__)
+
+# 代指针文件名
+GENERATION_FILE = "embedding_generation.json"
+
+# 索引根目录：第 0 代使用其下的 base/ 和 user/，之后的每一代使用 <代 ID>/base 和 <代 ID>/user
+DEFAULT_INDEX_ROOT = "./chroma_db"
+
+# 第 0 代（迁移前已有的索引）的 ID
+INITIAL_GENERATION = "g0"
+
+# 每批重新向量化的文本块数量
+COPY_BATCH_SIZE = 256
+
+
+class GenerationGate:
+    """
+    索引代切换闸门
+
+    检索和写入以共享方式进入，可以并发；切换索引代时独占进入，等待已进入的操作完成，
+    切换期间新的操作等待切换结束。同一线程中不要嵌套进入（切换等待期间会死锁）
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._switching = False
+
+    @contextmanager
+    def shared(self):
+        """检索、写入等使用当前代的操作"""
+        with self._cond:
+            while self._switching:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if not self._active:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        """切换索引代"""
+        with self._cond:
+            while self._switching:
+                self._cond.wait()
+            self._switching = True
+            while self._active:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._switching = False
+                self._cond.notify_all()
+
+
+def embedding_config(rag) -> Dict:
+    """DualVectorStoreRAG 的 embedding 配置"""
+    return {
+        "backend": rag.embedding_backend,
+        "model": rag.embedding_model,
+        "dimensions": rag.embedding_dimensions,
+    }
+
+
+def _collection_ids(collection, batch_size: int = 1000) -> Set[str]:
+    """分页读取 collection 中的所有文本块 ID"""
+    ids = set()
+    offset = 0
+    while True:
+        batch = collection.get(include=[], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.update(batch["ids"])
+        offset += len(batch["ids"])
+    return ids
+
+
+def _sync_page_store(source, target, mirror: bool) -> Set[str]:
+    """
+    复制目标页面存储中缺少或内容不同的文档；mirror 时同时删除源中已不存在的文档
+
+    按每个文档的页面摘要比较，分批索引后追加的页面和内容变化的基础文档也会同步
+
+    Returns:
+        复制的文档 ID
+    """
+    source_digests = source.doc_digests()
+    target_digests = target.doc_digests()
+    changed = {doc_id for doc_id, digest in source_digests.items() if target_digests.get(doc_id) != digest}
+    for doc_id in sorted(changed):
+        target.put_pages(doc_id, source.get_doc_pages(doc_id))
+    if mirror:
+        for doc_id in set(target_digests) - set(source_digests):
+            target.delete_doc(doc_id)
+    return changed
+
+
+def _changed_chunk_ids(source_collection, target_collection, doc_ids: Set[str], batch_size: int = 500) -> Set[str]:
+    """
+    属于指定文档、两边都存在但元数据不同的文本块（文档内容变化后偏移量变化，文本块 ID 不变）
+    """
+    changed = set()
+    doc_ids = sorted(doc_ids)
+    for i in range(0, len(doc_ids), batch_size):
+        where = {"doc_id": {"$in": doc_ids[i:i + batch_size]}}
+        source = source_collection.get(where=where, include=["metadatas"])
+        target = target_collection.get(where=where, include=["metadatas"])
+        target_metadata = dict(zip(target["ids"], target["metadatas"]))
+        changed.update(
+            chunk_id for chunk_id, metadata in zip(source["ids"], source["metadatas"])
+            if chunk_id in target_metadata and target_metadata[chunk_id] != metadata
+        )
+    return changed
+
+
+def _sync_registry(source_file: str, target_file: str, mirror: bool):
+    """同步用户分区的文本块注册表"""
+    if not os.path.exists(source_file):
+        return
+    source = ChunkRegistry(source_file)
+    target = ChunkRegistry(target_file)
+    source_ids = source.file_ids()
+    for file_id in source_ids:
+        if mirror:
+            target.register(file_id, source.get(file_id), coverage=source.get_coverage(file_id))
+        elif set(source.get(file_id)) - set(target.get(file_id)):
+            # 切换时正在分批索引的文档：切换前的批次写入上一代，之后的批次写入当前代，取并集
+            coverage = target.get_coverage(file_id) or source.get_coverage(file_id)
+            target.extend(file_id, source.get(file_id), coverage=coverage)
+    if mirror:
+        for file_id in set(target.file_ids()) - set(source_ids):
+            target.remove(file_id)
+
+
+def _sync_collection(
+    source_rag,
+    source_collection,
+    target_collection,
+    embedding_function,
+    mirror: bool,
+    changed_docs: Optional[Set[str]] = None,
+    batch_size: int = COPY_BATCH_SIZE
+) -> Dict[str, int]:
+    """
+    把源 collection 中目标缺少的文本块重新向量化后写入目标 collection
+
+    文本块 ID 和元数据原样复制；只保存偏移量的文本块按源的页面存储取出文本后向量化。
+    页面内容变化的文档中元数据（偏移量）不同的文本块也重新向量化
+
+    Args:
+        source_rag: 源 DualVectorStoreRAG（用于物化文本块内容）
+        source_collection: 源 collection
+        target_collection: 目标 collection
+        embedding_function: 目标 embedding
+        mirror: 是否删除目标中源已不存在的文本块
+        changed_docs: 页面内容与目标不同的文档 ID（见 _sync_page_store()）
+        batch_size: 每批向量化的文本块数量
+
+    Returns:
+        {"added": 新增数量, "updated": 重新向量化的已有文本块数量, "removed": 删除数量}
+    """
+    source_ids = _collection_ids(source_collection)
+    target_ids = _collection_ids(target_collection)
+    updated = _changed_chunk_ids(source_collection, target_collection, changed_docs) if changed_docs else set()
+    added = source_ids - target_ids
+    missing = sorted(added | updated)
+    stale = sorted(target_ids - source_ids) if mirror else []
+
+    for i in range(0, len(stale), batch_size):
+        target_collection.delete(ids=stale[i:i + batch_size])
+
+    for i in range(0, len(missing), batch_size):
+        batch = source_collection.get(ids=missing[i:i + batch_size], include=["documents", "metadatas"])
+        documents = [text or "" for text in batch["documents"]]
+        docs = source_rag.materialize_documents([
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(documents, batch["metadatas"])
+        ])
+        target_collection.upsert(
+            ids=batch["ids"],
+            embeddings=embedding_function.embed_documents([doc.page_content for doc in docs]),
+            metadatas=batch["metadatas"],
+            documents=documents
+        )
+    return {"added": len(added), "updated": len(updated), "removed": len(stale)}
+
+
+def sync_index(
+    source,
+    target,
+    mirror: bool = True,
+    progress_callback: Optional[Callable[[str, Dict], None]] = None
+) -> Dict[str, int]:
+    """
+    把源索引（基础库分片、用户分区、页面存储和注册表）同步到目标索引
+
+    只重新向量化目标缺少的文本块，因此可以重复执行：第一次是完整构建，之后是增量追赶
+
+    Args:
+        source: 源 DualVectorStoreRAG（已打开基础库）
+        target: 目标 DualVectorStoreRAG（使用新的 embedding 配置）
+        mirror: True 时目标与源完全一致（删除源中已不存在的内容）；
+            False 时只补充目标缺少的内容（切换后追赶旧进程的写入）
+        progress_callback: 每个 collection 同步完成后调用 (collection 名称, 统计)
+
+    Returns:
+        {"added", "updated", "removed", "collections", "pages_docs"}
+    """
+    totals = {"added": 0, "updated": 0, "removed": 0, "collections": 0, "pages_docs": 0}
+
+    def record(name: str, stats: Dict[str, int]):
+        totals["added"] += stats["added"]
+        totals["updated"] += stats["updated"]
+        totals["removed"] += stats["removed"]
+        totals["collections"] += 1
+        if progress_callback:
+            progress_callback(name, stats)
+
+    # 页面文本与 embedding 无关，直接复制
+    if target.base_page_store is None:
+        target._open_base_page_store()
+    changed_base = _sync_page_store(source.base_page_store, target.base_page_store, mirror)
+    changed_user = _sync_page_store(source.user_page_store, target.user_page_store, mirror)
+    totals["pages_docs"] += len(changed_base) + len(changed_user)
+
+    # 基础库分片：同步后重新计算质心并写出分片清单
+    target.shard_router.load()
+    shards = dict(target.shard_router.shards) if not mirror else {}
+    for course in source.shard_router.shards:
+        target_collection = target._open_base_shard(course)._collection
+        record(target_collection.name, _sync_collection(
+            source, source.base_shards[course]._collection, target_collection,
+            target.embedding_function, mirror, changed_base
+        ))
+        shards[course] = {
+            "collection": target_collection.name,
+            "chunks": target_collection.count(),
+            "centroid": collection_centroid(target_collection),
+        }
+    if mirror:
+        client = Chroma(persist_directory=target.base_persist_dir)._client
+        live = {info["collection"] for info in shards.values()}
+        for collection in client.list_collections():
+            name = getattr(collection, "name", collection)
+            if name not in live:
+                client.delete_collection(name)
+    target.shard_router.save(shards)
+    target._open_base_shards()
+
+    # 用户分区：collection 名称与用户 ID 一一对应，注册表随 collection 复制
+    source_client = source.get_user_vectorstore()._client
+    target_client = target.get_user_vectorstore()._client
+    user_collections = sorted(
+        name for name in (getattr(c, "name", c) for c in source_client.list_collections())
+        if name.startswith("user-")
+    )
+    for name in user_collections:
+        target_collection = target_client.get_or_create_collection(name)
+        record(name, _sync_collection(
+            source, source_client.get_collection(name), target_collection,
+            target.embedding_function, mirror, changed_user
+        ))
+        _sync_registry(
+            os.path.join(source.user_persist_dir, f"{name}.chunks.json"),
+            os.path.join(target.user_persist_dir, f"{name}.chunks.json"),
+            mirror
+        )
+    if mirror:
+        for name in (getattr(c, "name", c) for c in target_client.list_collections()):
+            if name.startswith("user-") and name not in user_collections:
+                target_client.delete_collection(name)
+
+    return totals
+
+
+def _result_key(doc: Document) -> tuple:
+    """检索结果的身份：只保存偏移量的文本块按位置，旧索引的文本块按内容"""
+    metadata = doc.metadata
+    if "start" in metadata:
+        return (metadata.get("source"), metadata.get("page"), metadata.get("start"), metadata.get("end"))
+    return (metadata.get("source"), metadata.get("page"), doc.page_content)
+
+
+def sample_queries(rag, sample_size: int, seed: int = 0, max_chars: int = 200) -> List[str]:
+    """
+    从基础库中随机抽取文本块，取开头一段文字作为比较用的查询
+
+    Args:
+        rag: DualVectorStoreRAG（已打开基础库）
+        sample_size: 查询数量
+        seed: 随机种子
+        max_chars: 每个查询的最大长度
+
+    Returns:
+        查询列表
+    """
+    rng = random.Random(seed)
+    candidates = []
+    for store in rag.base_shards.values():
+        collection = store._collection
+        candidates.extend((collection, chunk_id) for chunk_id in _collection_ids(collection))
+    picked = rng.sample(candidates, min(sample_size, len(candidates)))
+
+    queries = []
+    for collection, chunk_id in picked:
+        batch = collection.get(ids=[chunk_id], include=["documents", "metadatas"])
+        doc = rag.materialize_documents([
+            Document(page_content=batch["documents"][0] or "", metadata=batch["metadatas"][0])
+        ])[0]
+        text = " ".join(doc.page_content.split())[:max_chars]
+        if text:
+            queries.append(text)
+    return queries
+
+
+def compare_retrieval(source, target, queries: Iterable[str], k: int = 5) -> Dict:
+    """
+    比较两代索引对同一批查询的检索结果
+
+    Args:
+        source: 当前代 DualVectorStoreRAG
+        target: 新一代 DualVectorStoreRAG
+        queries: 查询列表
+        k: 每个查询比较的结果数量
+
+    Returns:
+        {"queries", "k", "mean_overlap", "min_overlap", "worst": [{"query", "overlap"}, ...]}
+    """
+    rows = []
+    for query in queries:
+        expected = {_result_key(doc) for doc, _ in source.retrieve_scored(query, k=k)}
+        actual = {_result_key(doc) for doc, _ in target.retrieve_scored(query, k=k)}
+        if expected:
+            rows.append({"query": query[:80], "overlap": len(expected & actual) / len(expected)})
+    overlaps = [row["overlap"] for row in rows]
+    return {
+        "queries": len(rows),
+        "k": k,
+        "mean_overlap": round(sum(overlaps) / len(overlaps), 4) if overlaps else None,
+        "min_overlap": round(min(overlaps), 4) if overlaps else None,
+        "worst": sorted(rows, key=lambda row: row["overlap"])[:5],
+    }
+
+
+def active_generation(index_root: str = DEFAULT_INDEX_ROOT) -> Optional[Dict]:
+    """
+    读取当前代的配置
+
+    Args:
+        index_root: 索引根目录
+
+    Returns:
+        {"id", "embedding", "base_persist_dir", "user_persist_dir", ...}；没有指针文件时返回 None
+    """
+    state = EmbeddingMigration(index_root).load_state()
+    if not state.get("active"):
+        return None
+    return dict(state["generations"][state["active"]], id=state["active"])
+
+
+class EmbeddingMigration:
+    """管理索引代：构建影子索引、比较、原子切换和回滚"""
+
+    def __init__(self, index_root: str = DEFAULT_INDEX_ROOT):
+        """
+        Args:
+            index_root: 索引根目录（代指针文件和各代目录所在位置）
+        """
+        self.index_root = index_root
+        self.pointer_path = os.path.join(index_root, GENERATION_FILE)
+
+    # ==================== 代指针 ====================
+    def load_state(self) -> Dict:
+        """读取代指针；不存在时返回空状态"""
+        if not os.path.exists(self.pointer_path):
+            return {"active": None, "previous": None, "generations": {}}
+        with open(self.pointer_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_state(self, state: Dict):
+        """写出代指针（先写临时文件再原子替换）"""
+        os.makedirs(self.index_root, exist_ok=True)
+        tmp_path = f"{self.pointer_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.pointer_path)
+
+    def _bootstrap(self, state: Dict, current_rag) -> Dict:
+        """第一次迁移时把现有索引登记为第 0 代"""
+        if state.get("active"):
+            return state
+        state["active"] = INITIAL_GENERATION
+        state["generations"][INITIAL_GENERATION] = {
+            "embedding": embedding_config(current_rag),
+            "base_persist_dir": current_rag.base_persist_dir,
+            "user_persist_dir": current_rag.user_persist_dir,
+            "status": "active",
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        return state
+
+    # ==================== 打开索引 ====================
+    def open_generation(self, generation_id: str, **kwargs):
+        """
+        按代配置创建 DualVectorStoreRAG 并打开其基础库（不会触发从 PDF 构建）
+
+        Args:
+            generation_id: 代 ID
+            **kwargs: 传给 DualVectorStoreRAG 的其他参数
+
+        Returns:
+            DualVectorStoreRAG 实例
+        """
+        from rag_system import DualVectorStoreRAG
+        entry = self.load_state()["generations"][generation_id]
+        embedding = entry["embedding"]
+        kwargs.setdefault("page_cache_dir", None)
+        kwargs.setdefault("base_artifact_path", None)
+        rag = DualVectorStoreRAG(
+            base_persist_dir=entry["base_persist_dir"],
+            user_persist_dir=entry["user_persist_dir"],
+            embedding_backend=embedding["backend"],
+            embedding_model=embedding["model"],
+            embedding_dimensions=embedding.get("dimensions"),
+            **kwargs
+        )
+        rag._open_base_page_store()
+        if rag.shard_router.load():
+            rag._open_base_shards()
+        return rag
+
+    def _default_target(self, state: Dict) -> str:
+        """最近创建的非当前代"""
+        candidates = [
+            (entry["created_at"], generation_id)
+            for generation_id, entry in state["generations"].items()
+            if generation_id != state["active"] and entry["status"] in ("building", "built", "ready")
+        ]
+        if not candidates:
+            raise ValueError("No shadow generation to use; run `build` first")
+        return max(candidates)[1]
+
+    # ==================== 迁移步骤 ====================
+    def build(
+        self,
+        current_rag,
+        backend: str,
+        model: Optional[str] = None,
+        dimensions: Optional[int] = None,
+        progress_callback: Optional[Callable[[str, Dict], None]] = None
+    ) -> str:
+        """
+        为新的 embedding 配置构建影子索引；相同配置的未完成构建会继续（只补齐缺少的文本块）
+
+        Args:
+            current_rag: 当前代的 DualVectorStoreRAG（已打开基础库）
+            backend: 新的 embedding 后端
+            model: 新的模型名称或模型文件路径
+            dimensions: 新的输出维度
+            progress_callback: 见 sync_index()
+
+        Returns:
+            新一代的 ID
+
+        Raises:
+            ValueError: 新配置与当前代相同
+        """
+        state = self._bootstrap(self.load_state(), current_rag)
+        embedding = {"backend": backend, "model": model, "dimensions": dimensions}
+        if embedding == state["generations"][state["active"]]["embedding"]:
+            raise ValueError("The requested embedding configuration is already active")
+
+        generation_id = next(
+            (gid for gid, entry in state["generations"].items()
+             if entry["embedding"] == embedding and gid != state["active"]),
+            None
+        )
+        if generation_id is None:
+            digest = hashlib.md5(json.dumps(embedding, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+            generation_id = f"g{len(state['generations'])}-{digest}"
+            generation_dir = os.path.join(self.index_root, generation_id)
+            state["generations"][generation_id] = {
+                "embedding": embedding,
+                "base_persist_dir": os.path.join(generation_dir, "base"),
+                "user_persist_dir": os.path.join(generation_dir, "user"),
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+            }
+        state["generations"][generation_id]["status"] = "building"
+        self._save_state(state)
+
+        target = self.open_generation(generation_id)
+        stats = sync_index(current_rag, target, mirror=True, progress_callback=progress_callback)
+        logger.info(f"Built shadow generation {generation_id}: {stats}")
+
+        state = self.load_state()
+        entry = state["generations"][generation_id]
+        entry["status"] = "built"
+        entry["built_at"] = datetime.now().isoformat(timespec="seconds")
+        entry["comparison"] = None
+        self._save_state(state)
+        return generation_id
+
+    def compare(
+        self,
+        current_rag,
+        generation_id: Optional[str] = None,
+        queries: Optional[List[str]] = None,
+        sample_size: int = 50,
+        k: int = 5
+    ) -> Dict:
+        """
+        比较当前代与影子代的检索结果，结果记录到代指针中
+
+        Args:
+            current_rag: 当前代的 DualVectorStoreRAG
+            generation_id: 影子代 ID，默认最近构建的一代
+            queries: 比较用的查询，None 表示从基础库抽样
+            sample_size: 抽样查询数量
+            k: 每个查询比较的结果数量
+
+        Returns:
+            compare_retrieval() 的报告
+        """
+        state = self.load_state()
+        generation_id = generation_id or self._default_target(state)
+        target = self.open_generation(generation_id)
+        report = compare_retrieval(
+            current_rag, target, queries or sample_queries(current_rag, sample_size), k
+        )
+
+        state = self.load_state()
+        entry = state["generations"][generation_id]
+        entry["comparison"] = dict(report, compared_at=datetime.now().isoformat(timespec="seconds"))
+        if entry["status"] == "built":
+            entry["status"] = "ready"
+        self._save_state(state)
+        return report
+
+    def swap(
+        self,
+        current_rag,
+        generation_id: Optional[str] = None,
+        min_overlap: Optional[float] = None,
+        force: bool = False
+    ) -> Dict[str, int]:
+        """
+        追赶构建期间的变更后，把影子代切换为当前代
+
+        Args:
+            current_rag: 当前代的 DualVectorStoreRAG
+            generation_id: 影子代 ID，默认最近构建的一代
+            min_overlap: 要求的最小平均 overlap@k
+            force: 跳过比较结果检查
+
+        Returns:
+            追赶同步的统计
+
+        Raises:
+            ValueError: 影子代未比较或 overlap 低于要求
+        """
+        state = self.load_state()
+        generation_id = generation_id or self._default_target(state)
+        entry = state["generations"][generation_id]
+        comparison = entry.get("comparison")
+        if not force:
+            if entry["status"] != "ready" or not comparison:
+                raise ValueError(f"Generation {generation_id} has not been compared; run `compare` first")
+            if min_overlap is not None and (comparison["mean_overlap"] or 0) < min_overlap:
+                raise ValueError(
+                    f"Generation {generation_id} mean overlap@{comparison['k']} "
+                    f"{comparison['mean_overlap']} is below {min_overlap}"
+                )
+        return self._activate(state, current_rag, generation_id)
+
+    def rollback(self, current_rag) -> Dict[str, int]:
+        """
+        切回上一代（先把切换后写入当前代的变更同步回去）
+
+        Returns:
+            追赶同步的统计
+
+        Raises:
+            ValueError: 没有上一代
+        """
+        state = self.load_state()
+        if not state.get("previous"):
+            raise ValueError("No previous generation to roll back to")
+        return self._activate(state, current_rag, state["previous"])
+
+    def _activate(self, state: Dict, current_rag, generation_id: str) -> Dict[str, int]:
+        """追赶同步并原子替换代指针"""
+        target = self.open_generation(generation_id)
+        stats = sync_index(current_rag, target, mirror=True)
+
+        previous = state["active"]
+        state["generations"][previous]["status"] = "previous"
+        state["generations"][generation_id]["status"] = "active"
+        state["generations"][generation_id]["activated_at"] = datetime.now().isoformat(timespec="seconds")
+        state["previous"] = previous
+        state["active"] = generation_id
+        self._save_state(state)
+        logger.info(f"Switched embedding generation {previous} -> {generation_id} (catch-up: {stats})")
+        return stats
+
+    def catch_up(self, current_rag) -> Dict[str, int]:
+        """
+        把切换后仍写入上一代的变更（应用切换前收到的上传）补充到当前代，不删除任何内容
+
+        Args:
+            current_rag: 当前代的 DualVectorStoreRAG
+
+        Returns:
+            同步统计
+        """
+        state = self.load_state()
+        if not state.get("previous"):
+            raise ValueError("No previous generation to catch up from")
+        return sync_index(self.open_generation(state["previous"]), current_rag, mirror=False)
+
+    def discard(self, generation_id: str):
+        """
+        删除一个非当前代的索引目录
+
+        Raises:
+            ValueError: 试图删除当前代
+        """
+        state = self.load_state()
+        if generation_id == state["active"]:
+            raise ValueError("Cannot discard the active generation")
+        entry = state["generations"].pop(generation_id)
+        if state.get("previous") == generation_id:
+            state["previous"] = None
+        self._save_state(state)
+        for path in (entry["base_persist_dir"], entry["user_persist_dir"]):
+            shutil.rmtree(path, ignore_errors=True)
+        generation_dir = os.path.join(self.index_root, generation_id)
+        if os.path.isdir(generation_dir) and not os.listdir(generation_dir):
+            os.rmdir(generation_dir)
+
+
+def main():
+    from rag_system import create_rag_from_env
+    from utils import ensure_openai_api_key
+
+    parser = argparse.ArgumentParser(description="Online blue/green migration of the embedding configuration")
+    parser.add_argument("--index-root", default=DEFAULT_INDEX_ROOT)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="显示各代配置和比较结果")
+    build_parser = subparsers.add_parser("build", help="为新的 embedding 配置构建影子索引并比较")
+    build_parser.add_argument("--backend", default="openai")
+    build_parser.add_argument("--model", default=None)
+    build_parser.add_argument("--dimensions", type=int, default=None)
+    build_parser.add_argument("--sample", type=int, default=50, help="比较用的抽样查询数量")
+    build_parser.add_argument("--k", type=int, default=5)
+    compare_parser = subparsers.add_parser("compare", help="比较当前代与影子代的检索结果")
+    compare_parser.add_argument("--generation", default=None)
+    compare_parser.add_argument("--queries", default=None, help="查询文件（每行一个），默认从基础库抽样")
+    compare_parser.add_argument("--sample", type=int, default=50)
+    compare_parser.add_argument("--k", type=int, default=5)
+    swap_parser = subparsers.add_parser("swap", help="追赶变更后切换到影子代")
+    swap_parser.add_argument("--generation", default=None)
+    swap_parser.add_argument("--min-overlap", type=float, default=None)
+    swap_parser.add_argument("--force", action="store_true", help="不检查比较结果")
+    subparsers.add_parser("rollback", help="切回上一代")
+    subparsers.add_parser("sync", help="把切换后写入上一代的上传补充到当前代")
+    discard_parser = subparsers.add_parser("discard", help="删除一个非当前代")
+    discard_parser.add_argument("generation")
+    args = parser.parse_args()
+
+    migration = EmbeddingMigration(args.index_root)
+    if args.command == "status":
+        print(json.dumps(migration.load_state(), ensure_ascii=False, indent=2))
+        return
+    if args.command == "discard":
+        migration.discard(args.generation)
+        print(f"✅ Discarded generation {args.generation}")
+        return
+
+    ensure_openai_api_key()
+    current = create_rag_from_env(base_artifact_path=None, index_root=args.index_root)
+    current._open_base_page_store()
+    if current.shard_router.load():
+        current._open_base_shards()
+
+    try:
+        if args.command == "build":
+            generation_id = migration.build(
+                current, args.backend, args.model, args.dimensions,
+                progress_callback=lambda name, stats: print(f"  {name}: +{stats['added']} ~{stats['updated']} -{stats['removed']}", file=sys.stderr)
+            )
+            report = migration.compare(current, generation_id, sample_size=args.sample, k=args.k)
+            print(f"✅ Built generation {generation_id}")
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        elif args.command == "compare":
+            queries = None
+            if args.queries:
+                with open(args.queries, 'r', encoding='utf-8') as f:
+                    queries = [line.strip() for line in f if line.strip()]
+            report = migration.compare(current, args.generation, queries, args.sample, args.k)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        elif args.command == "swap":
+            stats = migration.swap(current, args.generation, args.min_overlap, args.force)
+            print(f"✅ Active generation: {migration.load_state()['active']} (catch-up {stats}); running apps switch on their next poll")
+        elif args.command == "rollback":
+            stats = migration.rollback(current)
+            print(f"✅ Rolled back to {migration.load_state()['active']} (catch-up {stats}); running apps switch on their next poll")
+        elif args.command == "sync":
+            stats = migration.catch_up(current)
+            print(f"✅ Synced {stats['added']} chunks from the previous generation")
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+模型级联模块
+问题先交给便宜、快速的第一级模型；检索置信度低、上下文过大或回答 "I don't know" 时
+才升级到更大的模型。每一级的延迟和升级率都有统计，用于评估节省的成本。
+
+级联配置是一个列表，每一级是一个 dict：
+    name: 级别名称
+    model: 模型名称
+    base_url: 可选，OpenAI 兼容接口地址（例如本地模型服务）
+    min_score: 可选，检索最高相似度低于该值时跳过本级；不同 embedding 后端的相似度分布不同，
+        可写成 {后端名称: 阈值}（如 {"openai": 0.5, "hashed": 0.3}），缺少当前后端时不检查
+    max_context_chars: 可选，上下文超过该长度时跳过本级
+    timeout: 可选，本级的截止时间（秒），覆盖级联的默认值；超时视为失败并升级
+    hedge: 可选，本级是否发出对冲请求，覆盖级联的默认值
+最后一级总是回答，其 min_score / max_context_chars 不生效。
+
+默认只有一级（与引入级联前相同的 gpt-3.5-turbo），升级需要通过 LLM_CASCADE 显式配置。
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from hedging import HedgedCaller, StageTimeout
+
+logger = logging.getLogger(__name__)
+
+# 默认只有一级：第一级若与基线模型相同，升级只会增加成本和延迟；
+# 需要级联时通过 LLM_CASCADE 配置一个真正更便宜的第一级
+DEFAULT_CASCADE_TIERS = [
+    {"name": "default", "model": "gpt-3.5-turbo"},
+]
+
+# 回答中出现这些短语时视为未能回答（提示词要求模型在上下文不足时这样回答）
+IDK_PHRASES = ("i don't know", "i do not know")
+
+
+def is_idk_answer(text: str) -> bool:
+    """判断回答是否为 "I don't know" 类回答"""
+    lowered = (text or "").lower().replace("’", "'")
+    return any(phrase in lowered for phrase in IDK_PHRASES)
+
+
+class ModelCascade:
+    """
+    按级联配置依次尝试各级模型
+
+    各级模型实例按需创建并复用；统计信息线程安全
+    """
+
+    def __init__(
+        self,
+        tiers: List[Dict],
+        llm_factory: Callable[[Dict], Any],
+        timeout: Optional[float] = None,
+        hedge: bool = False,
+        hedge_percentile: float = 95,
+        embedding_backend: Optional[str] = None
+    ):
+        """
+        Args:
+            tiers: 级联配置（至少一级）
+            llm_factory: 根据一级配置创建 LangChain 聊天模型
+            timeout: 每一级 LLM 调用的默认截止时间（秒），None 表示不限制
+            hedge: 是否默认发出对冲请求（见 hedging.py）
+            hedge_percentile: 触发对冲的延迟分位数
+            embedding_backend: 当前 embedding 后端名称，用于选择按后端配置的 min_score
+
+        Raises:
+            ValueError: 级联配置为空
+        """
+        if not tiers:
+            raise ValueError("Model cascade needs at least one tier")
+        self.tiers = [dict(tier, name=tier.get("name") or tier["model"]) for tier in tiers]
+        self.llm_factory = llm_factory
+        self.embedding_backend = embedding_backend
+        # 每一级的模型延迟不同，各自统计延迟分布
+        self._callers = {
+            tier["name"]: HedgedCaller(
+                f"llm:{tier['name']}",
+                timeout=tier.get("timeout", timeout),
+                hedge=tier.get("hedge", hedge),
+                hedge_percentile=hedge_percentile
+            )
+            for tier in self.tiers
+        }
+        self._llms: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._questions = 0
+        self._escalations: Dict[str, int] = {
+            "low_confidence": 0, "context_too_large": 0, "idk": 0, "error": 0, "timeout": 0
+        }
+        self._tier_stats = {
+            tier["name"]: {"calls": 0, "answered": 0, "seconds": 0.0}
+            for tier in self.tiers
+        }
+
+    def _get_llm(self, tier: Dict):
+        with self._lock:
+            llm = self._llms.get(tier["name"])
+            if llm is None:
+                llm = self.llm_factory(tier)
+                self._llms[tier["name"]] = llm
+            return llm
+
+    def _min_score(self, tier: Dict) -> Optional[float]:
+        """本级对当前 embedding 后端的置信度阈值"""
+        min_score = tier.get("min_score")
+        if isinstance(min_score, dict):
+            return min_score.get(self.embedding_backend)
+        return min_score
+
+    def _skip_reason(self, tier: Dict, top_score: Optional[float], context_chars: int) -> Optional[str]:
+        """本级是否应直接跳过（置信度或上下文大小不满足条件）"""
+        min_score = self._min_score(tier)
+        if min_score is not None and (top_score is None or top_score < min_score):
+            return "low_confidence"
+        max_chars = tier.get("max_context_chars")
+        if max_chars is not None and context_chars > max_chars:
+            return "context_too_large"
+        return None
+
+    def _record(self, tier_name: str, seconds: float, answered: bool):
+        with self._lock:
+            stats = self._tier_stats[tier_name]
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["answered"] += answered
+
+    def _escalate(self, tier_name: str, reason: str):
+        with self._lock:
+            self._escalations[reason] += 1
+        logger.info(f"Cascade escalated past tier {tier_name}: {reason}")
+
+    def _start(self):
+        with self._lock:
+            self._questions += 1
+
+    def invoke(self, prompt_value, top_score: Optional[float], context_chars: int):
+        """
+        按级联回答
+
+        Args:
+            prompt_value: 已填充的提示词
+            top_score: 检索结果的最高相似度（没有检索结果时为 None）
+            context_chars: 上下文字符数
+
+        Returns:
+            回答消息，response_metadata["cascade_tier"] 为实际回答的级别
+        """
+        self._start()
+        last = len(self.tiers) - 1
+        for i, tier in enumerate(self.tiers):
+            if i < last:
+                reason = self._skip_reason(tier, top_score, context_chars)
+                if reason:
+                    self._escalate(tier["name"], reason)
+                    continue
+            t0 = time.perf_counter()
+            try:
+                response = self._callers[tier["name"]].call(self._get_llm(tier).invoke, prompt_value)
+            except Exception as e:
+                self._record(tier["name"], time.perf_counter() - t0, False)
+                if i == last:
+                    raise
+                logger.warning(f"Cascade tier {tier['name']} failed: {e}")
+                self._escalate(tier["name"], "timeout" if isinstance(e, StageTimeout) else "error")
+                continue
+            if self._accept(tier, i == last, response, time.perf_counter() - t0):
+                return response
+
+    async def ainvoke(self, prompt_value, top_score: Optional[float], context_chars: int):
+        """invoke() 的异步版本"""
+        self._start()
+        last = len(self.tiers) - 1
+        for i, tier in enumerate(self.tiers):
+            if i < last:
+                reason = self._skip_reason(tier, top_score, context_chars)
+                if reason:
+                    self._escalate(tier["name"], reason)
+                    continue
+            t0 = time.perf_counter()
+            llm = self._get_llm(tier)
+            try:
+                response = await self._callers[tier["name"]].acall(lambda: llm.ainvoke(prompt_value))
+            except Exception as e:
+                self._record(tier["name"], time.perf_counter() - t0, False)
+                if i == last:
+                    raise
+                logger.warning(f"Cascade tier {tier['name']} failed: {e}")
+                self._escalate(tier["name"], "timeout" if isinstance(e, StageTimeout) else "error")
+                continue
+            if self._accept(tier, i == last, response, time.perf_counter() - t0):
+                return response
+
+    def _accept(self, tier: Dict, is_last: bool, response, seconds: float) -> bool:
+        """记录本级结果，返回是否采用该回答"""
+        if not is_last and is_idk_answer(response.content):
+            self._record(tier["name"], seconds, False)
+            self._escalate(tier["name"], "idk")
+            return False
+        self._record(tier["name"], seconds, True)
+        response.response_metadata["cascade_tier"] = tier["name"]
+        return True
+
+    def get_stats(self) -> dict:
+        """
+        获取级联统计
+
+        Returns:
+            问题数、升级率（未由第一级回答的比例）、各原因的升级次数，
+            以及每一级的调用次数、回答次数、回答占比、平均延迟和对冲/超时统计
+        """
+        with self._lock:
+            questions = self._questions
+            first = self._tier_stats[self.tiers[0]["name"]]
+            tiers = {}
+            for tier in self.tiers:
+                stats = self._tier_stats[tier["name"]]
+                tiers[tier["name"]] = {
+                    "model": tier["model"],
+                    "calls": stats["calls"],
+                    "answered": stats["answered"],
+                    "answer_share": stats["answered"] / questions if questions else 0.0,
+                    "avg_seconds": stats["seconds"] / stats["calls"] if stats["calls"] else 0.0,
+                    "hedging": self._callers[tier["name"]].get_stats(),
+                }
+            return {
+                "questions": questions,
+                "escalation_rate": 1 - first["answered"] / questions if questions else 0.0,
+                "escalations": dict(self._escalations),
+                "tiers": tiers,
+            }
@@ -0,0 +1,117 @@
+"""
+偏移量文本分割模块
+一次线性扫描计算文本块边界，只返回 (start, end) 偏移量，不复制子串
+
+切分规则与 RecursiveCharacterTextSplitter 相近：优先在段落（\\n\\n）处断开，
+其次是换行、空格，最后按字符硬切；相邻文本块之间保留不超过 chunk_overlap 的重叠，
+重叠部分同样从分隔符处开始。文本块首尾的空白会被去掉。
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+# 分隔符优先级
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+# 切分规则版本（写入索引指纹，规则变化时旧索引不再匹配）
+SPLITTER_VERSION = "offset-v1"
+
+
+class OffsetTextSplitter:
+    """按偏移量切分文本的分割器"""
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        separators: Optional[Sequence[str]] = None
+    ):
+        """
+        Args:
+            chunk_size: 文本块最大字符数
+            chunk_overlap: 相邻文本块的最大重叠字符数
+            separators: 分隔符（按优先级），最后一个应为 "" 表示允许硬切
+
+        Raises:
+            ValueError: chunk_overlap 不小于 chunk_size
+        """
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = max(0, chunk_overlap)
+        self.separators = tuple(separators or DEFAULT_SEPARATORS)
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """
+        计算文本块边界
+
+        Args:
+            text: 待切分的文本
+
+        Returns:
+            [(start, end), ...]，text[start:end] 即文本块内容
+        """
+        n = len(text)
+        spans = []
+        start = self._skip_whitespace(text, 0)
+        while start < n:
+            if start + self.chunk_size >= n:
+                end = self._strip_end(text, start, n)
+                if end > start:
+                    spans.append((start, end))
+                break
+
+            end, level = self._find_break(text, start)
+            stripped_end = self._strip_end(text, start, end)
+            if stripped_end > start:
+                spans.append((start, stripped_end))
+            start = self._skip_whitespace(text, self._overlap_start(text, start, end, level))
+        return spans
+
+    def split_text(self, text: str) -> List[str]:
+        """按偏移量切分并返回文本块内容（兼容 LangChain 分割器接口）"""
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def _find_break(self, text: str, start: int) -> Tuple[int, int]:
+        """
+        在 [start, start + chunk_size] 内寻找优先级最高的最后一个分隔符
+
+        断点至少位于重叠窗口之后，保证下一个文本块的起点向前推进
+
+        Returns:
+            (断点位置, 分隔符级别)
+        """
+        limit = start + self.chunk_size
+        lowest = start + self.chunk_overlap + 1
+        for level, sep in enumerate(self.separators):
+            if not sep:
+                return limit, level
+            index = text.rfind(sep, lowest, limit)
+            if index != -1:
+                return index, level
+        return limit, len(self.separators)
+
+    def _overlap_start(self, text: str, start: int, end: int, level: int) -> int:
+        """下一个文本块的起点：重叠窗口内第一个同级或更细的分隔符之后"""
+        lowest = max(start + 1, end - self.chunk_overlap)
+        if self.chunk_overlap == 0:
+            return end
+        for sep in self.separators[level:]:
+            if not sep:
+                break
+            index = text.find(sep, lowest, end)
+            if index != -1:
+                return index + len(sep)
+        return lowest
+
+    @staticmethod
+    def _skip_whitespace(text: str, pos: int) -> int:
+        n = len(text)
+        while pos < n and text[pos].isspace():
+            pos += 1
+        return pos
+
+    @staticmethod
+    def _strip_end(text: str, start: int, end: int) -> int:
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return end
@@ -0,0 +1,121 @@
+"""
+页面文本缓存模块
+把 PDF 解析结果（页码、页面标签和文本）按文件内容哈希压缩缓存到磁盘，
+重新分块或重建向量库时跳过 PDF 解析
+
+缓存只用于基础课程 PDF（用户上传的文档不写入共享缓存），总大小超过上限时按最近使用时间淘汰
+"""
+
+import os
+import gzip
+import json
+import logging
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 缓存条目格式版本，格式变化时旧条目自动失效
+CACHE_FORMAT = 2
+
+# 缓存条目文件名后缀
+ENTRY_SUFFIX = ".json.gz"
+
+
+class PageTextCache:
+    """按 (文件 SHA256, 加载器版本) 缓存 PDF 页面文本的磁盘缓存"""
+
+    def __init__(self, cache_dir: str = "./.cache/pages", max_bytes: Optional[int] = 1024 * 1024 * 1024):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），None 表示不限制
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, file_hash: str, loader_version: str) -> str:
+        return os.path.join(self.cache_dir, f"{file_hash}.{loader_version}.f{CACHE_FORMAT}{ENTRY_SUFFIX}")
+
+    def get(self, file_hash: str, loader_version: str) -> Optional[Tuple[List[Tuple[int, str, str]], int]]:
+        """
+        读取缓存的页面
+
+        缓存只保存与文件路径无关的内容，相同内容的文件位于不同路径时共用同一条目
+
+        Args:
+            file_hash: 文件内容 SHA256
+            loader_version: 加载器版本
+
+        Returns:
+            ([(页码, 页面标签, 文本), ...], 总页数)，未命中时返回 None
+        """
+        cache_path = self._cache_path(file_hash, loader_version)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            # 修改时间记录最近一次使用，淘汰时按它排序
+            os.utime(cache_path)
+            return [tuple(page) for page in entry["pages"]], entry["total_pages"]
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable page cache entry {cache_path}: {e}")
+            return None
+
+    def put(self, file_hash: str, loader_version: str, pages: List[Tuple[int, str, str]], total_pages: int):
+        """
+        写入页面缓存
+
+        Args:
+            file_hash: 文件内容 SHA256
+            loader_version: 加载器版本
+            pages: [(页码, 页面标签, 文本), ...]
+            total_pages: 总页数
+        """
+        cache_path = self._cache_path(file_hash, loader_version)
+        tmp_path = f"{cache_path}.tmp"
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump({"total_pages": total_pages, "pages": pages}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to write page cache entry {cache_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.prune()
+
+    def prune(self) -> int:
+        """
+        按最近使用时间淘汰条目，直到总大小不超过 max_bytes
+
+        Returns:
+            删除的条目数
+        """
+        if self.max_bytes is None:
+            return 0
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} page cache entries from {self.cache_dir}")
+        return removed
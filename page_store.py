@@ -0,0 +1,184 @@
+"""
+页面文本存储模块
+每个页面的文本只用 zlib 压缩保存一份（SQLite），向量库中的文本块只记录
+(doc_id, page, start, end) 偏移量，构造上下文时才按偏移量取出文本
+"""
+
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 页面存储的默认文件名（位于向量库持久化目录中）
+PAGE_STORE_FILE = "pages.sqlite3"
+
+
+class PageStore:
+    """
+    压缩页面文本存储
+
+    - 以 (doc_id, page) 为键，文本用 zlib 压缩
+    - 最近读取的页面解压后保存在 LRU 中，同一页面的多个文本块只解压一次
+    - 单连接加锁，可在多个线程中使用
+    """
+
+    def __init__(self, db_path: str, cache_pages: int = 256):
+        """
+        Args:
+            db_path: SQLite 文件路径
+            cache_pages: 解压页面 LRU 缓存的最大页数
+        """
+        self.db_path = db_path
+        self.cache_pages = cache_pages
+        self._cache: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "doc_id TEXT NOT NULL, page INTEGER NOT NULL, text BLOB NOT NULL, "
+            "PRIMARY KEY (doc_id, page))"
+        )
+        self._conn.commit()
+
+    def put_pages(self, doc_id: str, pages: Iterable[Tuple[int, str]]):
+        """
+        写入一个文档的所有页面（替换该文档已有的页面）
+
+        Args:
+            doc_id: 文档 ID
+            pages: [(页码, 文本), ...]
+        """
+        rows = [(doc_id, page, zlib.compress(text.encode("utf-8"))) for page, text in pages]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+                self._conn.executemany("INSERT INTO pages (doc_id, page, text) VALUES (?, ?, ?)", rows)
+            self._evict_doc(doc_id)
+
+    def get_page(self, doc_id: str, page: int) -> Optional[str]:
+        """
+        读取页面文本
+
+        Args:
+            doc_id: 文档 ID
+            page: 页码
+
+        Returns:
+            页面文本，不存在时返回 None
+        """
+        key = (doc_id, page)
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                return text
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE doc_id = ? AND page = ?", (doc_id, page)
+            ).fetchone()
+            if row is None:
+                return None
+            text = zlib.decompress(row[0]).decode("utf-8")
+            if self.cache_pages > 0:
+                self._cache[key] = text
+                while len(self._cache) > self.cache_pages:
+                    self._cache.popitem(last=False)
+            return text
+
+    def get_span(self, doc_id: str, page: int, start: int, end: int) -> Optional[str]:
+        """
+        按偏移量取出文本块内容
+
+        Returns:
+            文本块内容，页面不存在时返回 None
+        """
+        text = self.get_page(doc_id, page)
+        return None if text is None else text[start:end]
+
+    def add_pages(self, doc_id: str, pages: Iterable[Tuple[int, str]]):
+        """
+        写入文档的部分页面（保留该文档的其他页面，用于分批索引）
+
+        Args:
+            doc_id: 文档 ID
+            pages: [(页码, 文本), ...]
+        """
+        rows = [(doc_id, page, zlib.compress(text.encode("utf-8"))) for page, text in pages]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO pages (doc_id, page, text) VALUES (?, ?, ?)", rows)
+            self._evict_doc(doc_id)
+
+    def get_doc_pages(self, doc_id: str) -> List[Tuple[int, str]]:
+        """
+        读取一个文档的所有页面（不经过 LRU 缓存）
+
+        Returns:
+            [(页码, 文本), ...]，按页码排序
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, text FROM pages WHERE doc_id = ? ORDER BY page", (doc_id,)
+            ).fetchall()
+        return [(page, zlib.decompress(text).decode("utf-8")) for page, text in rows]
+
+    def delete_doc(self, doc_id: str):
+        """删除一个文档的所有页面"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+            self._evict_doc(doc_id)
+
+    def clear(self):
+        """删除所有页面"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM pages")
+            self._cache.clear()
+
+    def doc_ids(self) -> List[str]:
+        """所有已保存文档的 ID"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT doc_id FROM pages")]
+
+    def doc_digests(self) -> Dict[str, str]:
+        """
+        每个文档的页面摘要（页码和压缩文本按页码顺序计算 SHA-1）
+
+        页面集合或任一页内容不同的文档摘要不同，用于比较两个页面存储（见 migration.py）
+
+        Returns:
+            {文档 ID: 摘要}
+        """
+        digests: dict = {}
+        with self._lock:
+            for doc_id, page, text in self._conn.execute("SELECT doc_id, page, text FROM pages ORDER BY doc_id, page"):
+                digest = digests.setdefault(doc_id, hashlib.sha1())
+                digest.update(f"{page}:{len(text)}:".encode("utf-8"))
+                digest.update(text)
+        return {doc_id: digest.hexdigest() for doc_id, digest in digests.items()}
+
+    def stats(self) -> dict:
+        """
+        存储统计
+
+        Returns:
+            文档数、页面数和压缩后的文本字节数
+        """
+        with self._lock:
+            docs, pages, size = self._conn.execute(
+                "SELECT COUNT(DISTINCT doc_id), COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM pages"
+            ).fetchone()
+        return {"docs": docs, "pages": pages, "compressed_bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict_doc(self, doc_id: str):
+        for key in [key for key in self._cache if key[0] == doc_id]:
+            del self._cache[key]
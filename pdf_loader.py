@@ -0,0 +1,291 @@
+"""
+PDF 加载模块
+负责把单个 PDF 文件解析为带元数据的页面文档（或索引流水线使用的紧凑页面记录）
+"""
+
+import os
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata as importlib_metadata
+from typing import Dict, List, Optional, Sequence, Tuple
+from pypdf import PdfReader, PdfWriter
+from langchain_community.document_loaders import UnstructuredPDFLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from page_cache import PageTextCache
+from chunk_records import MetadataTable, PageRecord, record_to_document
+from utils import calculate_path_hash
+
+try:
+    _PYPDF_VERSION = importlib_metadata.version("pypdf")
+except importlib_metadata.PackageNotFoundError:
+    _PYPDF_VERSION = "unknown"
+
+# 加载逻辑或 pypdf 版本变化时页面缓存自动失效
+LOADER_VERSION = f"v2-pypdf{_PYPDF_VERSION}"
+
+# 文本层少于该字符数（去掉空白后）的页面视为扫描页，交给 Unstructured 处理
+MIN_PAGE_TEXT_CHARS = 20
+
+# 并行处理慢路径页面的线程数
+SLOW_PATH_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def _has_text_layer(text: str) -> bool:
+    """判断页面是否有可用的文本层"""
+    return len("".join(text.split())) >= MIN_PAGE_TEXT_CHARS
+
+
+def _write_single_page(reader: PdfReader, page_index: int) -> str:
+    """
+    把单个页面写入临时 PDF 文件
+
+    Args:
+        reader: 已打开的 PdfReader
+        page_index: 页码（从 0 开始）
+
+    Returns:
+        临时文件路径（调用方负责删除）
+    """
+    writer = PdfWriter()
+    writer.add_page(reader.pages[page_index])
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, 'wb') as f:
+        writer.write(f)
+    return tmp_path
+
+
+def _extract_text_slow(page_path: str) -> str:
+    """用 UnstructuredPDFLoader 提取单页 PDF 的文本（OCR / 版面分析）"""
+    docs = UnstructuredPDFLoader(page_path).load()
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def _load_pages_with_triage(
+    file_path: str,
+    page_indices: Optional[Sequence[int]] = None
+) -> Tuple[List[Tuple[int, str, str]], int]:
+    """
+    逐页提取文本，只把有问题的页面交给慢路径
+
+    先用 pypdf 提取每一页；提取出错或没有可用文本层的页面
+    并行交给 UnstructuredPDFLoader，其余页面直接使用 pypdf 的结果
+
+    Args:
+        file_path: PDF 文件路径
+        page_indices: 只提取这些页（从 0 开始），None 表示全部页面
+
+    Returns:
+        ([(页码, 页面标签, 文本), ...], 总页数)，跳过没有文本的页面
+    """
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    try:
+        page_labels = list(reader.page_labels)
+    except Exception:
+        page_labels = [str(i + 1) for i in range(total_pages)]
+
+    if page_indices is None:
+        page_indices = range(total_pages)
+    texts: Dict[int, str] = {}
+    slow_pages: List[int] = []
+    for i in sorted(set(page_indices)):
+        if not 0 <= i < total_pages:
+            continue
+        try:
+            text = reader.pages[i].extract_text() or ""
+        except Exception as e:
+            logger.warning(f"pypdf failed on {file_path} page {i + 1}: {e}")
+            text = ""
+        texts[i] = text
+        if not _has_text_layer(text):
+            slow_pages.append(i)
+
+    if slow_pages:
+        logger.info(f"{file_path}: {len(slow_pages)}/{len(texts)} pages need the slow loader")
+        # PdfReader 不是线程安全的，先顺序拆出单页文件，再并行交给 Unstructured
+        page_paths = {}
+        try:
+            for i in slow_pages:
+                try:
+                    page_paths[i] = _write_single_page(reader, i)
+                except Exception as e:
+                    logger.warning(f"Failed to extract page {i + 1} of {file_path}: {e}")
+
+            if page_paths:
+                with ThreadPoolExecutor(max_workers=min(SLOW_PATH_WORKERS, len(page_paths))) as executor:
+                    futures = {i: executor.submit(_extract_text_slow, path) for i, path in page_paths.items()}
+                    for i, future in futures.items():
+                        try:
+                            slow_text = future.result()
+                            if len(slow_text.strip()) > len(texts[i].strip()):
+                                texts[i] = slow_text
+                        except Exception as e:
+                            logger.warning(f"UnstructuredPDFLoader failed on {file_path} page {i + 1}: {e}")
+        finally:
+            for path in page_paths.values():
+                os.remove(path)
+
+    pages = []
+    for i, text in texts.items():
+        if not text.strip():
+            continue
+        pages.append((i, page_labels[i] if i < len(page_labels) else str(i + 1), text))
+    return pages, total_pages
+
+
+def _load_pages_with_unstructured(file_path: str) -> Tuple[List[Tuple[int, str, str]], int]:
+    """pypdf 无法打开文件时整体交给 UnstructuredPDFLoader，返回格式同 _load_pages_with_triage"""
+    docs = UnstructuredPDFLoader(file_path).load()
+    pages = [
+        (i, str(i + 1), doc.page_content)
+        for i, doc in enumerate(docs)
+        if doc.page_content.strip()
+    ]
+    return pages, len(docs)
+
+
+def pdf_page_plan(file_path: str, first_pages: int) -> Tuple[int, List[int]]:
+    """
+    为分批索引规划优先页面：前 first_pages 页，加上目录（书签）中顶层条目指向的章节首页
+
+    Args:
+        file_path: PDF 文件路径
+        first_pages: 优先索引的开头页数
+
+    Returns:
+        (总页数, 按页码排序的优先页面)
+
+    Raises:
+        Exception: pypdf 无法打开文件
+    """
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    priority = set(range(min(first_pages, total_pages)))
+    try:
+        for item in reader.outline:
+            # 嵌套列表是下级目录，只取顶层章节
+            if isinstance(item, list):
+                continue
+            page = reader.get_destination_page_number(item)
+            if page is not None and 0 <= page < total_pages:
+                priority.add(page)
+    except Exception as e:
+        logger.debug(f"Could not read the outline of {file_path}: {e}")
+    return total_pages, sorted(priority)
+
+
+def load_pdf_pages(
+    file_path: str,
+    metadata_table: MetadataTable,
+    source_type: str = "base",
+    additional_metadata: Optional[dict] = None,
+    page_cache: Optional[PageTextCache] = None,
+    page_indices: Optional[Sequence[int]] = None
+) -> List[PageRecord]:
+    """
+    加载单个 PDF 文件为紧凑的页面记录
+
+    逐页分流：pypdf 能提取文本层的页面直接使用，出错或无文本层的页面才交给
+    UnstructuredPDFLoader；只有 pypdf 完全无法打开文件时才整体回退到 Unstructured。
+    提供 page_cache 时先按文件内容哈希查找已解析的页面，命中则跳过解析。
+
+    文件级元数据（source、total_pages、source_type 和额外元数据）只在
+    metadata_table 中驻留一份，页面记录通过 ID 引用
+
+    Args:
+        file_path: PDF 文件路径
+        metadata_table: 元数据驻留表
+        source_type: 文档来源类型 ("base" 或 "user")
+        additional_metadata: 额外的元数据（用于用户上传文档）
+        page_cache: 页面文本缓存
+        page_indices: 只加载这些页（从 0 开始，用于分批索引），None 表示全部页面；
+            部分加载只读取页面缓存，不写入
+
+    Returns:
+        页面记录列表
+
+    Raises:
+        RuntimeError: 两种加载器都无法打开文件
+    """
+    cached = None
+    file_hash = None
+    if page_cache is not None:
+        file_hash = calculate_path_hash(file_path)
+        cached = page_cache.get(file_hash, LOADER_VERSION)
+
+    if cached is not None:
+        pages, total_pages = cached
+        if page_indices is not None:
+            wanted = set(page_indices)
+            pages = [page for page in pages if page[0] in wanted]
+    else:
+        try:
+            pages, total_pages = _load_pages_with_triage(file_path, page_indices)
+        except Exception as e1:
+            logger.warning(f"pypdf could not open {file_path}, falling back to UnstructuredPDFLoader: {e1}")
+            try:
+                pages, total_pages = _load_pages_with_unstructured(file_path)
+            except Exception as e2:
+                raise RuntimeError(f"pypdf: {e1}; UnstructuredPDFLoader: {e2}") from e2
+            if page_indices is not None:
+                wanted = set(page_indices)
+                pages = [page for page in pages if page[0] in wanted]
+        if page_cache is not None and page_indices is None:
+            page_cache.put(file_hash, LOADER_VERSION, pages, total_pages)
+
+    metadata = {"source": file_path, "total_pages": total_pages, "source_type": source_type}
+    if additional_metadata:
+        metadata.update(additional_metadata)
+    meta_id = metadata_table.intern(metadata)
+
+    return [PageRecord(meta_id, page, page_label, text) for page, page_label, text in pages]
+
+
+def load_pdf_file(
+    file_path: str,
+    source_type: str = "base",
+    additional_metadata: Optional[dict] = None,
+    page_cache: Optional[PageTextCache] = None
+) -> List[Document]:
+    """
+    加载单个 PDF 文件为页面文档
+
+    加载逻辑同 load_pdf_pages，每页返回一个带完整元数据的 LangChain Document
+    （source、page、page_label、total_pages、source_type 以及额外元数据）
+
+    Args:
+        file_path: PDF 文件路径
+        source_type: 文档来源类型 ("base" 或 "user")
+        additional_metadata: 额外的元数据（用于用户上传文档）
+        page_cache: 页面文本缓存
+
+    Returns:
+        页面文档列表
+
+    Raises:
+        RuntimeError: 两种加载器都无法打开文件
+    """
+    table = MetadataTable()
+    pages = load_pdf_pages(file_path, table, source_type, additional_metadata, page_cache)
+    return [record_to_document(page, table) for page in pages]
+
+
+def create_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 200) -> RecursiveCharacterTextSplitter:
+    """
+    创建文本分割器
+
+    Args:
+        chunk_size: 文本块大小
+        chunk_overlap: 文本块重叠大小
+
+    Returns:
+        文本分割器
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
@@ -0,0 +1,195 @@
+"""
+请求级性能剖析模块
+按比例抽样请求，或保留所有超过延迟阈值的请求，用 cProfile 记录调用开销。
+每个剖析结果写成 .prof 文件（pstats 格式，可用 snakeviz、flameprof 等工具生成火焰图），
+同名 .json 文件记录请求元数据、耗时和开销最大的函数；目录中的文件数量有上限，旧文件自动轮转删除。
+
+默认关闭，通过环境变量启用：
+    RAG_PROFILE_SAMPLE_RATE  抽样比例（0~1）
+    RAG_PROFILE_SLOW_SECONDS 延迟阈值（秒），超过阈值的请求都会保留剖析结果
+    RAG_PROFILE_DIR          输出目录（默认 ./.profiles）
+    RAG_PROFILE_MAX_FILES    保留的剖析结果数量上限（默认 50）
+
+设置延迟阈值时，是否超过阈值只能在请求结束后得知，因此每个请求都会在剖析下运行，
+只有超过阈值或被抽中的结果才会写入磁盘。同一时间只剖析一个请求，其余请求照常执行。
+"""
+
+import os
+import io
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认输出目录
+DEFAULT_PROFILE_DIR = "./.profiles"
+
+# JSON 元数据中记录的开销最大函数数量
+TOP_FUNCTIONS = 25
+
+
+class RequestProfiler:
+    """抽样或按延迟阈值剖析请求"""
+
+    def __init__(
+        self,
+        output_dir: str = DEFAULT_PROFILE_DIR,
+        sample_rate: float = 0.0,
+        slow_threshold: Optional[float] = None,
+        max_files: int = 50,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            output_dir: 剖析结果目录
+            sample_rate: 抽样比例（0~1）
+            slow_threshold: 延迟阈值（秒），None 表示不按延迟保留
+            max_files: 保留的剖析结果数量上限
+            seed: 抽样随机种子
+        """
+        self.output_dir = output_dir
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.slow_threshold = slow_threshold
+        self.max_files = max(1, max_files)
+        self._rng = random.Random(seed)
+        self._busy = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "profiled": 0, "saved": 0, "skipped_busy": 0}
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        """是否可能剖析任何请求"""
+        return self.sample_rate > 0 or self.slow_threshold is not None
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def run(self, kind: str, fn: Callable[[], Any], metadata: Optional[Dict] = None) -> Any:
+        """
+        执行 fn，按配置决定是否剖析并保存结果
+
+        Args:
+            kind: 请求类型（如 "answer"、"add_user_document"），用于文件名
+            fn: 实际执行的函数
+            metadata: 写入 JSON 的请求元数据
+
+        Returns:
+            fn 的返回值（fn 的异常原样抛出）
+        """
+        self._count("requests")
+        with self._stats_lock:
+            sampled = self._rng.random() < self.sample_rate
+        if not (sampled or self.slow_threshold is not None):
+            return fn()
+        # cProfile 同一时间只能有一个活动的剖析器（Python 3.12+），忙时不剖析
+        if not self._busy.acquire(blocking=False):
+            self._count("skipped_busy")
+            return fn()
+
+        self._count("profiled")
+        profile = cProfile.Profile()
+        error = None
+        t0 = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                return fn()
+            finally:
+                profile.disable()
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            try:
+                slow = self.slow_threshold is not None and elapsed >= self.slow_threshold
+                if sampled or slow:
+                    self._save(profile, kind, elapsed, "slow" if slow else "sampled", metadata, error)
+            except Exception as e:
+                logger.warning(f"Failed to save profile for {kind}: {e}")
+            finally:
+                self._busy.release()
+
+    def _save(self, profile: cProfile.Profile, kind: str, elapsed: float, reason: str,
+              metadata: Optional[Dict], error: Optional[str]):
+        """写出 .prof 和 .json，并轮转旧文件"""
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        base = os.path.join(self.output_dir, f"{stamp}-{kind}-{int(elapsed * 1000)}ms")
+        profile.dump_stats(f"{base}.prof")
+
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        record = {
+            "kind": kind,
+            "reason": reason,
+            "elapsed_seconds": round(elapsed, 4),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "error": error,
+            "metadata": metadata or {},
+            "top_cumulative": [
+                {
+                    "function": f"{os.path.basename(filename)}:{line}({name})",
+                    "calls": calls,
+                    "tottime": round(tottime, 4),
+                    "cumtime": round(cumtime, 4),
+                }
+                for (filename, line, name), (_, calls, tottime, cumtime, _) in top
+            ],
+        }
+        with open(f"{base}.json", 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2, default=str)
+        self._count("saved")
+        logger.info(f"Saved {reason} profile for {kind} ({elapsed:.2f}s): {base}.prof")
+        self._rotate()
+
+    def _rotate(self):
+        """只保留最新的 max_files 个剖析结果"""
+        profiles = sorted(
+            (name for name in os.listdir(self.output_dir) if name.endswith(".prof")),
+            reverse=True
+        )
+        for name in profiles[self.max_files:]:
+            base = os.path.join(self.output_dir, name[:-len(".prof")])
+            for path in (f"{base}.prof", f"{base}.json"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def get_stats(self) -> dict:
+        """
+        获取剖析统计
+
+        Returns:
+            请求数、实际剖析数、保存数、因已有剖析进行中而跳过的数量
+        """
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+def create_profiler_from_env() -> Optional[RequestProfiler]:
+    """
+    按环境变量创建剖析器
+
+    Returns:
+        RequestProfiler；未设置抽样比例和延迟阈值时返回 None
+    """
+    sample_rate = float(os.environ.get("RAG_PROFILE_SAMPLE_RATE") or 0)
+    slow_seconds = os.environ.get("RAG_PROFILE_SLOW_SECONDS")
+    if sample_rate <= 0 and not slow_seconds:
+        return None
+    return RequestProfiler(
+        output_dir=os.environ.get("RAG_PROFILE_DIR", DEFAULT_PROFILE_DIR),
+        sample_rate=sample_rate,
+        slow_threshold=float(slow_seconds) if slow_seconds else None,
+        max_files=int(os.environ.get("RAG_PROFILE_MAX_FILES", 50))
+    )
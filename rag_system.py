@@ -3,16 +3,34 @@ RAG 系统核心模块
 实现双向量库架构、文档索引、检索功能
 """
 
-import os, logging
-from typing import List, Tuple, Optional
-import streamlit as st
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader, UnstructuredPDFLoader
+import os, json, time, shutil, logging, hashlib, threading, asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple, Optional, Sequence, Union
 from langchain_chroma import Chroma
+from chromadb.api.shared_system_client import SharedSystemClient
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.runnables import RunnableLambda
+from langchain_openai import ChatOpenAI
+from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
+from embeddings import CachedQueryEmbeddings, create_embedding_backend, normalize_query
+from pdf_loader import load_pdf_pages, pdf_page_plan
+from offset_splitter import OffsetTextSplitter
+from page_store import PageStore, PAGE_STORE_FILE
+from chunk_records import MetadataTable, record_to_document, split_page_records
+from ingestion_pipeline import IngestionPipeline
+from chunk_registry import ChunkRegistry, chunk_page
+from page_cache import PageTextCache
+from index_artifact import install_artifact, index_fingerprint, DEFAULT_ARTIFACT_PATH
+from build_checkpoint import BuildCheckpoint, CHECKPOINT_FILE, promote_directory
+from singleflight import SingleFlight
+from file_lock import FileLock, FileLockError, INDEX_LOCK_FILE
+from model_cascade import ModelCascade, DEFAULT_CASCADE_TIERS
+from profiling import RequestProfiler, create_profiler_from_env
+from hedging import HedgedCaller, LatencyTracker
+from migration import active_generation, EmbeddingMigration, GenerationGate, DEFAULT_INDEX_ROOT, GENERATION_FILE
+from shard_router import ShardRouter, SHARD_MANIFEST_FILE, course_of, shard_collection_name, collection_centroid
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,18 +39,58 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# 未指定用户时使用的默认分区
+DEFAULT_USER_ID = "default"
+
+
+def user_collection_name(user_id: str) -> str:
+    """
+    根据用户 ID 生成用户向量库分区的 collection 名称
+
+    Chroma 对 collection 名称有字符和长度限制，这里使用哈希保证合法且稳定
+
+    Args:
+        user_id: 用户或会话 ID
+
+    Returns:
+        collection 名称
+    """
+    user_hash = hashlib.md5(user_id.encode("utf-8")).hexdigest()[:16]
+    return f"user-{user_hash}"
+
+
+def release_chroma_client(persist_dir: str):
+    """
+    关闭进程内缓存的某个持久化目录的 Chroma 实例
+
+    Chroma 按目录路径缓存实例，目录被改名或替换后必须先释放，
+    之后按同一路径打开时才会读取新的目录内容
+
+    Args:
+        persist_dir: 持久化目录
+    """
+    target = os.path.abspath(persist_dir)
+    for identifier in list(SharedSystemClient._identifier_to_system):
+        if identifier != "ephemeral" and os.path.abspath(identifier) == target:
+            system = SharedSystemClient._identifier_to_system.pop(identifier)
+            SharedSystemClient._identifier_to_refcount.pop(identifier, None)
+            system.stop()
+
+
 def loadAndIndexFiles(
     file_paths: List[str],
     chunk_size: int = 1000,
     chunk_overlap: int = 200,
     source_type: str = "base",
-    additional_metadata: Optional[dict] = None
+    additional_metadata: Optional[dict] = None,
+    page_cache: Optional[PageTextCache] = None
 ) -> Tuple[List[Document], int]:
     """
     通用文档加载和索引函数
     
-    用于加载PDF文件、分割文本并返回文档片段
-    这个函数被基础向量库和用户向量库共同使用
+    用于加载PDF文件、分割文本并一次性返回所有文档片段
+    向量库索引使用并行的 IngestionPipeline，此函数保留为同步的简单接口；
+    内部使用紧凑记录，只在返回前把文本块转换为 Document
     
     Args:
         file_paths: PDF 文件路径列表
@@ -40,44 +98,171 @@ def loadAndIndexFiles(
         chunk_overlap: 文本块重叠大小
         source_type: 文档来源类型 ("base" 或 "user")
         additional_metadata: 额外的元数据（用于用户上传文档）
+        page_cache: 页面文本缓存，命中的文件跳过 PDF 解析
         
     Returns:
         (文档片段列表, 原始文档数量)
     """
-    all_docs = []
+    metadata_table = MetadataTable()
+    all_pages = []
     
     # 加载所有PDF文件
     for file_path in file_paths:
         try:
-            try:
-                docs = PyPDFLoader(file_path).load()
-                loader_used = "PyPDFLoader"
-            except Exception as e1:
-                docs = UnstructuredPDFLoader(file_path).load()
-                loader_used = "UnstructuredPDFLoader"
-
-            for doc in docs:
-                doc.metadata["source_type"] = source_type
-                if additional_metadata:
-                    doc.metadata.update(additional_metadata)
-
-            all_docs.extend(docs)
-
-        except Exception as e2:
-            st.error(f"❌ {loader_used} 加载失败 {file_path}: {e2}")
+            all_pages.extend(load_pdf_pages(file_path, metadata_table, source_type, additional_metadata, page_cache))
+        except Exception as e:
+            logger.error(f"❌ 加载失败 {file_path}: {e}")
             continue
 
-    if not all_docs:
+    if not all_pages:
         return [], 0
     
     # 分割文本
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
-    )
-    splits = text_splitter.split_documents(all_docs)
+    text_splitter = OffsetTextSplitter(chunk_size, chunk_overlap)
+    splits = [
+        record_to_document(chunk, metadata_table)
+        for chunk in split_page_records(all_pages, text_splitter)
+    ]
+    
+    return splits, len(all_pages)
+
+
+# 默认检索的文档总数（基础库和用户库合并后的全局前 k 个）
+DEFAULT_TOP_K = 4
+
+# 各阶段的默认截止时间（秒）：查询 embedding、基础库检索、用户库检索、每一级 LLM 调用
+DEFAULT_STAGE_TIMEOUTS = {"embed": 10.0, "base_search": 5.0, "user_search": 5.0, "llm": 60.0}
+
+# 默认发出对冲请求的阶段（只有远程调用值得对冲）
+DEFAULT_HEDGE_STAGES = ("embed", "llm")
+
+RAG_PROMPT_TEMPLATE = """You are a helpful assistant.
+Answer the question using ONLY the Context below.
+If the answer is not in the Context, say "I don't know based on the provided context."
+
+Context:
+{context}
+
+Question:
+{question}
+"""
+
+
+def format_docs_with_source(docs: List[Document]) -> str:
+    """格式化文档并标记来源"""
+    parts = []
+    for i, d in enumerate(docs, 1):
+        src = d.metadata.get("source", "unknown_source")
+        src_type = d.metadata.get("source_type", "base")
+        page = d.metadata.get("page_label", d.metadata.get("page", "unknown_page"))
+        
+        # 根据来源类型选择图标
+        if src_type == "user":
+            emoji = "📄"
+            original_name = d.metadata.get("original_filename", "Unknown")
+            upload_time = d.metadata.get("upload_time", "Unknown")
+            header = f"{emoji} [{i}] 用户文档：{original_name} (上传于 {upload_time}, p.{page})"
+        else:
+            emoji = "📘"
+            header = f"{emoji} [{i}] 课程材料：{os.path.basename(src)}, p.{page}"
+        
+        text = (d.page_content or "").strip()
+        parts.append(f"{header}\n{text}")
     
-    return splits, len(all_docs)
+    return "\n\n".join(parts)
+
+
+def distance_to_similarity(distance: float, space: str = "l2") -> float:
+    """
+    把 Chroma 的距离换算为余弦相似度
+    
+    Chroma 默认的 L2 空间返回平方欧氏距离；embedding 向量已单位化，
+    此时余弦相似度 = 1 - d / 2。cosine 和 ip 空间的距离为 1 - 余弦相似度
+    
+    Args:
+        distance: Chroma 返回的距离
+        space: collection 的距离空间（"l2"、"cosine" 或 "ip"）
+    """
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    return 1.0 - distance / 2.0
+
+
+def collection_space(collection) -> str:
+    """获取 Chroma collection 的距离空间，未设置时为默认的 l2"""
+    return (getattr(collection, "metadata", None) or {}).get("hnsw:space", "l2")
+
+
+def merge_top_k(
+    candidates: Dict[str, List[Tuple[Document, float]]],
+    k: int,
+    quotas: Optional[Dict[str, int]] = None
+) -> List[Tuple[Document, float]]:
+    """
+    按相似度合并多个向量库的候选文档，返回全局前 k 个
+    
+    各库的分数都已换算为同一 embedding 模型下的余弦相似度，可以直接比较
+    
+    Args:
+        candidates: {库名: [(文档, 相似度), ...]}
+        k: 返回的文档总数
+        quotas: {库名: 至少保留的名额}；该库候选不足时名额让给其他库，名额总和不超过 k
+        
+    Returns:
+        (文档, 相似度) 列表，按相似度从高到低排列
+    """
+    ranked = {
+        store: sorted(items, key=lambda item: item[1], reverse=True)
+        for store, items in candidates.items()
+    }
+    selected: List[Tuple[Document, float]] = []
+    taken = {store: 0 for store in ranked}
+    for store, quota in (quotas or {}).items():
+        reserved = ranked.get(store, [])[:max(0, min(quota, k - len(selected)))]
+        selected.extend(reserved)
+        if store in taken:
+            taken[store] = len(reserved)
+    rest = [item for store, items in ranked.items() for item in items[taken[store]:]]
+    rest.sort(key=lambda item: item[1], reverse=True)
+    selected.extend(rest[:max(0, k - len(selected))])
+    selected.sort(key=lambda item: item[1], reverse=True)
+    return selected
+
+
+def _query_collection_with_distances(
+    collection,
+    query_vectors: List[List[float]],
+    n_results: int
+) -> List[List[Tuple[Document, float]]]:
+    """
+    对 Chroma collection 执行一次多查询向量检索
+    
+    Args:
+        collection: Chroma collection
+        query_vectors: 查询向量列表
+        n_results: 每个查询返回的文档数量
+        
+    Returns:
+        每个查询对应的 (文档, 距离) 列表，按距离从小到大排列
+    """
+    n_results = min(n_results, collection.count())
+    if n_results <= 0:
+        return [[] for _ in query_vectors]
+    
+    results = collection.query(
+        query_embeddings=query_vectors,
+        n_results=n_results,
+        include=["documents", "metadatas", "distances"]
+    )
+    return [
+        [
+            (Document(page_content=text or "", metadata=metadata or {}), distance)
+            for text, metadata, distance in zip(texts, metadatas, distances)
+        ]
+        for texts, metadatas, distances in zip(
+            results["documents"], results["metadatas"], results["distances"]
+        )
+    ]
 
 
 class DualVectorStoreRAG:
@@ -88,7 +273,31 @@ class DualVectorStoreRAG:
         base_persist_dir: str = "./chroma_db/base",
         user_persist_dir: str = "./chroma_db/user",
         base_docs_dir: str = "CourseMaterials",
-        # embedding_model: str = "text-embedding-3-large"
+        max_open_user_stores: int = 32,
+        query_cache_size: int = 1024,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        parse_workers: int = 4,
+        embed_workers: int = 4,
+        page_cache_dir: Optional[str] = "./.cache/pages",
+        page_cache_max_mb: Optional[int] = 1024,
+        embedding_backend: Union[str, Embeddings] = "openai",
+        embedding_model: Optional[str] = None,
+        embedding_dimensions: Optional[int] = None,
+        base_artifact_path: Optional[str] = DEFAULT_ARTIFACT_PATH,
+        base_route_top_n: int = 2,
+        llm_tiers: Optional[List[Dict]] = None,
+        profiler: Optional[RequestProfiler] = None,
+        store_quotas: Optional[Dict[str, int]] = None,
+        stage_timeouts: Optional[Dict[str, Optional[float]]] = None,
+        hedge_stages: Sequence[str] = DEFAULT_HEDGE_STAGES,
+        hedge_percentile: float = 95,
+        progressive_min_pages: int = 60,
+        progressive_first_pages: int = 20,
+        progressive_batch_pages: int = 40,
+        background_index_workers: int = 2,
+        index_root: Optional[str] = None,
+        index_lock: Optional[str] = "shared"
     ):
         """
         初始化双向量库 RAG 系统
@@ -97,260 +306,1491 @@ class DualVectorStoreRAG:
             base_persist_dir: 基础向量库持久化目录
             user_persist_dir: 用户向量库持久化目录
             base_docs_dir: 基础文档目录
-            embedding_model: OpenAI embedding 模型名称
+            max_open_user_stores: 同时保持打开的用户分区数量上限（LRU 淘汰）
+            query_cache_size: 查询向量 LRU 缓存的最大条目数，0 表示不缓存
+            chunk_size: 文本块大小
+            chunk_overlap: 文本块重叠大小
+            parse_workers: 索引流水线的 PDF 解析线程数
+            embed_workers: 索引流水线的并发 embedding 请求数
+            page_cache_dir: 基础 PDF 页面文本缓存目录，None 表示不缓存（用户上传的文档从不缓存）
+            page_cache_max_mb: 页面文本缓存的大小上限（MB），超过时按最近使用时间淘汰，None 表示不限制
+            embedding_backend: embedding 后端名称（"openai" 或本地的 "hashed"），或 Embeddings 实例
+            embedding_model: 后端的模型名称或模型文件路径
+            embedding_dimensions: embedding 输出维度，None 表示使用模型默认维度
+            base_artifact_path: 预构建的基础向量库制品，匹配当前配置时直接解包代替重新向量化
+            base_route_top_n: 每次查询检索的课程分片数量（按质心相似度选择），0 表示检索全部分片
+            llm_tiers: 回答问题的模型级联配置（见 model_cascade.py），默认 DEFAULT_CASCADE_TIERS
+            profiler: 问答和上传请求的性能剖析器（见 profiling.py），None 表示不剖析
+            store_quotas: 检索结果中每个库至少保留的名额（{"base": n, "user": m}），None 表示只按相似度排序
+            stage_timeouts: 各阶段截止时间，覆盖 DEFAULT_STAGE_TIMEOUTS 中的同名项，值为 None 表示不限制
+            hedge_stages: 发出对冲请求的阶段（"embed"、"llm"）
+            hedge_percentile: 调用超过最近延迟的该分位数仍未返回时发出对冲请求
+            progressive_min_pages: 超过该页数的上传文档分批索引，0 表示总是一次性索引
+            progressive_first_pages: 分批索引时同步索引的开头页数（另加目录中的章节首页）
+            progressive_batch_pages: 后台每批索引的页数
+            background_index_workers: 同时进行的后台分批索引任务数
+            index_root: 代指针所在的索引根目录（见 migration.py），设置后 refresh_generation()
+                跟随代指针在进程内切换索引代；None 表示固定使用上面的目录
+            index_lock: 持有用户库目录锁的方式（见 file_lock.py）："shared"（应用和只读工具）、
+                "exclusive"（reconcile.py --apply 等维护操作，其他进程打开索引时抛出 FileLockError）或 None
         """
         self.base_persist_dir = base_persist_dir
         self.user_persist_dir = user_persist_dir
         self.base_docs_dir = base_docs_dir
-        # self.embedding_model = embedding_model
+        self.embedding_backend = embedding_backend if isinstance(embedding_backend, str) else type(embedding_backend).__name__
+        self.embedding_model = embedding_model
+        self.embedding_dimensions = embedding_dimensions
+        self.base_artifact_path = base_artifact_path
         
         # 创建目录
         os.makedirs(base_persist_dir, exist_ok=True)
         os.makedirs(user_persist_dir, exist_ok=True)
         
-        # 初始化 embedding 函数
-        self.embedding_function = OpenAIEmbeddings()
+        # 其他进程的维护工具不会在本进程打开的 PersistentClient 之下删除 collection 或 VACUUM
+        self.index_lock_mode = index_lock
+        self._index_lock = self._acquire_index_lock(user_persist_dir)
+        
+        # 各阶段的截止时间和对冲请求（见 hedging.py）：远程调用慢时降级或重复请求，不让单个慢响应决定整个问题的延迟
+        self.stage_timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {})}
+        self.embed_caller = HedgedCaller(
+            "embed",
+            timeout=self.stage_timeouts["embed"],
+            hedge="embed" in hedge_stages,
+            hedge_percentile=hedge_percentile
+        )
+        self.search_latency = {"base": LatencyTracker(), "user": LatencyTracker()}
+        self.search_timeouts = {"base": 0, "user": 0}
+        self._search_stats_lock = threading.Lock()
+        self._search_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="rag-search")
+        
+        # 初始化 embedding 函数（查询向量经过进程内共享的 LRU 缓存）
+        if isinstance(embedding_backend, str):
+            embedding_backend = create_embedding_backend(embedding_backend, embedding_model, embedding_dimensions)
+        self.embedding_function = CachedQueryEmbeddings(
+            embedding_backend,
+            max_size=query_cache_size,
+            caller=self.embed_caller
+        )
+        
+        # 索引流水线：解析、分割、向量化、写入并行执行
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # 页面文本缓存独立于 chroma_db，删除向量库或调整分块参数后重建无需重新解析 PDF
+        # 用户上传的文档不写入缓存：删除上传后其文本不会残留在共享的缓存目录中
+        self.page_cache = PageTextCache(
+            page_cache_dir,
+            max_bytes=page_cache_max_mb * 1024 * 1024 if page_cache_max_mb is not None else None
+        ) if page_cache_dir else None
+        self.pipeline = IngestionPipeline(
+            embedding_function=self.embedding_function,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            parse_workers=parse_workers,
+            embed_workers=embed_workers,
+            page_cache=self.page_cache
+        )
         
-        # 初始化向量库
-        self.base_vectorstore = None
-        self.user_vectorstore = None
+        # 基础向量库按课程分片，每个课程一个 collection
+        self.base_route_top_n = base_route_top_n
+        self.base_shards: Dict[str, Chroma] = {}
+        self.shard_router = ShardRouter(os.path.join(base_persist_dir, SHARD_MANIFEST_FILE))
         self.base_doc_count = 0
         
-    def initialize_base_vectorstore(self) -> int:
+        # 页面文本只在页面存储中保存一份，向量库中的文本块只记录偏移量；
+        # 基础库目录可能被制品整体替换，因此基础库的页面存储在初始化时才打开
+        self.base_page_store: Optional[PageStore] = None
+        self.user_page_store = PageStore(os.path.join(user_persist_dir, PAGE_STORE_FILE))
+        
+        # 用户向量库按用户分区，每个用户一个 collection，按需打开并 LRU 淘汰
+        self.max_open_user_stores = max_open_user_stores
+        self._user_vectorstores: "OrderedDict[str, Chroma]" = OrderedDict()
+        self._user_stores_lock = threading.Lock()
+        # 文本块注册表每个用户只有一个实例，不随向量库句柄淘汰（后台索引任务可能仍在使用）
+        self._chunk_registries: dict = {}
+        self._registries_lock = threading.Lock()
+        
+        # 相同问题的并发请求合并为一次检索和 LLM 调用
+        self.answer_flight = SingleFlight()
+        
+        # 回答模型级联：便宜的模型先回答，低置信度或答不出时升级
+        self.cascade = ModelCascade(
+            llm_tiers or DEFAULT_CASCADE_TIERS,
+            self.create_llm,
+            timeout=self.stage_timeouts["llm"],
+            hedge="llm" in hedge_stages,
+            hedge_percentile=hedge_percentile,
+            embedding_backend=self.embedding_backend
+        )
+        
+        # 可选的性能剖析：抽样或超过延迟阈值的请求写出 cProfile 结果
+        self.profiler = profiler
+        
+        # 基础库和用户库的候选按相似度合并为全局前 k 个，可为每个库保留最少名额
+        self.store_quotas = store_quotas or {}
+        
+        # 大文档分批索引：开头页面同步索引后即可提问，其余页面在后台线程中分批提交
+        self.progressive_min_pages = progressive_min_pages
+        self.progressive_first_pages = progressive_first_pages
+        self.progressive_batch_pages = max(1, progressive_batch_pages)
+        self._indexing_jobs: Dict[Tuple[str, str], Tuple[threading.Thread, threading.Event]] = {}
+        self._indexing_lock = threading.Lock()
+        self._background_slots = threading.Semaphore(max(1, background_index_workers))
+        
+        # 在线切换索引代：检索和写入共享进入闸门，切换时独占，向量库目录和 embedding 一起替换
+        self.index_root = index_root
+        self.generation_id: Optional[str] = None
+        self._generation_mtime: Optional[float] = None
+        self._generation_gate = GenerationGate()
+        self._generation_refresh_lock = threading.Lock()
+        
+    def list_base_pdf_files(self) -> List[str]:
         """
-        初始化或加载基础向量库
+        列出基础文档目录中的所有 PDF 文件
+        
+        Returns:
+            PDF 文件路径列表（按路径排序）
+        """
+        pdf_files = []
+        for root, dirs, files in os.walk(self.base_docs_dir):
+            for file in files:
+                if file.endswith('.pdf'):
+                    pdf_files.append(os.path.join(root, file))
+        return sorted(pdf_files)
+    
+    def initialize_base_vectorstore(self, progress_callback: Optional[Callable[[Dict], None]] = None) -> int:
+        """
+        初始化或加载基础向量库（按课程分片）
+        
+        向量库不存在时优先安装与当前配置匹配的预构建制品，否则从 PDF 构建。
+        构建在暂存目录中进行并记录检查点，中断后再次调用从检查点继续；
+        只有完成并通过校验的构建才会替换基础库目录，不完整的向量库不会被当作完整的加载
+        
+        Args:
+            progress_callback: 进度回调，参数为 {"phase": ...}；
+                phase 为 "installing_artifact"、"opening" 或 "building"，
+                构建时另含 files、files_parsed、chunks
         
         Returns:
             加载的文档数量
         """
-        # 检查是否已存在持久化的向量库
-        if os.path.exists(self.base_persist_dir) and os.listdir(self.base_persist_dir):
-            # 加载已有的向量库
+        report = progress_callback or (lambda _: None)
+        if os.path.exists(os.path.join(self.base_staging_dir, SHARD_MANIFEST_FILE)):
+            # 上次构建已通过校验，但替换目录时进程退出
+            logger.info("Promoting the validated base index build left by the previous run")
+            self._promote_base_build()
+        # 只有分片清单才表示基础库完整：失败或中断的构建不会在基础库目录中留下任何文件，
+        # 旧版单 collection 的向量库没有分片清单，同样安装制品或重建
+        base_exists = os.path.exists(os.path.join(self.base_persist_dir, SHARD_MANIFEST_FILE))
+        if not base_exists and os.path.exists(self.base_persist_dir) and os.listdir(self.base_persist_dir):
+            logger.warning("⚠️ 基础向量库缺少分片清单，将安装制品或按课程重新创建")
+        if not base_exists and self.base_artifact_path and os.path.exists(self.base_docs_dir):
+            report({"phase": "installing_artifact"})
             try:
-                self.base_vectorstore = Chroma(
-                    persist_directory=self.base_persist_dir,
-                    embedding_function=self.embedding_function
-                )
-                # 尝试获取文档数量
-                try:
-                    collection = self.base_vectorstore._collection
-                    self.base_doc_count = collection.count()
-                except:
-                    self.base_doc_count = 0
-                
-                return self.base_doc_count
+                base_exists = install_artifact(self, self.base_artifact_path) is not None
             except Exception as e:
-                st.warning(f"⚠️ 加载基础向量库失败，将重新创建：{str(e)}")
+                logger.warning(f"⚠️ 安装基础向量库制品失败，将重新创建：{str(e)}")
+        
+        report({"phase": "opening"})
+        
+        # 检查是否已存在持久化的向量库
+        if base_exists:
+            # 页面存储只在完整的基础库中打开；构建时写入暂存目录，随暂存目录一起替换到位
+            self._open_base_page_store()
+            if self.shard_router.load():
+                # 加载已有的课程分片
+                try:
+                    self._open_base_shards()
+                    self.base_doc_count = sum(
+                        store._collection.count() for store in self.base_shards.values()
+                    )
+                    if os.path.exists(self.base_staging_dir):
+                        # 基础库完整时残留的暂存目录（例如构建中断后安装了制品）已无用
+                        release_chroma_client(self.base_staging_dir)
+                        shutil.rmtree(self.base_staging_dir, ignore_errors=True)
+                    return self.base_doc_count
+                except Exception as e:
+                    logger.warning(f"⚠️ 加载基础向量库失败，将重新创建：{str(e)}")
+            else:
+                logger.warning("⚠️ 基础向量库的分片清单无法读取，将按课程重新创建")
         
         # 首次创建：加载基础文档
         if not os.path.exists(self.base_docs_dir):
-            st.error(f"❌ 基础文档目录不存在：{self.base_docs_dir}")
+            logger.error(f"❌ 基础文档目录不存在：{self.base_docs_dir}")
             return 0
         
         # 获取所有PDF文件
-        pdf_files = []
-        for root, dirs, files in os.walk(self.base_docs_dir):
-            for file in files:
-                if file.endswith('.pdf'):
-                    pdf_files.append(os.path.join(root, file))
+        pdf_files = self.list_base_pdf_files()
         
         if not pdf_files:
-            st.warning(f"⚠️ 在 {self.base_docs_dir} 中未找到 PDF 文件")
+            logger.warning(f"⚠️ 在 {self.base_docs_dir} 中未找到 PDF 文件")
             return 0
         
-        # 加载和索引文件
-        splits, doc_count = loadAndIndexFiles(
-            file_paths=pdf_files,
-            source_type="base"
+        return self._build_base_shards(pdf_files, progress_callback)
+    
+    @property
+    def base_staging_dir(self) -> str:
+        """基础库构建的暂存目录（与基础库目录同级）"""
+        return f"{self.base_persist_dir.rstrip('/')}.building"
+    
+    def _open_base_page_store(self):
+        """（重新）打开基础库的页面存储"""
+        if self.base_page_store is not None:
+            self.base_page_store.close()
+        self.base_page_store = PageStore(os.path.join(self.base_persist_dir, PAGE_STORE_FILE))
+    
+    def base_doc_id(self, file_path: str) -> str:
+        """基础文档在页面存储中的 ID：相对于基础文档目录的路径"""
+        return os.path.relpath(file_path, self.base_docs_dir).replace(os.sep, "/")
+    
+    def _open_base_shard(self, course: str, persist_dir: Optional[str] = None) -> Chroma:
+        """打开（不存在时创建）课程分片的向量库，persist_dir 默认为基础库目录"""
+        return Chroma(
+            collection_name=shard_collection_name(course),
+            persist_directory=persist_dir or self.base_persist_dir,
+            embedding_function=self.embedding_function
         )
+    
+    def _open_base_shards(self):
+        """按分片清单打开所有课程分片"""
+        self.base_shards = {
+            course: self._open_base_shard(course)
+            for course in self.shard_router.courses
+        }
+    
+    def _build_base_shards(
+        self,
+        pdf_files: List[str],
+        progress_callback: Optional[Callable[[Dict], None]] = None
+    ) -> int:
+        """
+        在暂存目录中构建按课程分片的基础向量库，校验通过后替换基础库目录
         
-        if not splits:
-            st.error("❌ 未能加载任何基础文档")
-            return 0
+        所有课程共用一次流水线运行，写入阶段按文件所在课程路由到对应分片。
+        每个文件全部写入后记录到检查点；文本块使用确定性 ID，中断后重新运行时
+        跳过已完成的文件，未完成文件中已写入的批次也不再向量化。
+        语料或构建配置变化（指纹不同）时丢弃暂存目录重新开始。
         
-        # 创建向量库
-        self.base_vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embedding_function,
-            persist_directory=self.base_persist_dir
+        Args:
+            pdf_files: 基础 PDF 文件路径列表
+            progress_callback: 进度回调（见 initialize_base_vectorstore()）
+            
+        Returns:
+            加载的文档（页面）数量；没有可索引的内容或校验失败时返回 0
+            
+        Raises:
+            Exception: 向量化或写入失败时抛出，已完成的进度保留在暂存目录中
+        """
+        staging_dir = self.base_staging_dir
+        checkpoint = BuildCheckpoint(os.path.join(staging_dir, CHECKPOINT_FILE))
+        if checkpoint.load(index_fingerprint(self, pdf_files)["fingerprint"]):
+            logger.info(f"Resuming base index build: {len(checkpoint.files)}/{len(pdf_files)} files already indexed")
+        else:
+            release_chroma_client(staging_dir)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir, exist_ok=True)
+        checkpoint.save()
+        
+        page_store = PageStore(os.path.join(staging_dir, PAGE_STORE_FILE))
+        try:
+            courses = sorted({course_of(path, self.base_docs_dir) for path in pdf_files})
+            shards = {course: self._open_base_shard(course, staging_dir) for course in courses}
+            pending_files = [path for path in pdf_files if self.base_doc_id(path) not in checkpoint.files]
+            done_files = len(pdf_files) - len(pending_files)
+            done_chunks = checkpoint.chunks
+            
+            def route(metadata: dict):
+                return shards[course_of(metadata["source"], self.base_docs_dir)]._collection
+            
+            def report(snapshot: dict):
+                progress_callback({
+                    "phase": "building",
+                    "files": len(pdf_files),
+                    "files_parsed": done_files + snapshot["files_parsed"],
+                    "chunks": done_chunks + snapshot["chunks"] + snapshot["chunks_skipped"],
+                })
+            
+            if progress_callback:
+                progress_callback({"phase": "building", "files": len(pdf_files),
+                                   "files_parsed": done_files, "chunks": done_chunks})
+            stats = self.pipeline.run(
+                file_paths=pending_files,
+                collection=None,
+                source_type="base",
+                collection_router=route,
+                page_store=page_store,
+                doc_id_for=self.base_doc_id,
+                progress_callback=report if progress_callback else None,
+                stable_ids=True,
+                skip_existing=True,
+                file_callback=lambda path, info: checkpoint.mark_file(self.base_doc_id(path), info)
+            )
+            if stats["chunks_skipped"]:
+                logger.info(f"Skipped {stats['chunks_skipped']} chunks already written before the interruption")
+            
+            if not checkpoint.chunks:
+                logger.error("❌ 未能加载任何基础文档")
+                return 0
+            
+            try:
+                manifest = self._validate_base_build(pdf_files, stats["failed_files"], checkpoint, shards, page_store)
+            except ValueError as e:
+                logger.error(f"❌ 基础向量库校验失败，未替换现有向量库：{str(e)}")
+                return 0
+            # 分片清单最后写出：暂存目录中存在分片清单表示构建已完成并通过校验
+            ShardRouter(os.path.join(staging_dir, SHARD_MANIFEST_FILE)).save(manifest)
+        finally:
+            page_store.close()
+        
+        self._promote_base_build()
+        self.shard_router.load()
+        self._open_base_shards()
+        logger.info(f"Built {len(self.base_shards)} base shards: " + ", ".join(
+            f"{course}={info['chunks']}" for course, info in self.shard_router.shards.items()
+        ))
+        
+        self.base_doc_count = checkpoint.pages
+        return self.base_doc_count
+    
+    def _validate_base_build(
+        self,
+        pdf_files: List[str],
+        failed_files: List[str],
+        checkpoint: BuildCheckpoint,
+        shards: Dict[str, Chroma],
+        page_store: PageStore
+    ) -> Dict[str, Dict]:
+        """
+        校验暂存目录中的构建并生成分片清单
+        
+        检查每个文件都已完成（解析失败的文件除外）、每个分片的文本块数量与检查点一致、
+        每个有页面的文档都在页面存储中
+        
+        Args:
+            pdf_files: 基础 PDF 文件路径列表
+            failed_files: 本次运行中解析失败的文件
+            checkpoint: 构建检查点
+            shards: {课程: 暂存目录中的分片向量库}
+            page_store: 暂存目录中的页面存储
+            
+        Returns:
+            分片清单 {课程: {"collection", "chunks", "centroid"}}
+            
+        Raises:
+            ValueError: 校验失败
+        """
+        failed = set(failed_files)
+        unfinished = [path for path in pdf_files if path not in failed and self.base_doc_id(path) not in checkpoint.files]
+        if unfinished:
+            raise ValueError(f"{len(unfinished)} files were not fully indexed, e.g. {unfinished[0]}")
+        if failed:
+            logger.warning(f"⚠️ {len(failed)} 个基础文档解析失败，未包含在基础向量库中")
+        
+        expected: Dict[str, int] = {course: 0 for course in shards}
+        for path in pdf_files:
+            info = checkpoint.files.get(self.base_doc_id(path))
+            if info:
+                expected[course_of(path, self.base_docs_dir)] += info["chunks"]
+        
+        manifest = {}
+        for course, store in shards.items():
+            collection = store._collection
+            count = collection.count()
+            if count != expected[course]:
+                raise ValueError(f"shard {course} has {count} chunks, expected {expected[course]}")
+            manifest[course] = {
+                "collection": collection.name,
+                "chunks": count,
+                "centroid": collection_centroid(collection),
+            }
+        
+        stored = set(page_store.doc_ids())
+        missing = [doc_id for doc_id, info in checkpoint.files.items() if info["pages"] and doc_id not in stored]
+        if missing:
+            raise ValueError(f"{len(missing)} documents are missing from the page store, e.g. {missing[0]}")
+        return manifest
+    
+    def _promote_base_build(self):
+        """用已通过校验的暂存目录替换基础库目录"""
+        if self.base_page_store is not None:
+            self.base_page_store.close()
+        self.base_shards = {}
+        release_chroma_client(self.base_staging_dir)
+        release_chroma_client(self.base_persist_dir)
+        checkpoint_file = os.path.join(self.base_staging_dir, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        promote_directory(self.base_staging_dir, self.base_persist_dir)
+        self.base_page_store = PageStore(os.path.join(self.base_persist_dir, PAGE_STORE_FILE))
+    
+    def _acquire_index_lock(self, user_persist_dir: str) -> Optional[FileLock]:
+        """按 index_lock_mode 获取用户库目录的锁"""
+        if not self.index_lock_mode:
+            return None
+        lock = FileLock(os.path.join(user_persist_dir, INDEX_LOCK_FILE))
+        exclusive = self.index_lock_mode == "exclusive"
+        try:
+            lock.acquire(exclusive=exclusive, blocking=False)
+        except FileLockError:
+            if exclusive:
+                raise
+            logger.warning(f"⚠️ 维护工具正在独占 {user_persist_dir}，等待其完成")
+            lock.acquire(exclusive=False)
+        return lock
+    
+    def switch_generation(self, generation: Dict):
+        """
+        在进程内切换到另一个索引代（见 migration.py）
+        
+        新一代的 embedding、基础库分片和页面存储先在闸门外打开，再在独占闸门内一起替换：
+        正在进行的检索和写入完成后才切换，之后的请求只会看到新一代，不会混用新旧两代的
+        embedding 和向量库。用户分区句柄和注册表清空，之后按需从新一代目录打开
+        
+        Args:
+            generation: 代配置（见 migration.active_generation()）
+        """
+        embedding = generation["embedding"]
+        embedding_function = CachedQueryEmbeddings(
+            create_embedding_backend(embedding["backend"], embedding["model"], embedding.get("dimensions")),
+            max_size=self.embedding_function.max_size,
+            caller=self.embed_caller
         )
+        base_persist_dir = generation["base_persist_dir"]
+        user_persist_dir = generation["user_persist_dir"]
+        os.makedirs(base_persist_dir, exist_ok=True)
+        os.makedirs(user_persist_dir, exist_ok=True)
+        shard_router = ShardRouter(os.path.join(base_persist_dir, SHARD_MANIFEST_FILE))
+        if not shard_router.load():
+            logger.warning(f"⚠️ 索引代 {generation['id']} 缺少分片清单，切换后只检索用户文档")
+        base_shards = {
+            course: Chroma(
+                collection_name=shard_collection_name(course),
+                persist_directory=base_persist_dir,
+                embedding_function=embedding_function
+            )
+            for course in shard_router.courses
+        }
+        base_doc_count = sum(store._collection.count() for store in base_shards.values())
+        base_page_store = PageStore(os.path.join(base_persist_dir, PAGE_STORE_FILE))
+        user_page_store = PageStore(os.path.join(user_persist_dir, PAGE_STORE_FILE))
+        index_lock = self._acquire_index_lock(user_persist_dir)
+        
+        with self._generation_gate.exclusive():
+            previous_stores = (self.base_page_store, self.user_page_store)
+            previous_lock, self._index_lock = self._index_lock, index_lock
+            self.base_persist_dir = base_persist_dir
+            self.user_persist_dir = user_persist_dir
+            self.embedding_backend = embedding["backend"]
+            self.embedding_model = embedding["model"]
+            self.embedding_dimensions = embedding.get("dimensions")
+            self.cascade.embedding_backend = embedding["backend"]
+            self.embedding_function = embedding_function
+            self.pipeline.embedding_function = embedding_function
+            self.shard_router = shard_router
+            self.base_shards = base_shards
+            self.base_doc_count = base_doc_count
+            self.base_page_store = base_page_store
+            self.user_page_store = user_page_store
+            with self._user_stores_lock:
+                self._user_vectorstores.clear()
+            # 注册表文件在新世代的用户库目录中；索引任务在门控外等待，切换后重新获取
+            with self._registries_lock:
+                self._chunk_registries.clear()
+            self.generation_id = generation["id"]
+        
+        for store in previous_stores:
+            if store is not None:
+                store.close()
+        if previous_lock is not None:
+            previous_lock.release()
+        logger.info(f"Switched to embedding generation {generation['id']} ({embedding['backend']}/{embedding['model']})")
+    
+    def refresh_generation(self) -> Optional[Dict]:
+        """
+        检查代指针，当前代变化时在进程内切换（见 switch_generation()）
+        
+        切换后把上一代在切换前收到的写入（migration.py swap 之后、本进程切换之前的上传）
+        补充到新一代。由 RAGService 定期调用；代指针文件未修改时只有一次 stat
+        
+        Returns:
+            切换到的代配置；未设置 index_root 或当前代未变化时返回 None
+        """
+        if not self.index_root:
+            return None
+        try:
+            mtime = os.path.getmtime(os.path.join(self.index_root, GENERATION_FILE))
+        except OSError:
+            return None
+        with self._generation_refresh_lock:
+            if mtime == self._generation_mtime:
+                return None
+            self._generation_mtime = mtime
+            generation = active_generation(self.index_root)
+            if generation is None or generation["id"] == self.generation_id:
+                return None
+            if os.path.abspath(generation["base_persist_dir"]) == os.path.abspath(self.base_persist_dir) and \
+                    os.path.abspath(generation["user_persist_dir"]) == os.path.abspath(self.user_persist_dir):
+                # 已经在使用这一代（第一次迁移时现有索引被登记为第 0 代）
+                self.generation_id = generation["id"]
+                return None
+            
+            try:
+                self.switch_generation(generation)
+            except Exception:
+                # 下次检查时重试
+                self._generation_mtime = None
+                raise
+            try:
+                stats = EmbeddingMigration(self.index_root).catch_up(self)
+                logger.info(f"Caught up {stats['added']} chunks written to the previous generation before the switch")
+            except Exception as e:
+                logger.warning(f"⚠️ 补充上一代的写入失败，可运行 python migration.py sync 重试：{str(e)}")
+            return generation
+    
+    def get_base_courses(self) -> List[str]:
+        """
+        获取基础库的所有课程（分片）名称
         
-        self.base_doc_count = doc_count
-        return doc_count
+        Returns:
+            课程名称列表
+        """
+        return self.shard_router.courses
     
-    def initialize_user_vectorstore(self):
-        """初始化或加载用户向量库"""
+    def _search_base(
+        self,
+        query_vector: List[float],
+        k: int,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        在路由选中的课程分片中检索，按相似度合并为全局前 k 个结果
+        
+        Args:
+            query_vector: 查询向量
+            k: 返回的文档数量
+            courses: 显式指定的课程，None 表示按质心路由
+            
+        Returns:
+            (文档, 余弦相似度) 列表，按相似度从高到低排列
+        """
+        scored = []
+        for course in self.shard_router.route(query_vector, self.base_route_top_n, courses):
+            store = self.base_shards.get(course)
+            if store is None:
+                continue
+            try:
+                space = collection_space(store._collection)
+                scored.extend(
+                    (doc, distance_to_similarity(distance, space))
+                    for doc, distance in store.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ 基础库分片 {course} 检索失败：{str(e)}")
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:k]
+    
+    def get_user_vectorstore(self, user_id: str = DEFAULT_USER_ID) -> Chroma:
+        """
+        获取指定用户的向量库分区（懒加载）
+        
+        分区首次访问时才打开；超过 max_open_user_stores 时关闭最久未使用的分区句柄，
+        数据仍保留在磁盘上，下次访问时重新打开
+        
+        Args:
+            user_id: 用户或会话 ID
+            
+        Returns:
+            该用户的 Chroma 向量库
+        """
+        with self._user_stores_lock:
+            store = self._user_vectorstores.get(user_id)
+            if store is not None:
+                self._user_vectorstores.move_to_end(user_id)
+                return store
+            
+            store = Chroma(
+                collection_name=user_collection_name(user_id),
+                persist_directory=self.user_persist_dir,
+                embedding_function=self.embedding_function
+            )
+            self._user_vectorstores[user_id] = store
+            
+            while len(self._user_vectorstores) > self.max_open_user_stores:
+                evicted_id, _ = self._user_vectorstores.popitem(last=False)
+                logger.info(f"Evicted idle user store partition: {user_collection_name(evicted_id)}")
+            
+            return store
+    
+    def get_chunk_registry(self, user_id: str = DEFAULT_USER_ID) -> ChunkRegistry:
+        """
+        获取指定用户分区的文本块注册表
+        
+        注册表与向量库句柄分开缓存，淘汰向量库句柄时保留，保证同一个注册表文件只有一个实例
+        
+        Args:
+            user_id: 用户或会话 ID
+            
+        Returns:
+            该分区的 ChunkRegistry
+        """
+        with self._registries_lock:
+            registry = self._chunk_registries.get(user_id)
+            if registry is None:
+                registry = ChunkRegistry(os.path.join(
+                    self.user_persist_dir,
+                    f"{user_collection_name(user_id)}.chunks.json"
+                ))
+                self._chunk_registries[user_id] = registry
+            return registry
+    
+    def initialize_user_vectorstore(self, user_id: str = DEFAULT_USER_ID):
+        """初始化或加载指定用户的向量库分区"""
         # 始终尝试加载用户向量库（可能为空）
-        self.user_vectorstore = Chroma(
-            persist_directory=self.user_persist_dir,
-            embedding_function=self.embedding_function
-        )
+        return self.get_user_vectorstore(user_id)
+    
+    def user_doc_id(self, file_id: str, user_id: str = DEFAULT_USER_ID) -> str:
+        """用户文档在页面存储中的 ID：<分区 collection>/<file_id>"""
+        return f"{user_collection_name(user_id)}/{file_id}"
     
     def add_user_document(
         self,
         file_path: str,
         original_filename: str,
         upload_time: str,
-        file_size: int
+        file_size: int,
+        file_id: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID
     ) -> Tuple[bool, str, int]:
         """
-        添加用户上传的文档到用户向量库
+        添加用户上传的文档到该用户的向量库分区
+        
+        文本块 ID 由 file_id 确定性生成并记录到注册表，删除时无需扫描向量库
         
         Args:
             file_path: 文件路径
             original_filename: 原始文件名
             upload_time: 上传时间
             file_size: 文件大小
+            file_id: 文件ID（默认为保存后的唯一文件名）
+            user_id: 用户或会话 ID
             
         Returns:
             (是否成功, 消息, 添加的文本块数量)
         """
+        file_id = file_id or os.path.basename(file_path)
+        ingest = lambda: self._add_user_document(
+            file_path, original_filename, upload_time, file_size, file_id, user_id
+        )
+        with self._generation_gate.shared():
+            if self.profiler is None or not self.profiler.enabled:
+                return ingest()
+            return self.profiler.run(
+                "add_user_document",
+                ingest,
+                metadata={
+                    "user_id": user_id,
+                    "file_id": file_id,
+                    "original_filename": original_filename,
+                    "file_size": file_size,
+                }
+            )
+    
+    def _add_user_document(
+        self,
+        file_path: str,
+        original_filename: str,
+        upload_time: str,
+        file_size: int,
+        file_id: str,
+        user_id: str
+    ) -> Tuple[bool, str, int]:
+        """add_user_document() 的实际实现"""
         try:
             # 加载和索引文件
             additional_metadata = {
+                'file_id': file_id,
                 'original_filename': original_filename,
                 'upload_time': upload_time,
                 'file_size': file_size
             }
             
-            splits, doc_count = loadAndIndexFiles(
-                file_paths=[file_path],
-                source_type="user",
-                additional_metadata=additional_metadata
-            )
+            if self.progressive_min_pages:
+                try:
+                    total_pages, priority_pages = pdf_page_plan(file_path, self.progressive_first_pages)
+                except Exception:
+                    # pypdf 无法打开的文件走一次性索引（整体回退到 Unstructured）
+                    total_pages = 0
+                if total_pages > self.progressive_min_pages:
+                    return self._add_user_document_progressive(
+                        file_path, additional_metadata, file_id, user_id, total_pages, priority_pages
+                    )
             
-            if not splits:
-                return False, "❌ 文档处理失败：未能提取任何内容", 0
+            # 通过流水线写入该用户的向量库分区（多批 embedding 并发请求）
+            collection = self.get_user_vectorstore(user_id)._collection
+            doc_id = self.user_doc_id(file_id, user_id)
+            stats = self._index_user_pages(file_path, additional_metadata, file_id, user_id)
+            chunk_count = stats["chunks"]
             
-            # 添加到用户向量库
-            if self.user_vectorstore is None:
-                self.initialize_user_vectorstore()
+            if not chunk_count:
+                self.user_page_store.delete_doc(doc_id)
+                return False, "❌ 文档处理失败：未能提取任何内容", 0
             
-            self.user_vectorstore.add_documents(splits)
+            # 记录文本块 ID；重新索引同一文件时清理不再存在的旧文本块
+            registry = self.get_chunk_registry(user_id)
+            stale_ids = set(registry.get(file_id)) - set(stats["ids"])
+            if stale_ids:
+                collection.delete(ids=list(stale_ids))
+            registry.register(file_id, stats["ids"])
             
-            return True, f"✅ 成功索引文档，添加了 {len(splits)} 个文本块", len(splits)
+            return True, f"✅ 成功索引文档，添加了 {chunk_count} 个文本块", chunk_count
             
         except Exception as e:
             return False, f"❌ 索引文档时出错：{str(e)}", 0
     
-    def remove_user_document(self, original_filename: str) -> Tuple[bool, str]:
+    def _index_user_pages(
+        self,
+        file_path: str,
+        additional_metadata: dict,
+        file_id: str,
+        user_id: str,
+        page_indices: Optional[Sequence[int]] = None
+    ) -> dict:
+        """通过流水线把文档（或其中部分页面）写入该用户的向量库分区，返回流水线统计"""
+        doc_id = self.user_doc_id(file_id, user_id)
+        return self.pipeline.run(
+            file_paths=[file_path],
+            collection=self.get_user_vectorstore(user_id)._collection,
+            source_type="user",
+            additional_metadata=additional_metadata,
+            id_prefix=file_id,
+            page_store=self.user_page_store,
+            doc_id_for=lambda _: doc_id,
+            page_indices=page_indices,
+            use_page_cache=False
+        )
+    
+    def _add_user_document_progressive(
+        self,
+        file_path: str,
+        additional_metadata: dict,
+        file_id: str,
+        user_id: str,
+        total_pages: int,
+        priority_pages: List[int]
+    ) -> Tuple[bool, str, int]:
+        """
+        分批索引大文档：同步索引优先页面后立即返回，其余页面交给后台线程
+        
+        每批提交后文本块 ID 追加到注册表并更新覆盖率，新提交的批次立即可以被检索到
+        """
+        registry = self.get_chunk_registry(user_id)
+        previous_ids = set(registry.get(file_id))
+        registry.register(file_id, [])
+        
+        # 优先页面没有文本（例如扫描的封面）时继续同步索引后续页面，直到得到第一批文本块
+        remaining = [page for page in range(total_pages) if page not in set(priority_pages)]
+        batch = priority_pages
+        indexed_pages = 0
+        chunk_ids: List[str] = []
+        while True:
+            stats = self._index_user_pages(file_path, additional_metadata, file_id, user_id, batch)
+            indexed_pages += len(batch)
+            chunk_ids.extend(stats["ids"])
+            registry.extend(file_id, stats["ids"], coverage={
+                "pages_indexed": indexed_pages, "total_pages": total_pages, "status": "indexing"
+            })
+            if chunk_ids or not remaining:
+                break
+            batch, remaining = remaining[:self.progressive_batch_pages], remaining[self.progressive_batch_pages:]
+        
+        if not chunk_ids:
+            self.user_page_store.delete_doc(self.user_doc_id(file_id, user_id))
+            registry.remove(file_id)
+            return False, "❌ 文档处理失败：未能提取任何内容", 0
+        
+        if not remaining:
+            self._finish_progressive(file_id, user_id, previous_ids, total_pages)
+            return True, f"✅ 成功索引文档，添加了 {len(chunk_ids)} 个文本块", len(chunk_ids)
+        
+        self._start_background_indexing(
+            file_path, additional_metadata, file_id, user_id, remaining, indexed_pages, total_pages, previous_ids
+        )
+        return (
+            True,
+            f"✅ 已索引前 {indexed_pages} 页（{len(chunk_ids)} 个文本块），现在即可提问；"
+            f"其余 {len(remaining)} 页正在后台索引",
+            len(chunk_ids)
+        )
+    
+    def _start_background_indexing(
+        self,
+        file_path: str,
+        additional_metadata: dict,
+        file_id: str,
+        user_id: str,
+        remaining: List[int],
+        indexed_pages: int,
+        total_pages: int,
+        previous_ids: set
+    ):
+        """启动后台线程分批索引剩余页面"""
+        cancel = threading.Event()
+        
+        def run():
+            status = "failed"
+            pages_done = indexed_pages
+            try:
+                # 限制同时进行的后台任务数，等待期间也响应取消
+                while not self._background_slots.acquire(timeout=0.5):
+                    if cancel.is_set():
+                        status = "cancelled"
+                        return
+                try:
+                    for i in range(0, len(remaining), self.progressive_batch_pages):
+                        if cancel.is_set():
+                            status = "cancelled"
+                            return
+                        batch = remaining[i:i + self.progressive_batch_pages]
+                        # 每批单独进入闸门：切换索引代后剩余的批次写入新一代
+                        with self._generation_gate.shared():
+                            stats = self._index_user_pages(file_path, additional_metadata, file_id, user_id, batch)
+                            pages_done += len(batch)
+                            # 文本块 ID 和覆盖率一起更新，每批只重写一次注册表文件
+                            self.get_chunk_registry(user_id).extend(file_id, stats["ids"], coverage={
+                                "pages_indexed": pages_done, "total_pages": total_pages, "status": "indexing"
+                            })
+                    with self._generation_gate.shared():
+                        self._finish_progressive(file_id, user_id, previous_ids, total_pages)
+                    status = "complete"
+                finally:
+                    self._background_slots.release()
+            except Exception as e:
+                logger.error(f"❌ 后台索引 {file_id} 失败：{str(e)}")
+            finally:
+                if status != "complete" and not cancel.is_set():
+                    self.get_chunk_registry(user_id).set_coverage(file_id, pages_done, total_pages, status)
+                with self._indexing_lock:
+                    self._indexing_jobs.pop((user_id, file_id), None)
+        
+        thread = threading.Thread(target=run, name=f"index-{file_id}", daemon=True)
+        with self._indexing_lock:
+            self._indexing_jobs[(user_id, file_id)] = (thread, cancel)
+        thread.start()
+    
+    def _finish_progressive(self, file_id: str, user_id: str, previous_ids: set, total_pages: int):
+        """分批索引完成：清理重新索引前遗留的旧文本块，覆盖率标记为完成"""
+        registry = self.get_chunk_registry(user_id)
+        stale_ids = previous_ids - set(registry.get(file_id))
+        if stale_ids:
+            self.get_user_vectorstore(user_id)._collection.delete(ids=list(stale_ids))
+        registry.set_coverage(file_id, total_pages, total_pages, "complete")
+    
+    def _cancel_indexing(self, file_id: str, user_id: str):
+        """取消文档的后台索引，并等待正在提交的批次结束"""
+        with self._indexing_lock:
+            job = self._indexing_jobs.get((user_id, file_id))
+        if job is None:
+            return
+        thread, cancel = job
+        cancel.set()
+        thread.join()
+    
+    def get_indexing_coverage(self, file_id: str, user_id: str = DEFAULT_USER_ID) -> Optional[dict]:
         """
-        从用户向量库中删除文档
+        获取文档的索引覆盖率
         
         Args:
-            original_filename: 原始文件名
+            file_id: 文件ID
+            user_id: 用户或会话 ID
             
+        Returns:
+            {"pages_indexed", "total_pages", "status"}；一次性索引的文档返回 None。
+            记录为索引中但没有后台任务（进程重启）时 status 为 "interrupted"
+        """
+        coverage = self.get_chunk_registry(user_id).get_coverage(file_id)
+        if coverage and coverage["status"] == "indexing":
+            with self._indexing_lock:
+                if (user_id, file_id) not in self._indexing_jobs:
+                    coverage["status"] = "interrupted"
+        return coverage
+    
+    def resume_user_document(
+        self,
+        file_path: str,
+        original_filename: str,
+        upload_time: str,
+        file_size: int,
+        file_id: str,
+        user_id: str = DEFAULT_USER_ID
+    ) -> Tuple[bool, str]:
+        """
+        继续索引中断（进程重启）或失败的分批索引文档
+        
+        已索引的页面根据注册表中按页编号的文本块 ID 得出，只索引其余页面
+        
         Returns:
             (是否成功, 消息)
         """
-        try:
-            if self.user_vectorstore is None:
-                return True, "用户向量库为空"
-            
-            # 通过元数据过滤删除
-            # 注意：Chroma 的删除操作需要文档ID，这里我们需要先查询
-            collection = self.user_vectorstore._collection
-            results = collection.get(
-                where={"original_filename": original_filename}
-            )
+        coverage = self.get_indexing_coverage(file_id, user_id)
+        if not coverage or coverage["status"] not in ("interrupted", "failed"):
+            return False, "⚠️ 该文档没有需要继续的索引任务"
+        with self._generation_gate.shared():
+            registry = self.get_chunk_registry(user_id)
+            done = {chunk_page(chunk_id) for chunk_id in registry.get(file_id)}
+            remaining = [page for page in range(coverage["total_pages"]) if page not in done]
+            registry.set_coverage(file_id, coverage["total_pages"] - len(remaining), coverage["total_pages"], "indexing")
+        additional_metadata = {
+            'file_id': file_id,
+            'original_filename': original_filename,
+            'upload_time': upload_time,
+            'file_size': file_size
+        }
+        self._start_background_indexing(
+            file_path, additional_metadata, file_id, user_id, remaining,
+            coverage["total_pages"] - len(remaining), coverage["total_pages"], set()
+        )
+        return True, f"✅ 继续索引剩余的 {len(remaining)} 页"
+    
+    def remove_user_document(
+        self,
+        file_id: str,
+        user_id: str = DEFAULT_USER_ID
+    ) -> Tuple[bool, str]:
+        """
+        从用户向量库分区中删除文档
+        
+        根据注册表中记录的文本块 ID 直接批量删除，不扫描元数据
+        
+        Args:
+            file_id: 文件ID（唯一文件名）
+            user_id: 用户或会话 ID
             
-            if results and 'ids' in results and results['ids']:
-                collection.delete(ids=results['ids'])
-                return True, f"✅ 已从向量库中删除 {len(results['ids'])} 个文本块"
-            else:
-                return True, "向量库中未找到相关内容"
+        Returns:
+            (是否成功, 消息)
+        """
+        try:
+            # 先停止后台分批索引，避免删除后仍有批次写入（在闸门外等待，后台批次可能正在等待切换）
+            self._cancel_indexing(file_id, user_id)
+            with self._generation_gate.shared():
+                registry = self.get_chunk_registry(user_id)
+                chunk_ids = registry.get(file_id)
+                
+                if not chunk_ids:
+                    return True, "向量库中未找到相关内容"
+                
+                collection = self.get_user_vectorstore(user_id)._collection
+                collection.delete(ids=chunk_ids)
+                self.user_page_store.delete_doc(self.user_doc_id(file_id, user_id))
+                registry.remove(file_id)
+                return True, f"✅ 已从向量库中删除 {len(chunk_ids)} 个文本块"
                 
         except Exception as e:
             return False, f"⚠️ 从向量库删除时出错：{str(e)}"
     
-    def create_rag_chain(self, k: int = 3):
+    def _answer_key(
+        self,
+        question: str,
+        k: int,
+        user_id: str,
+        courses: Optional[Sequence[str]]
+    ) -> tuple:
         """
-        创建 RAG 检索链
+        生成问答请求的合并键
+        
+        用户分区为空时回答只取决于基础库，不同用户的相同问题可以合并；
+        否则只合并同一用户的请求
+        """
+        try:
+            user_scope = user_id if self.get_user_vectorstore(user_id)._collection.count() > 0 else None
+        except Exception:
+            user_scope = user_id
+        return (
+            normalize_query(question),
+            k,
+            tuple(sorted(courses)) if courses else None,
+            user_scope
+        )
+    
+    def answer(
+        self,
+        question: str,
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ) -> str:
+        """
+        回答问题；相同问题的并发请求共享同一次检索和 LLM 调用
         
         Args:
-            k: 检索的文档数量
+            question: 问题
+            k: 检索的文档总数（基础库和用户库合并）
+            user_id: 提问用户的 ID
+            courses: 只检索这些课程的基础库分片，None 表示按质心路由
             
         Returns:
-            RAG chain
+            回答文本
+        """
+        key = self._answer_key(question, k, user_id, courses)
+        return self.answer_flight.do(
+            key,
+            lambda: self._invoke_chain(question, k, user_id, courses)
+        )
+    
+    def _invoke_chain(
+        self,
+        question: str,
+        k: int,
+        user_id: str,
+        courses: Optional[Sequence[str]]
+    ) -> str:
+        """同步执行问答链；启用剖析器时在剖析下执行"""
+        invoke = lambda: self.create_rag_chain(k=k, user_id=user_id, courses=courses).invoke(question).content
+        if self.profiler is None or not self.profiler.enabled:
+            return invoke()
+        return self.profiler.run(
+            "answer",
+            invoke,
+            metadata={"question": question, "k": k, "user_id": user_id, "courses": list(courses or [])}
+        )
+    
+    async def aanswer(
+        self,
+        question: str,
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None,
+        semaphore: Optional[asyncio.Semaphore] = None
+    ) -> str:
         """
-        # 创建混合检索器
-        def hybrid_retrieve(query: str) -> List[Document]:
-            """从两个向量库中检索相关文档"""
-            all_docs = []
+        answer() 的异步版本
+        
+        启用剖析器时问答链改为在工作线程中同步执行：cProfile 只记录当前线程，
+        在事件循环上剖析会混入其他并发请求的协程
+        
+        Args:
+            semaphore: 只限制实际执行的请求，被合并的请求等待结果时不占用名额
             
-            # 从基础库检索
-            if self.base_vectorstore:
-                # logger.info("Base vectorstore detected!")
-                try:
-                    base_docs = self.base_vectorstore.similarity_search(query, k=k)
-                    all_docs.extend(base_docs)
-                except Exception as e:
-                    st.warning(f"⚠️ 基础库检索失败：{str(e)}")
-
-            # logger.info(f"All docs num:\n {len(all_docs)}")
-
-            # 从用户库检索
-            if self.user_vectorstore:
-                try:
-                    # 检查用户库是否有内容
-                    collection = self.user_vectorstore._collection
-                    if collection.count() > 0:
-                        user_docs = self.user_vectorstore.similarity_search(query, k=10)
-                        all_docs.extend(user_docs)
-                except Exception as e:
-                    # 用户库可能为空，这是正常的
-                    pass
-
-            # TODO: 需要添加 reranking
-            # 返回前 k 个文档（可以添加重新排序逻辑）
-            return all_docs[:k+10]
-        
-        # 格式化文档，添加来源标记
-        def format_docs_with_source(docs: List[Document]) -> str:
-            """格式化文档并标记来源"""
-            parts = []
-            for i, d in enumerate(docs, 1):
-                src = d.metadata.get("source", "unknown_source")
-                src_type = d.metadata.get("source_type", "base")
-                page = d.metadata.get("page_label", d.metadata.get("page", "unknown_page"))
-                
-                # 根据来源类型选择图标
-                if src_type == "user":
-                    emoji = "📄"
-                    original_name = d.metadata.get("original_filename", "Unknown")
-                    upload_time = d.metadata.get("upload_time", "Unknown")
-                    header = f"{emoji} [{i}] 用户文档：{original_name} (上传于 {upload_time}, p.{page})"
-                else:
-                    emoji = "📘"
-                    header = f"{emoji} [{i}] 课程材料：{os.path.basename(src)}, p.{page}"
-                
-                text = (d.page_content or "").strip()
-                parts.append(f"{header}\n{text}")
+        Returns:
+            回答文本
+        """
+        key = await asyncio.to_thread(self._answer_key, question, k, user_id, courses)
+        
+        async def run() -> str:
+            if self.profiler is not None and self.profiler.enabled:
+                if semaphore is None:
+                    return await asyncio.to_thread(self._invoke_chain, question, k, user_id, courses)
+                async with semaphore:
+                    return await asyncio.to_thread(self._invoke_chain, question, k, user_id, courses)
+            rag_chain = self.create_rag_chain(k=k, user_id=user_id, courses=courses)
+            if semaphore is None:
+                response = await rag_chain.ainvoke(question)
+            else:
+                async with semaphore:
+                    response = await rag_chain.ainvoke(question)
+            return response.content
+        
+        return await self.answer_flight.ado(key, run)
+    
+    def get_coalescing_stats(self) -> dict:
+        """
+        获取问答请求合并的统计信息
+        
+        Returns:
+            请求数、实际执行数、被合并的请求数和合并率
+        """
+        return self.answer_flight.get_stats()
+    
+    def get_query_cache_stats(self) -> dict:
+        """
+        获取查询向量缓存的统计信息
+        
+        Returns:
+            缓存大小、命中次数、未命中次数和命中率
+        """
+        return self.embedding_function.get_stats()
+    
+    def retrieve_scored(
+        self,
+        query: str,
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        从基础库和提问用户的分区中检索相关文档，并返回余弦相似度
+        
+        两个库各取 k 个候选，按相似度合并为全局前 k 个（见 merge_top_k()），
+        相关度低的用户文档不会挤掉相关度高的课程材料。
+        只保存偏移量的文本块在返回前从页面存储取出文本（见 materialize_documents()）
+        
+        Args:
+            query: 查询文本
+            k: 返回的文档总数
+            user_id: 提问用户的 ID
+            courses: 只检索这些课程的基础库分片，None 表示按质心路由
             
-            return "\n\n".join(parts)
+        Returns:
+            (文档, 相似度) 列表，按相似度从高到低排列，page_content 为文本块内容
+        """
+        with self._generation_gate.shared():
+            return self._retrieve_scored(query, k, user_id, courses)
+    
+    def _retrieve_scored(
+        self,
+        query: str,
+        k: int,
+        user_id: str,
+        courses: Optional[Sequence[str]]
+    ) -> List[Tuple[Document, float]]:
+        """retrieve_scored() 的实际实现"""
+        # 查询只向量化一次，路由、基础库分片和用户库检索共用
+        query_vector = self.embedding_function.embed_query(query)
         
-        # 构建 RAG 链
-        prompt_template = """You are a helpful assistant.
-Answer the question using ONLY the Context below.
-If the answer is not in the Context, say "I don't know based on the provided context."
+        # 基础库分片和提问用户自己的分区并行检索，各自有截止时间
+        searches = {"user": self._search_pool.submit(self._timed_search, "user", self._search_user, query_vector, k, user_id)}
+        if self.base_shards:
+            searches["base"] = self._search_pool.submit(
+                self._timed_search, "base", self._search_base, query_vector, k, courses
+            )
+        
+        candidates = {}
+        start = time.perf_counter()
+        for store, future in searches.items():
+            timeout = self.stage_timeouts.get(f"{store}_search")
+            remaining = None if timeout is None else max(0.0, start + timeout - time.perf_counter())
+            try:
+                candidates[store] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                # 降级：只用按时返回的库回答
+                with self._search_stats_lock:
+                    self.search_timeouts[store] += 1
+                logger.warning(f"⚠️ {store} 库检索超过 {timeout:.1f}s，本次只使用其他库的结果")
 
-Context:
-{context}
+        # TODO: 需要添加 reranking
+        scored = merge_top_k(candidates, k, self.store_quotas)
+        self.materialize_documents([doc for doc, _ in scored])
+        return scored
+    
+    def _timed_search(self, store: str, search: Callable, *args) -> List[Tuple[Document, float]]:
+        """执行检索并记录延迟（超时被放弃的检索仍计入延迟分布）"""
+        t0 = time.perf_counter()
+        result = search(*args)
+        self.search_latency[store].record(time.perf_counter() - t0)
+        return result
+    
+    def _search_user(self, query_vector: List[float], k: int, user_id: str) -> List[Tuple[Document, float]]:
+        """
+        在用户自己的分区中检索
+        
+        Returns:
+            (文档, 余弦相似度) 列表；分区为空或检索失败时返回空列表
+        """
+        try:
+            user_vectorstore = self.get_user_vectorstore(user_id)
+            # 检查用户库是否有内容
+            collection = user_vectorstore._collection
+            if collection.count() == 0:
+                return []
+            space = collection_space(collection)
+            return [
+                (doc, distance_to_similarity(distance, space))
+                for doc, distance in user_vectorstore.similarity_search_by_vector_with_relevance_scores(
+                    query_vector, k=k
+                )
+            ]
+        except Exception as e:
+            # 用户库可能为空，这是正常的
+            return []
+    
+    def retrieve(
+        self,
+        query: str,
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[Document]:
+        """
+        从基础库和提问用户的分区中检索相关文档
+        
+        Returns:
+            文档列表（按相似度从高到低，page_content 为文本块内容），参数同 retrieve_scored()
+        """
+        return [doc for doc, _ in self.retrieve_scored(query, k, user_id, courses)]
+    
+    async def aretrieve(
+        self,
+        query: str,
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[Document]:
+        """
+        retrieve() 的异步版本
+        
+        Chroma 的检索是同步阻塞调用，放到线程池执行，不阻塞事件循环
+        """
+        return await asyncio.to_thread(self.retrieve, query, k, user_id, courses)
+    
+    def batch_retrieve(
+        self,
+        queries: List[str],
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[List[Document]]:
+        """
+        批量检索
+        
+        Returns:
+            每个查询对应的文档列表，参数同 batch_retrieve_scored()
+        """
+        return [
+            [doc for doc, _ in scored]
+            for scored in self.batch_retrieve_scored(queries, k, user_id, courses)
+        ]
+    
+    def batch_retrieve_scored(
+        self,
+        queries: List[str],
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        批量检索：一次 embedding 请求向量化所有查询，每个被路由到的分片只做一次多查询检索
+        
+        结果与逐条调用 retrieve_scored() 相同（文本块内容已从页面存储取出）
+        
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的文档总数
+            user_id: 提问用户的 ID
+            courses: 只检索这些课程的基础库分片，None 表示按质心路由
+            
+        Returns:
+            每个查询对应的 (文档, 相似度) 列表，按相似度从高到低排列
+        """
+        if not queries:
+            return []
+        with self._generation_gate.shared():
+            return self._batch_retrieve_scored(queries, k, user_id, courses)
+    
+    def _batch_retrieve_scored(
+        self,
+        queries: List[str],
+        k: int,
+        user_id: str,
+        courses: Optional[Sequence[str]]
+    ) -> List[List[Tuple[Document, float]]]:
+        """batch_retrieve_scored() 的实际实现"""
 
-Question:
-{question}
-"""
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-        llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+        query_vectors = self.embedding_function.embed_queries(queries)
+        candidates: List[Dict[str, List[Tuple[Document, float]]]] = [{} for _ in queries]
         
-        rag_chain = (
-            {
-                "context": RunnableLambda(hybrid_retrieve) | RunnableLambda(format_docs_with_source),
-                "question": RunnablePassthrough()
+        if self.base_shards:
+            # 按路由结果把查询分组到各个分片
+            shard_queries: Dict[str, List[int]] = {}
+            for i, vector in enumerate(query_vectors):
+                for course in self.shard_router.route(vector, self.base_route_top_n, courses):
+                    if course in self.base_shards:
+                        shard_queries.setdefault(course, []).append(i)
+            
+            for course, indices in shard_queries.items():
+                collection = self.base_shards[course]._collection
+                space = collection_space(collection)
+                for i, shard_docs in zip(indices, _query_collection_with_distances(
+                    collection,
+                    [query_vectors[i] for i in indices],
+                    k
+                )):
+                    candidates[i].setdefault("base", []).extend(
+                        (doc, distance_to_similarity(distance, space)) for doc, distance in shard_docs
+                    )
+            
+            for per_store in candidates:
+                if "base" in per_store:
+                    per_store["base"] = sorted(per_store["base"], key=lambda item: item[1], reverse=True)[:k]
+        
+        collection = self.get_user_vectorstore(user_id)._collection
+        if collection.count() > 0:
+            space = collection_space(collection)
+            for per_store, user_docs in zip(candidates, _query_collection_with_distances(
+                collection, query_vectors, k
+            )):
+                per_store["user"] = [(doc, distance_to_similarity(distance, space)) for doc, distance in user_docs]
+        
+        results = [merge_top_k(per_store, k, self.store_quotas) for per_store in candidates]
+        self.materialize_documents([doc for scored in results for doc, _ in scored])
+        return results
+    
+    def materialize_documents(self, docs: List[Document]) -> List[Document]:
+        """
+        按偏移量从页面存储取出文本块内容，填入 page_content
+        
+        向量库中只保存偏移量的文本块（元数据包含 doc_id / start / end）才需要物化，
+        旧索引中自带文本的文本块保持不变
+        
+        Args:
+            docs: 检索得到的文档
+            
+        Returns:
+            同一个列表（原地填充）
+        """
+        for doc in docs:
+            metadata = doc.metadata
+            if doc.page_content or "doc_id" not in metadata or "start" not in metadata:
+                continue
+            store = self.user_page_store if metadata.get("source_type") == "user" else self.base_page_store
+            if store is None:
+                continue
+            text = store.get_span(metadata["doc_id"], metadata["page"], metadata["start"], metadata["end"])
+            if text is None:
+                logger.warning(f"⚠️ 页面存储中缺少 {metadata['doc_id']} p.{metadata['page']}")
+                continue
+            doc.page_content = text
+        return docs
+    
+    def format_context(self, docs: List[Document]) -> str:
+        """物化文本块内容并格式化为带来源标记的上下文"""
+        return format_docs_with_source(self.materialize_documents(docs))
+    
+    def get_latency_stats(self) -> dict:
+        """
+        获取各阶段的延迟、超时和对冲统计
+        
+        Returns:
+            {"embed": 查询 embedding 的调用统计, "base_search"/"user_search": 延迟分位数和超时（降级）次数,
+             "llm": 每一级模型的调用统计}
+        """
+        with self._search_stats_lock:
+            search_timeouts = dict(self.search_timeouts)
+        stats = {"embed": self.embed_caller.get_stats()}
+        for store, tracker in self.search_latency.items():
+            stats[f"{store}_search"] = {
+                "timeout": self.stage_timeouts.get(f"{store}_search"),
+                "timeouts": search_timeouts[store],
+                "latency": tracker.get_stats(),
             }
-            | prompt
-            | llm
+        stats["llm"] = {name: tier["hedging"] for name, tier in self.cascade.get_stats()["tiers"].items()}
+        return stats
+    
+    def get_cascade_stats(self) -> dict:
+        """
+        获取模型级联的统计信息
+        
+        Returns:
+            升级率、各原因的升级次数以及每一级的调用次数和平均延迟
+        """
+        return self.cascade.get_stats()
+    
+    def create_llm(self, tier: Optional[Dict] = None) -> ChatOpenAI:
+        """
+        创建用于回答问题的 LLM
+        
+        Args:
+            tier: 级联中的一级配置（model、可选 base_url），默认 gpt-3.5-turbo
+        """
+        tier = tier or {}
+        kwargs = {"base_url": tier["base_url"]} if tier.get("base_url") else {}
+        return ChatOpenAI(model_name=tier.get("model", "gpt-3.5-turbo"), temperature=0, **kwargs)
+    
+    def create_rag_chain(
+        self,
+        k: int = DEFAULT_TOP_K,
+        user_id: str = DEFAULT_USER_ID,
+        courses: Optional[Sequence[str]] = None
+    ):
+        """
+        创建 RAG 检索链
+        
+        检索结果的最高相似度和上下文长度决定从哪一级模型开始回答（见 model_cascade.py）
+        
+        Args:
+            k: 检索的文档总数（基础库和用户库合并）
+            user_id: 提问用户的 ID，只检索该用户的向量库分区
+            courses: 只检索这些课程的基础库分片，None 表示按质心路由
+            
+        Returns:
+            RAG chain（输入问题，输出回答消息）
+        """
+        # 创建混合检索器，同时记录检索置信度
+        def hybrid_retrieve(question: str) -> dict:
+            """从两个向量库中检索相关文档并构造上下文"""
+            scored = self.retrieve_scored(question, k=k, user_id=user_id, courses=courses)
+            return {
+                "question": question,
+                "context": self.format_context([doc for doc, _ in scored]),
+                "top_score": max((score for _, score in scored), default=None),
+            }
+        
+        async def ahybrid_retrieve(question: str) -> dict:
+            # 检索和从页面存储取文本都是同步调用，放到线程池执行
+            return await asyncio.to_thread(hybrid_retrieve, question)
+        
+        prompt = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+        
+        def generate(inputs: dict):
+            prompt_value = prompt.invoke({"context": inputs["context"], "question": inputs["question"]})
+            return self.cascade.invoke(prompt_value, inputs["top_score"], len(inputs["context"]))
+        
+        async def agenerate(inputs: dict):
+            prompt_value = await prompt.ainvoke({"context": inputs["context"], "question": inputs["question"]})
+            return await self.cascade.ainvoke(prompt_value, inputs["top_score"], len(inputs["context"]))
+        
+        # 构建 RAG 链
+        rag_chain = (
+            RunnableLambda(hybrid_retrieve, afunc=ahybrid_retrieve)
+            | RunnableLambda(generate, afunc=agenerate)
         )
         
         return rag_chain
 
+
+def create_rag_from_env(**kwargs) -> DualVectorStoreRAG:
+    """
+    按环境变量 EMBEDDING_BACKEND / EMBEDDING_MODEL / EMBEDDING_DIMENSIONS / LLM_CASCADE（JSON）/
+    RETRIEVAL_QUOTAS（JSON，如 {"base": 1}）/ RAG_STAGE_TIMEOUTS（JSON）/ RAG_HEDGE_STAGES /
+    RAG_PROFILE_* 创建 RAG 系统
+    
+    Streamlit 应用和命令行工具共用，保证使用同一套 embedding 配置。
+    索引根目录中有代指针（见 migration.py）时，向量库目录和 embedding 配置以当前代为准，
+    代指针之后的切换由 refresh_generation() 在进程内生效
+    
+    Args:
+        index_root: 索引根目录，默认 ./chroma_db
+        **kwargs: 传给 DualVectorStoreRAG 的其他参数
+        
+    Returns:
+        DualVectorStoreRAG 实例
+    """
+    index_root = kwargs.pop("index_root", DEFAULT_INDEX_ROOT)
+    generation = active_generation(index_root)
+    if "base_persist_dir" not in kwargs and "user_persist_dir" not in kwargs:
+        # 目录由代指针决定时，运行中也跟随代指针切换（见 DualVectorStoreRAG.refresh_generation()）
+        kwargs.setdefault("index_root", index_root)
+    if generation and "base_persist_dir" not in kwargs and "user_persist_dir" not in kwargs:
+        embedding = generation["embedding"]
+        if os.environ.get("EMBEDDING_BACKEND", embedding["backend"]) != embedding["backend"] or \
+                os.environ.get("EMBEDDING_MODEL", embedding["model"]) != embedding["model"]:
+            logger.warning(f"EMBEDDING_* environment is ignored; serving embedding generation {generation['id']}")
+        kwargs["base_persist_dir"] = generation["base_persist_dir"]
+        kwargs["user_persist_dir"] = generation["user_persist_dir"]
+        kwargs.setdefault("embedding_backend", embedding["backend"])
+        kwargs.setdefault("embedding_model", embedding["model"])
+        kwargs.setdefault("embedding_dimensions", embedding.get("dimensions"))
+    kwargs.setdefault("embedding_backend", os.environ.get("EMBEDDING_BACKEND", "openai"))
+    kwargs.setdefault("embedding_model", os.environ.get("EMBEDDING_MODEL"))
+    if os.environ.get("EMBEDDING_DIMENSIONS"):
+        kwargs.setdefault("embedding_dimensions", int(os.environ["EMBEDDING_DIMENSIONS"]))
+    if os.environ.get("LLM_CASCADE"):
+        kwargs.setdefault("llm_tiers", json.loads(os.environ["LLM_CASCADE"]))
+    if os.environ.get("RETRIEVAL_QUOTAS"):
+        kwargs.setdefault("store_quotas", json.loads(os.environ["RETRIEVAL_QUOTAS"]))
+    if os.environ.get("RAG_STAGE_TIMEOUTS"):
+        kwargs.setdefault("stage_timeouts", json.loads(os.environ["RAG_STAGE_TIMEOUTS"]))
+    if "RAG_HEDGE_STAGES" in os.environ:
+        kwargs.setdefault("hedge_stages", [
+            stage.strip() for stage in os.environ["RAG_HEDGE_STAGES"].split(",") if stage.strip()
+        ])
+    if "profiler" not in kwargs:
+        kwargs["profiler"] = create_profiler_from_env()
+    return DualVectorStoreRAG(**kwargs)
@@ -0,0 +1,392 @@
+"""
+用户库对账与压缩模块
+交叉核对每个用户的三处状态，清理不一致留下的孤儿数据：
+
+- 元数据：UserUploads/<uid>/document_metadata.json
+- 磁盘文件：UserUploads/<uid>/ 下的上传文件
+- 索引：用户分区 collection 中的文本块 ID（"<file_id>::<序号>" 或 "<file_id>::p<页码>-<序号>"）、文本块注册表和页面存储
+
+典型的不一致：
+- 索引成功但保存元数据失败：文本块留在向量库，界面上看不到，也无法删除
+- delete_document 成功但 remove_user_document 失败：同上
+- 上传后索引失败或进程中断：文件留在磁盘上，没有元数据
+- 文件丢失或删除了一半：元数据指向不存在的文件，或元数据存在但没有文本块
+
+清理以 file_id 为单位：文档在元数据、磁盘文件和索引三处都齐全才保留，否则整体删除。
+修改时间在 min_age_seconds 之内的文件视为上传或索引仍在进行，不做处理。
+没有对应上传目录的用户分区整体删除。
+
+按用户分区之前的旧版数据没有归属信息，无法分配给任何用户，也一并清理：
+共享的旧用户库 collection（LangChain 默认的 "langchain"）、直接放在 UserUploads/ 下的上传文件和
+document_metadata.json，以及名称不是应用签发的 uuid4 的上传目录（旧版接受任意 uid，这些 ID 可以被猜到）。
+清理后对 Chroma 和页面存储的 SQLite 文件执行 VACUUM，
+并按大小上限淘汰页面文本缓存（见 page_cache.py）。
+
+默认只输出报告（dry run），--apply 时才删除：
+    python reconcile.py
+    python reconcile.py --apply --min-age-minutes 60
+
+--apply 会删除 collection 并对 SQLite 文件执行 VACUUM，需要用户库目录的独占锁（见 file_lock.py）；
+应用运行时持有共享锁，此时 --apply 直接退出，需先停止应用。dry run 可以随时运行。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+from typing import Dict, List, Optional, Set, Tuple
+
+from document_manager import DocumentManager
+from chunk_registry import chunk_page
+from utils import is_valid_user_id
+
+logger = logging.getLogger(__name__)
+
+# 默认的上传根目录（每个用户一个子目录）
+DEFAULT_UPLOAD_ROOT = "UserUploads"
+
+# Chroma 持久化目录中的 SQLite 文件名
+CHROMA_SQLITE_FILE = "chroma.sqlite3"
+
+# 每批删除的文本块数量
+DELETE_BATCH_SIZE = 1000
+
+
+def _collection_file_ids(collection, batch_size: int = 1000) -> Dict[str, List[str]]:
+    """
+    按 file_id 分组读取 collection 中的文本块 ID
+
+    以元数据中的 file_id 为准（早期版本的文本块 ID 是随机 UUID），缺失时取 ID 中 "::" 之前的部分
+    """
+    chunks: Dict[str, List[str]] = {}
+    offset = 0
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+            file_id = (metadata or {}).get("file_id") or chunk_id.rsplit("::", 1)[0]
+            chunks.setdefault(file_id, []).append(chunk_id)
+        offset += len(batch["ids"])
+    return chunks
+
+
+def _chunk_order(chunk_id: str) -> Tuple[int, int]:
+    """文本块排序键：(页码, 序号)，兼容 "<file_id>::<序号>" 和按页编号的 "<file_id>::p<页码>-<序号>" """
+    suffix = chunk_id.rsplit("::", 1)[-1]
+    page = chunk_page(chunk_id)
+    try:
+        if page is not None:
+            return page, int(suffix.split("-", 1)[1])
+        return 0, int(suffix)
+    except (IndexError, ValueError):
+        return 0, 0
+
+
+def vacuum_sqlite(path: str) -> Optional[Dict[str, int]]:
+    """
+    对 SQLite 文件执行 VACUUM，回收删除数据占用的空间
+
+    Args:
+        path: SQLite 文件路径
+
+    Returns:
+        {"before": 字节数, "after": 字节数}；文件不存在时返回 None
+    """
+    if not os.path.exists(path):
+        return None
+    before = os.path.getsize(path)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return {"before": before, "after": os.path.getsize(path)}
+
+
+def reconcile_user(
+    rag,
+    upload_dir: str,
+    user_id: str,
+    apply: bool = False,
+    min_age_seconds: float = 3600,
+    now: Optional[float] = None
+) -> Dict:
+    """
+    核对一个用户的元数据、磁盘文件和索引
+
+    Args:
+        rag: DualVectorStoreRAG 实例
+        upload_dir: 该用户的上传目录
+        user_id: 用户 ID
+        apply: 是否实际删除
+        min_age_seconds: 比这更新的文件视为仍在处理，跳过
+        now: 当前时间戳（默认 time.time()）
+
+    Returns:
+        该用户的报告：每类问题的 file_id 列表和删除的文本块数量
+    """
+    now = now or time.time()
+    manager = DocumentManager(upload_dir=upload_dir)
+    metadata = {meta['file_id']: meta for meta in manager.list_documents()}
+    metadata_name = os.path.basename(manager.metadata_file)
+    files = {
+        name for name in os.listdir(upload_dir)
+        if os.path.isfile(os.path.join(upload_dir, name)) and name != metadata_name
+    }
+
+    collection = rag.get_user_vectorstore(user_id)._collection
+    chunks = _collection_file_ids(collection)
+    registry = rag.get_chunk_registry(user_id)
+    registered = set(registry.file_ids())
+    page_prefix = rag.user_doc_id("", user_id)
+    paged = {
+        doc_id[len(page_prefix):] for doc_id in rag.user_page_store.doc_ids()
+        if doc_id.startswith(page_prefix)
+    }
+
+    def file_path(file_id: str) -> str:
+        meta = metadata.get(file_id)
+        return meta['filepath'] if meta and meta.get('filepath') else os.path.join(upload_dir, file_id)
+
+    def in_progress(file_id: str) -> bool:
+        path = file_path(file_id)
+        return os.path.exists(path) and now - os.path.getmtime(path) < min_age_seconds
+
+    report = {
+        "indexed_without_metadata": [],
+        "metadata_without_file": [],
+        "metadata_without_chunks": [],
+        "files_without_metadata": [],
+        "registry_repaired": [],
+        "skipped_in_progress": [],
+        "removed_chunks": 0,
+    }
+    orphans: Set[str] = set()
+    for file_id in sorted(set(metadata) | files | set(chunks) | registered | paged):
+        has_meta = file_id in metadata
+        has_file = os.path.exists(file_path(file_id))
+        has_chunks = file_id in chunks
+        if has_meta and has_file and has_chunks:
+            # 文档完整；注册表缺失或过期时按 collection 中的 ID 修复
+            # （后台分批索引中的文档注册表与 collection 暂时不一致，跳过）
+            if sorted(registry.get(file_id)) != sorted(chunks[file_id]):
+                if in_progress(file_id):
+                    report["skipped_in_progress"].append(file_id)
+                    continue
+                report["registry_repaired"].append(file_id)
+                if apply:
+                    registry.register(
+                        file_id, sorted(chunks[file_id], key=_chunk_order), coverage=registry.get_coverage(file_id)
+                    )
+            continue
+        if in_progress(file_id):
+            report["skipped_in_progress"].append(file_id)
+            continue
+        if not has_meta and (has_chunks or file_id in registered or file_id in paged):
+            report["indexed_without_metadata"].append(file_id)
+        elif not has_meta:
+            report["files_without_metadata"].append(file_id)
+        elif not has_file:
+            report["metadata_without_file"].append(file_id)
+        else:
+            report["metadata_without_chunks"].append(file_id)
+        orphans.add(file_id)
+
+    report["removed_chunks"] = sum(len(chunks.get(file_id, [])) for file_id in orphans)
+    if not apply or not orphans:
+        return report
+
+    # 批量删除文本块，再清理注册表、页面、文件和元数据
+    orphan_chunk_ids = [chunk_id for file_id in sorted(orphans) for chunk_id in chunks.get(file_id, [])]
+    for i in range(0, len(orphan_chunk_ids), DELETE_BATCH_SIZE):
+        collection.delete(ids=orphan_chunk_ids[i:i + DELETE_BATCH_SIZE])
+    for file_id in orphans:
+        if file_id in registered:
+            registry.remove(file_id)
+        if file_id in paged:
+            rag.user_page_store.delete_doc(rag.user_doc_id(file_id, user_id))
+        path = file_path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+    if orphans & set(metadata):
+        success, error = manager.remove_document_metadata(sorted(orphans & set(metadata)))
+        if not success:
+            logger.warning(f"⚠️ {upload_dir}: {error}")
+    return report
+
+
+def reconcile(
+    rag,
+    upload_root: str = DEFAULT_UPLOAD_ROOT,
+    apply: bool = False,
+    min_age_seconds: float = 3600,
+    compact: bool = True
+) -> Dict:
+    """
+    核对所有用户，删除没有上传目录的用户分区，并压缩存储
+
+    Args:
+        rag: DualVectorStoreRAG 实例（用户库按当前 embedding 代打开）
+        upload_root: 上传根目录
+        apply: 是否实际删除（False 时只生成报告）
+        min_age_seconds: 比这更新的文件视为仍在处理
+        compact: apply 时是否对 SQLite 文件执行 VACUUM 并淘汰超出上限的页面文本缓存
+
+    Returns:
+        {"users": {uid: 报告}, "unknown_collections": [...], "legacy": {...}, "totals": {...}, "compaction": {...}}
+
+    Raises:
+        ValueError: apply 时 rag 只持有共享的索引锁（其他进程可能正打开同一个用户库）
+    """
+    from rag_system import user_collection_name, DEFAULT_USER_ID
+
+    if apply and rag.index_lock_mode == "shared":
+        raise ValueError("Applying a reconcile needs the exclusive index lock (index_lock=\"exclusive\")")
+
+    now = time.time()
+    entries = sorted(os.listdir(upload_root)) if os.path.isdir(upload_root) else []
+    user_ids = [
+        name for name in entries
+        if os.path.isdir(os.path.join(upload_root, name)) and is_valid_user_id(name)
+    ]
+    # 旧版数据：不是 uuid4 的上传目录、直接放在上传根目录下的文件
+    legacy = {
+        "user_dirs": [
+            name for name in entries
+            if os.path.isdir(os.path.join(upload_root, name)) and not is_valid_user_id(name)
+        ],
+        "upload_files": [name for name in entries if os.path.isfile(os.path.join(upload_root, name))],
+        "collections": [],
+    }
+    if apply:
+        for name in legacy["user_dirs"]:
+            shutil.rmtree(os.path.join(upload_root, name), ignore_errors=True)
+        for name in legacy["upload_files"]:
+            os.remove(os.path.join(upload_root, name))
+
+    users = {}
+    for user_id in user_ids:
+        users[user_id] = reconcile_user(
+            rag, os.path.join(upload_root, user_id), user_id, apply, min_age_seconds, now
+        )
+
+    # 没有上传目录的分区无法对应到任何元数据，整体视为孤儿（默认用户的分区供命令行工具使用，保留）
+    known = {user_collection_name(user_id) for user_id in user_ids + [DEFAULT_USER_ID]}
+    client = rag.get_user_vectorstore()._client
+    unknown = []
+    removed = set()
+    for name in sorted(getattr(c, "name", c) for c in client.list_collections()):
+        if not name.startswith("user-"):
+            # 按用户分区之前所有用户共享的 collection
+            legacy["collections"].append({"collection": name, "chunks": client.get_collection(name).count()})
+            if apply:
+                client.delete_collection(name)
+            continue
+        if name in known:
+            continue
+        count = client.get_collection(name).count()
+        unknown.append({"collection": name, "chunks": count})
+        if apply:
+            client.delete_collection(name)
+            removed.add(name)
+            registry_file = os.path.join(rag.user_persist_dir, f"{name}.chunks.json")
+            for path in (registry_file, f"{registry_file}.lock"):
+                if os.path.exists(path):
+                    os.remove(path)
+    orphan_pages = [
+        doc_id for doc_id in rag.user_page_store.doc_ids()
+        if doc_id.split("/", 1)[0] not in known
+    ]
+    if apply:
+        for doc_id in orphan_pages:
+            rag.user_page_store.delete_doc(doc_id)
+        # 被删除的分区句柄可能仍在缓存中，清空后按需重新打开
+        with rag._user_stores_lock:
+            rag._user_vectorstores.clear()
+        # 注册表文件已删除的分区同时丢弃缓存的注册表，其他分区的注册表保留
+        with rag._registries_lock:
+            for user_id in [u for u in rag._chunk_registries if user_collection_name(u) in removed]:
+                rag._chunk_registries.pop(user_id)
+
+    categories = ("indexed_without_metadata", "metadata_without_file", "metadata_without_chunks",
+                  "files_without_metadata", "registry_repaired", "skipped_in_progress")
+    totals = {category: sum(len(report[category]) for report in users.values()) for category in categories}
+    totals["removed_chunks"] = (
+        sum(report["removed_chunks"] for report in users.values())
+        + sum(item["chunks"] for item in unknown)
+    )
+    totals["unknown_collections"] = len(unknown)
+    totals["orphan_page_docs"] = len(orphan_pages)
+    totals["legacy_items"] = sum(len(items) for items in legacy.values())
+
+    compaction = {}
+    if apply and compact:
+        for path in (
+            os.path.join(rag.user_persist_dir, CHROMA_SQLITE_FILE),
+            rag.user_page_store.db_path,
+        ):
+            try:
+                result = vacuum_sqlite(path)
+                if result:
+                    compaction[path] = result
+            except sqlite3.OperationalError as e:
+                # 其他进程正在写入时 VACUUM 会失败，下次运行再压缩
+                logger.warning(f"⚠️ 压缩 {path} 失败：{str(e)}")
+                compaction[path] = {"error": str(e)}
+        if rag.page_cache is not None:
+            compaction[rag.page_cache.cache_dir] = {"evicted": rag.page_cache.prune()}
+
+    return {
+        "apply": apply,
+        "users": {user_id: report for user_id, report in users.items()
+                  if any(report[category] for category in categories)},
+        "unknown_collections": unknown,
+        "legacy": legacy,
+        "totals": totals,
+        "compaction": compaction,
+    }
+
+
+def main():
+    from rag_system import create_rag_from_env
+    from utils import ensure_openai_api_key
+    from file_lock import FileLockError
+
+    parser = argparse.ArgumentParser(description="Reconcile user metadata, uploaded files and the user vector store")
+    parser.add_argument("--upload-root", default=DEFAULT_UPLOAD_ROOT)
+    parser.add_argument("--apply", action="store_true", help="实际删除孤儿数据（默认只输出报告）")
+    parser.add_argument("--min-age-minutes", type=float, default=60, help="更新的文件视为仍在处理，不做清理")
+    parser.add_argument("--no-compact", action="store_true", help="不执行 VACUUM")
+    args = parser.parse_args()
+
+    ensure_openai_api_key()
+    try:
+        rag = create_rag_from_env(base_artifact_path=None, index_lock="exclusive" if args.apply else "shared")
+    except FileLockError:
+        print("❌ The app (or another tool) has the user index open; stop it before running with --apply", file=sys.stderr)
+        sys.exit(1)
+    report = reconcile(
+        rag,
+        upload_root=args.upload_root,
+        apply=args.apply,
+        min_age_seconds=args.min_age_minutes * 60,
+        compact=not args.no_compact
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    totals = report["totals"]
+    verb = "Removed" if args.apply else "Would remove"
+    print(
+        f"{'✅' if args.apply else '🔍'} {verb} {totals['removed_chunks']} orphan chunks, "
+        f"{totals['unknown_collections']} unknown partitions, {totals['orphan_page_docs']} orphan page docs, "
+        f"{totals['legacy_items']} legacy shared-store items",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
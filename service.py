@@ -0,0 +1,262 @@
+"""
+异步服务模块
+在一个后台事件循环上提供问答和文档索引服务，一个进程内可同时服务多个客户端（会话）
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, Optional, Sequence, Tuple
+from rag_system import DualVectorStoreRAG, DEFAULT_USER_ID, DEFAULT_TOP_K
+
+logger = logging.getLogger(__name__)
+
+
+class WarmingUpError(RuntimeError):
+    """基础知识库仍在加载，问答请求等待超时"""
+
+    def __init__(self, status: Dict):
+        """
+        Args:
+            status: 抛出时的加载状态（见 RAGService.warmup_status()）
+        """
+        super().__init__("Base knowledge base is still loading")
+        self.status = status
+
+
+class RAGService:
+    """
+    RAG 异步服务
+
+    - 问答使用 chain.ainvoke，LLM 请求在事件循环上并发执行；相同问题的并发请求合并为一次
+    - 索引、删除等阻塞操作放到线程池执行
+    - 通过信号量限制同时进行的问答和索引数量
+
+    事件循环运行在独立的守护线程上。异步客户端可以直接 await 各个协程方法；
+    Streamlit 等同步客户端通过 run() 提交协程并等待结果。
+
+    基础向量库通过 start_warmup() 在后台加载，加载期间上传和文档管理照常可用；
+    问答请求排队等待加载完成，超过 warmup_wait 秒时抛出 WarmingUpError。
+
+    RAG 系统设置了 index_root 时，每 generation_poll_interval 秒检查一次代指针，
+    embedding 迁移切换索引代后在进程内生效（见 DualVectorStoreRAG.refresh_generation()）。
+    """
+
+    def __init__(
+        self,
+        rag: DualVectorStoreRAG,
+        max_concurrent_queries: int = 32,
+        max_concurrent_ingestions: int = 2,
+        warmup_wait: float = 3.0,
+        generation_poll_interval: Optional[float] = 5.0
+    ):
+        """
+        Args:
+            rag: RAG 系统
+            max_concurrent_queries: 同时进行的问答上限
+            max_concurrent_ingestions: 同时进行的文档索引上限
+            warmup_wait: 基础库加载期间问答请求最多等待的秒数（同步客户端会一直阻塞到这里，保持较短）
+            generation_poll_interval: 检查代指针的间隔（秒），None 表示不检查
+        """
+        self.rag = rag
+        self.max_concurrent_queries = max_concurrent_queries
+        self.max_concurrent_ingestions = max_concurrent_ingestions
+        self.warmup_wait = warmup_wait
+
+        self._warmup: Optional[Future] = None
+        self._warmup_lock = threading.Lock()
+        self._warmup_status: Dict = {"state": "cold", "phase": None, "progress": None,
+                                     "base_doc_count": 0, "error": None}
+        self._warmup_started: Optional[float] = None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="rag-service", daemon=True)
+        self._thread.start()
+        # 信号量需要在事件循环所在线程上创建
+        self._query_semaphore = self.run(self._create_semaphore(max_concurrent_queries))
+        self._ingest_semaphore = self.run(self._create_semaphore(max_concurrent_ingestions))
+        if rag.index_root and generation_poll_interval:
+            self.submit(self._watch_generation(generation_poll_interval))
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @staticmethod
+    async def _create_semaphore(value: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(value)
+
+    async def _watch_generation(self, interval: float):
+        """定期检查代指针，索引代切换后在进程内生效"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.rag.refresh_generation)
+            except Exception as e:
+                logger.error(f"❌ 切换索引代失败：{str(e)}")
+
+    # ==================== 同步客户端接口 ====================
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        把协程提交到服务的事件循环
+
+        Args:
+            coro: 协程
+
+        Returns:
+            concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        提交协程并阻塞等待结果（供同步客户端使用）
+
+        Args:
+            coro: 协程
+            timeout: 超时时间（秒）
+
+        Returns:
+            协程的返回值
+        """
+        return self.submit(coro).result(timeout=timeout)
+
+    # ==================== 基础库预热 ====================
+    def start_warmup(self) -> Future:
+        """
+        在后台开始加载基础向量库（重复调用返回同一个任务）
+
+        Returns:
+            concurrent.futures.Future，结果为加载的文档数量
+        """
+        with self._warmup_lock:
+            if self._warmup is None:
+                self._warmup_started = time.perf_counter()
+                self._warmup_status.update(state="loading", phase="starting")
+                self._warmup = self.submit(self._warm())
+            return self._warmup
+
+    async def _warm(self) -> int:
+        try:
+            count = await asyncio.to_thread(self.rag.initialize_base_vectorstore, self._on_warmup_progress)
+        except Exception as e:
+            logger.error(f"❌ 基础知识库加载失败：{str(e)}")
+            self._update_warmup(state="failed", error=str(e))
+            return 0
+        self._update_warmup(state="ready", phase=None, progress=None, base_doc_count=count)
+        logger.info(f"Base knowledge base ready: {count} docs in {time.perf_counter() - self._warmup_started:.1f}s")
+        return count
+
+    def _on_warmup_progress(self, event: Dict):
+        progress = None
+        if event.get("files"):
+            progress = event["files_parsed"] / event["files"]
+        self._update_warmup(phase=event["phase"], progress=progress, chunks=event.get("chunks"))
+
+    def _update_warmup(self, **fields):
+        with self._warmup_lock:
+            self._warmup_status.update(fields)
+
+    def warmup_status(self) -> Dict:
+        """
+        获取基础库加载状态
+
+        Returns:
+            state（"cold"、"loading"、"ready"、"failed"）、phase（见
+            DualVectorStoreRAG.initialize_base_vectorstore()）、progress（0~1，未知时为 None）、
+            base_doc_count、error 和已用时间 elapsed_seconds
+        """
+        with self._warmup_lock:
+            status = dict(self._warmup_status)
+        if self._warmup_started is not None:
+            status["elapsed_seconds"] = round(time.perf_counter() - self._warmup_started, 1)
+        return status
+
+    @property
+    def is_ready(self) -> bool:
+        """基础库是否已加载完成（加载失败也视为完成，此时只检索用户文档）"""
+        return self.warmup_status()["state"] in ("ready", "failed")
+
+    # ==================== 服务接口 ====================
+    async def initialize(self) -> int:
+        """
+        初始化基础向量库（等待后台加载完成）
+
+        Returns:
+            加载的文档数量
+        """
+        return await asyncio.wrap_future(self.start_warmup())
+
+    async def ask(
+        self,
+        question: str,
+        user_id: str = DEFAULT_USER_ID,
+        k: int = DEFAULT_TOP_K,
+        courses: Optional[Sequence[str]] = None
+    ) -> str:
+        """
+        回答问题
+
+        Args:
+            question: 问题
+            user_id: 提问用户的 ID
+            k: 检索的文档总数（基础库和用户库合并）
+            courses: 只检索这些课程的资料，None 表示自动路由
+
+        Returns:
+            回答文本
+
+        Raises:
+            WarmingUpError: 基础库在 warmup_wait 秒内未加载完成
+        """
+        if not self.is_ready:
+            # 基础库加载期间问题排队等待，超时后由客户端提示稍后再试
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.start_warmup())), self.warmup_wait)
+            except asyncio.TimeoutError:
+                raise WarmingUpError(self.warmup_status())
+        # 相同问题的并发请求在 RAG 系统中合并，只有实际执行的请求占用并发名额
+        return await self.rag.aanswer(
+            question,
+            k=k,
+            user_id=user_id,
+            courses=courses,
+            semaphore=self._query_semaphore
+        )
+
+    async def ingest(
+        self,
+        file_path: str,
+        original_filename: str,
+        upload_time: str,
+        file_size: int,
+        file_id: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID
+    ) -> Tuple[bool, str, int]:
+        """
+        索引用户上传的文档
+
+        Returns:
+            (是否成功, 消息, 添加的文本块数量)
+        """
+        async with self._ingest_semaphore:
+            return await asyncio.to_thread(
+                self.rag.add_user_document,
+                file_path=file_path,
+                original_filename=original_filename,
+                upload_time=upload_time,
+                file_size=file_size,
+                file_id=file_id,
+                user_id=user_id
+            )
+
+    async def remove_document(self, file_id: str, user_id: str = DEFAULT_USER_ID) -> Tuple[bool, str]:
+        """
+        从用户向量库删除文档
+
+        Returns:
+            (是否成功, 消息)
+        """
+        return await asyncio.to_thread(self.rag.remove_user_document, file_id, user_id)
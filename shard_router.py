@@ -0,0 +1,173 @@
+"""
+基础库分片路由模块
+基础向量库按课程目录分片，每个课程一个 collection；
+路由器保存每个分片的质心向量，查询时只检索与问题最相关的前 N 个分片
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 分片清单文件（位于基础向量库目录中）
+SHARD_MANIFEST_FILE = "shards.json"
+
+# 直接放在基础文档目录根下的文件归入的课程
+DEFAULT_COURSE = "General"
+
+
+def course_of(file_path: str, base_docs_dir: str) -> str:
+    """
+    根据文件在基础文档目录中的位置确定所属课程（第一级子目录名）
+
+    Args:
+        file_path: PDF 文件路径
+        base_docs_dir: 基础文档目录
+
+    Returns:
+        课程名称
+    """
+    parts = os.path.relpath(file_path, base_docs_dir).split(os.sep)
+    return parts[0] if len(parts) > 1 else DEFAULT_COURSE
+
+
+def shard_collection_name(course: str) -> str:
+    """
+    生成课程分片的 collection 名称
+
+    Chroma 要求名称由字母、数字、_ 和 - 组成且首尾为字母数字，
+    不合法的字符替换为 -，并附加短哈希避免不同课程名清洗后冲突
+
+    Args:
+        course: 课程名称
+
+    Returns:
+        collection 名称
+    """
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", course).strip("-_")[:40] or "course"
+    course_hash = hashlib.md5(course.encode("utf-8")).hexdigest()[:8]
+    return f"base-{slug}-{course_hash}"
+
+
+def collection_centroid(collection, batch_size: int = 1000) -> Optional[List[float]]:
+    """
+    计算 collection 中所有向量的质心（单位化后的平均方向）
+
+    Args:
+        collection: Chroma collection
+        batch_size: 每次读取的向量数量
+
+    Returns:
+        质心向量；collection 为空时返回 None
+    """
+    total = None
+    offset = 0
+    while True:
+        batch = collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+        embeddings = batch.get("embeddings")
+        if embeddings is None or len(embeddings) == 0:
+            break
+        vectors = np.asarray(embeddings, dtype=np.float64)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        total = vectors.sum(axis=0) if total is None else total + vectors.sum(axis=0)
+        offset += len(vectors)
+    if total is None:
+        return None
+    return (total / (np.linalg.norm(total) + 1e-12)).tolist()
+
+
+class ShardRouter:
+    """
+    按质心相似度选择要检索的课程分片
+
+    分片清单（shards.json）记录每个课程的 collection 名称、文本块数量和质心向量
+    """
+
+    def __init__(self, manifest_path: str):
+        """
+        Args:
+            manifest_path: 分片清单文件路径
+        """
+        self.manifest_path = manifest_path
+        self.shards: Dict[str, Dict] = {}
+        self._courses: List[str] = []
+        self._centroids = np.zeros((0, 0), dtype=np.float32)
+
+    def load(self) -> bool:
+        """
+        加载分片清单
+
+        Returns:
+            清单存在且可解析时返回 True
+        """
+        if not os.path.exists(self.manifest_path):
+            return False
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                shards = json.load(f)["shards"]
+        except Exception as e:
+            logger.warning(f"Failed to read shard manifest {self.manifest_path}: {e}")
+            return False
+        self._set_shards(shards)
+        return True
+
+    def save(self, shards: Dict[str, Dict]):
+        """
+        保存分片清单（先写临时文件再原子替换）
+
+        Args:
+            shards: {课程: {"collection", "chunks", "centroid"}}
+        """
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"shards": shards}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        self._set_shards(shards)
+
+    def _set_shards(self, shards: Dict[str, Dict]):
+        self.shards = shards
+        self._courses = [course for course, info in sorted(shards.items()) if info.get("centroid")]
+        if self._courses:
+            self._centroids = np.asarray(
+                [shards[course]["centroid"] for course in self._courses],
+                dtype=np.float32
+            )
+        else:
+            self._centroids = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def courses(self) -> List[str]:
+        """所有分片的课程名称（按名称排序）"""
+        return sorted(self.shards)
+
+    def route(
+        self,
+        query_vector: Sequence[float],
+        top_n: int,
+        courses: Optional[Sequence[str]] = None
+    ) -> List[str]:
+        """
+        选择要检索的分片
+
+        Args:
+            query_vector: 查询向量
+            top_n: 最多检索的分片数量，0 或负数表示检索全部
+            courses: 用户显式指定的课程；指定时只检索这些课程，不再按质心筛选
+
+        Returns:
+            课程名称列表（按相关度从高到低）
+        """
+        if courses:
+            return [course for course in courses if course in self.shards]
+        if top_n <= 0 or len(self._courses) <= top_n:
+            return self.courses
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = self._centroids @ (query / (np.linalg.norm(query) + 1e-12))
+        order = np.argsort(-scores)[:top_n]
+        return [self._courses[i] for i in order]
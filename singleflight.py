@@ -0,0 +1,129 @@
+"""
+请求合并模块
+相同键的并发请求只执行一次，所有等待者共享同一个结果（或异常）
+
+同步调用方和异步调用方可以合并到同一次执行：进行中的请求用
+concurrent.futures.Future 表示，异步等待者通过 asyncio.wrap_future 等待。
+请求完成后立即移除，不缓存结果。
+
+只有普通异常（Exception）会传给等待者；执行者被取消或中断（CancelledError、
+KeyboardInterrupt 等）时异常只在执行者中抛出，进行中的请求被移除，
+等待者重新加入，由其中一个成为新的执行者。
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Abandoned(Exception):
+    """执行者被取消或中断，等待者需要重新加入"""
+
+
+class SingleFlight:
+    """合并相同键的并发请求，并统计合并率"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self.requests = 0
+        self.executions = 0
+
+    def _join(self, key: Hashable, retry: bool = False) -> Tuple[Future, bool]:
+        """返回键对应的 Future，以及调用方是否需要负责执行（retry 为 True 时不重复计入请求数）"""
+        with self._lock:
+            if not retry:
+                self.requests += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.executions += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None, error: BaseException = None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # 取消和中断只属于执行者自己，等待者收到 _Abandoned 后重试
+            future.set_exception(_Abandoned())
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        执行或加入相同键的进行中请求（同步）
+
+        Args:
+            key: 请求键
+            fn: 实际执行的函数
+
+        Returns:
+            fn 的返回值
+
+        Raises:
+            Exception: fn 抛出的异常（所有等待者都会收到）
+        """
+        future, leader = self._join(key)
+        while not leader:
+            try:
+                return future.result()
+            except _Abandoned:
+                future, leader = self._join(key, retry=True)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def ado(self, key: Hashable, coro_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入相同键的进行中请求（异步）
+
+        Args:
+            key: 请求键
+            coro_fn: 返回协程的函数
+
+        Returns:
+            协程的返回值
+        """
+        future, leader = self._join(key)
+        while not leader:
+            try:
+                # shield：等待者被取消时不能取消共享的 Future
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _Abandoned:
+                future, leader = self._join(key, retry=True)
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def get_stats(self) -> dict:
+        """
+        获取合并统计
+
+        Returns:
+            请求数、实际执行数、被合并的请求数、合并率和当前进行中的请求数
+        """
+        with self._lock:
+            coalesced = self.requests - self.executions
+            return {
+                "requests": self.requests,
+                "executions": self.executions,
+                "coalesced": coalesced,
+                "coalescing_ratio": coalesced / self.requests if self.requests else 0.0,
+                "in_flight": len(self._in_flight),
+            }
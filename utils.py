@@ -4,10 +4,14 @@
 """
 
 import os
+import json
+import uuid
 import hashlib
+import logging
 from datetime import datetime
 from typing import Optional, Tuple
-import streamlit as st
+
+logger = logging.getLogger(__name__)
 
 
 def generate_unique_filename(original_filename: str) -> str:
@@ -47,6 +51,45 @@ def calculate_file_hash(file_content: bytes) -> str:
     return hashlib.sha256(file_content).hexdigest()
 
 
+def calculate_path_hash(filepath: str, block_size: int = 1024 * 1024) -> str:
+    """
+    分块读取并计算磁盘文件的 SHA256 哈希值
+    
+    Args:
+        filepath: 文件路径
+        block_size: 每次读取的字节数
+        
+    Returns:
+        SHA256 哈希值（十六进制字符串）
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def is_valid_user_id(user_id: Optional[str]) -> bool:
+    """
+    检查用户 ID 是否为应用签发的格式（uuid4 的 32 位小写十六进制形式）
+    
+    用户 ID 就是访问该用户分区的凭据，只接受随机生成、无法猜测的 ID
+    
+    Args:
+        user_id: 用户 ID
+        
+    Returns:
+        格式合法时返回 True
+    """
+    if not user_id or len(user_id) != 32:
+        return False
+    try:
+        parsed = uuid.UUID(hex=user_id)
+    except ValueError:
+        return False
+    return parsed.hex == user_id and parsed.version == 4
+
+
 def validate_pdf_file(uploaded_file, max_size_mb: int = 50) -> Tuple[bool, Optional[str]]:
     """
     验证上传的 PDF 文件
@@ -117,7 +160,7 @@ def get_directory_size(directory: str) -> int:
                 if os.path.exists(filepath):
                     total_size += os.path.getsize(filepath)
     except Exception as e:
-        st.warning(f"⚠️ 无法计算目录大小：{str(e)}")
+        logger.warning(f"⚠️ 无法计算目录大小：{str(e)}")
     return total_size
 
 
@@ -140,3 +183,27 @@ def safe_remove_file(filepath: str) -> Tuple[bool, Optional[str]]:
     except Exception as e:
         return False, f"删除失败：{str(e)}"
 
+
+def ensure_openai_api_key(config_file: str = "config.json") -> bool:
+    """
+    确保环境变量中有 OpenAI API Key（供命令行工具使用）
+    
+    优先使用环境变量 OPENAI_API_KEY，否则从 config.json 读取
+    
+    Args:
+        config_file: 本地配置文件路径
+        
+    Returns:
+        是否找到 API Key
+    """
+    if os.environ.get('OPENAI_API_KEY'):
+        return True
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            openai_key = json.load(f).get("OpenAIAPIKey")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    if openai_key:
+        os.environ['OPENAI_API_KEY'] = openai_key
+        return True
+    return False